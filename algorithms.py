@@ -28,6 +28,9 @@ import numpy as np
 from numpy import linalg as LA
 from sklearn.cross_decomposition import CCA
 
+from mcee import (as_compute, trca_core, sine_reference, cca_kernel, dsp_core,
+                  di1, di2, di3, di4, di5)
+
 def trca_compute(Xin, subspace_idx=None):
     '''
     task-related component analysis (TRCA)
@@ -43,37 +46,17 @@ def trca_compute(Xin, subspace_idx=None):
             (n_channels * n_channels)
     '''
     # print('Now, algorithm TRCA is running...')
-    n_chans = Xin.shape[0]
-    n_epochs = Xin.shape[2]
-
     # zero means
     values_mean = Xin.mean(axis=1, keepdims=True)
     # Xin_std = Xin.std(axis=1, ddof=1, keepdims=True)
     Xin = (Xin-values_mean)  # /Xin_std
 
-    S = np.zeros((n_chans, n_chans))
-    # computation of correlation matrices
-    for epoch_i in range(n_epochs):
-        for epoch_j in range(n_epochs):
-            Xin_i = Xin[:,:,epoch_i]
-            Xin_j = Xin[:,:,epoch_j]
-            S += np.dot(Xin_i, Xin_j.T)
-
-    Xin_i2 = Xin.reshape((Xin.shape[0], -1), order='F')
-    Xin_i2 = Xin_i2 - Xin_i2.mean(axis=1, keepdims=True)
-    Q = np.dot(Xin_i2, Xin_i2.T)
-
-    eig_vals, eig_vectors = LA.eig(np.dot(LA.inv(Q),S)) # or LA.pinv for general
-
-    eig_vectors = eig_vectors[:, eig_vals.argsort()[::-1]] # return indices in ascending order and reverse
-
-    eig_vals.sort()
-    eig_vals = eig_vals[::-1] # sort in descending order
+    # S sums over all epoch pairs (i==j included); solved by the shared TRCA core
+    eig_vals, eig_vectors = trca_core(Xin.transpose((2, 0, 1))[np.newaxis, ...],
+                                      n_components=subspace_idx, include_self=True)
+    eig_vals, eig_vectors = eig_vals[0], eig_vectors[0].T
     # print('Now, algorithm TRCA is finished.')
 
-    eig_vals = eig_vals if subspace_idx is None else eig_vals[:subspace_idx]
-    eig_vectors = eig_vectors if subspace_idx is None else eig_vectors[:,:subspace_idx]
-
     return eig_vals, eig_vectors
 
 def cca_manu(Xin, Yin):
@@ -93,41 +76,10 @@ def cca_manu(Xin, Yin):
         Yin = Yin.mean(axis=-1, keepdims=False)
 
     # print('Now, algorithm cca_manu is running...')
-    Xin -= Xin.mean(axis=1, keepdims=True)
-    Yin -= Yin.mean(axis=1, keepdims=True)
-    cov_xx = np.cov(Xin, rowvar=True, bias=False)
-    cov_yy = np.cov(Yin, rowvar=True, bias=False)
-    # cross covariance
-    cov_xy = np.dot(Xin, Yin.T)/(Xin.shape[1]-1)
-    # cov_yx = cov_xy.T
-
-    # eps = np.finfo(cov_xx.dtype).eps
-    # cov_xx = np.maximum(cov_xx, eps)
-    # cov_yy = np.maximum(cov_yy, eps)
-    # cov_xy = np.maximum(cov_xy, eps)
-    # inv_2_xx = LA.inv(cov_xx**0.5)
-    # inv_2_yy = LA.inv(cov_yy**0.5)
-
-    U, sigma_xx, VT = LA.svd(cov_xx)
-    sigma_xx = sigma_xx**(-0.5)
-    inv_2_xx = U.dot(np.diag(sigma_xx)).dot(VT)
-
-    U, sigma_yy, VT = LA.svd(cov_yy)
-    sigma_yy = sigma_yy**(-0.5)
-    inv_2_yy = U.dot(np.diag(sigma_yy)).dot(VT)
-
-    M = inv_2_xx.dot(cov_xy).dot(inv_2_yy)
-    U, sigma_M, VT = LA.svd(M)
-
-    eig_vectors_x = inv_2_xx.dot(U)
-    eig_vectors_y = inv_2_yy.dot(VT.T)
-
-    # compute correlation coeficient
-    X_proj = np.dot(eig_vectors_x.T, Xin)
-    Y_proj = np.dot(eig_vectors_y.T, Yin)
-    rr_coef = np.zeros((X_proj.shape[0]))
-    for i in range(X_proj.shape[0]):
-        rr_coef[i] = np.corrcoef(X_proj[i,:], Y_proj[i,:])[0,1]
+    # thin-QR & SVD kernel; weights scaled to w.T @ cov @ w = I as the covariance whitening did
+    rr_coef, eig_vectors_x, eig_vectors_y = cca_kernel(Xin, Yin, weights=True)
+    eig_vectors_x = as_compute(eig_vectors_x * np.sqrt(Xin.shape[1]-1))
+    eig_vectors_y = as_compute(eig_vectors_y * np.sqrt(Yin.shape[1]-1))
     # print('Now, algorithm cca_manu is finished.')
 
     return eig_vectors_x, eig_vectors_y, rr_coef
@@ -158,6 +110,7 @@ def extended_cca(Xtest, Xtrain, freq_stim, fs, t_begin, t_end, n_hf=5, init_phas
     '''
     if t_begin > t_end:
         raise ValueError('t_begin should be less than t_end.')
+    Xtrain, Xtest = as_compute(Xtrain), as_compute(Xtest)
     if Xtrain.ndim == 3:
         Xtrain = Xtrain.mean(axis=-1, keepdims=False)
 
@@ -166,17 +119,12 @@ def extended_cca(Xtest, Xtrain, freq_stim, fs, t_begin, t_end, n_hf=5, init_phas
     Xtest -= Xtest.mean(axis=1, keepdims=True)
 
     init_phase = 0 if init_phase is None else init_phase
-    t1 = np.ceil(fs*t_begin)
-    t2 = np.ceil(fs*t_end)
-    t_time = np.arange(t1, t2+1, 1)/fs
-
-    # generate sin-cos template
-    Yf = None
-    for idx_hf in range(1, n_hf+1):
-        sin_tmp = np.sin(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        cos_tmp = np.cos(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        Yf_tmp = np.vstack((sin_tmp, cos_tmp)).T
-        Yf = Yf_tmp if Yf is None else np.hstack((Yf, Yf_tmp))  # n_time * n_chans
+    t1 = int(np.ceil(fs*t_begin))
+    t2 = int(np.ceil(fs*t_end))
+
+    # sin-cos template from the reference bank (phase unit: pi)
+    Yf = as_compute(sine_reference(freq_stim, n_hf, t2-t1+1, init_phase/np.pi, fs,
+                                   start=t1).signal.T)  # n_time * n_chans
 
     # recognition by extended CCA
     n_chans, n_features = Xtrain.shape
@@ -240,6 +188,7 @@ def extended_cca2(Xtest, Xtrain, freq_stim, fs, t_begin, t_end, n_hf=5, init_pha
     '''
     if t_begin > t_end:
         raise ValueError('t_begin should be less than t_end.')
+    Xtrain, Xtest = as_compute(Xtrain), as_compute(Xtest)
     if Xtrain.ndim == 3:
         Xtrain = Xtrain.mean(axis=-1, keepdims=False)
 
@@ -248,17 +197,11 @@ def extended_cca2(Xtest, Xtrain, freq_stim, fs, t_begin, t_end, n_hf=5, init_pha
     Xtest -= Xtest.mean(axis=1, keepdims=True)
 
     init_phase = 0 if init_phase is None else init_phase
-    t1 = np.ceil(fs*t_begin)
-    t2 = np.ceil(fs*t_end)
-    t_time = np.arange(t1, t2+1, 1)/fs
-
-    # generate sin-cos template
-    Yf = None
-    for idx_hf in range(1, n_hf+1):
-        sin_tmp = np.sin(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        cos_tmp = np.cos(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        Yf_tmp = np.vstack((sin_tmp, cos_tmp)).T
-        Yf = Yf_tmp if Yf is None else np.hstack((Yf, Yf_tmp))
+    t1 = int(np.ceil(fs*t_begin))
+    t2 = int(np.ceil(fs*t_end))
+
+    # sin-cos template from the reference bank (phase unit: pi)
+    Yf = as_compute(sine_reference(freq_stim, n_hf, t2-t1+1, init_phase/np.pi, fs, start=t1).signal.T)
 
     # recognition by extended CCA
     n_chans, n_features = Xtrain.shape
@@ -327,20 +270,16 @@ def standard_cca(Xtest, freq_stim, fs, t_begin, t_end, n_hf=5, init_phase=None,
         raise ValueError('Xtest should be 2-D array instead of 3D')
 
     # zero means
+    Xtest = as_compute(Xtest)
     Xtest -= Xtest.mean(axis=1, keepdims=True)
 
     init_phase = 0 if init_phase is None else init_phase
-    t1 = np.ceil(fs*t_begin)
-    t2 = np.ceil(fs*t_end)
-    t_time = np.arange(t1, t2+1, 1)/fs
-
-    # generate sin-cos template
-    Yf = None
-    for idx_hf in range(1, n_hf+1):
-        sin_tmp = np.sin(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        cos_tmp = np.cos(2*np.pi*freq_stim*idx_hf*t_time+init_phase)
-        Yf_tmp = np.vstack((sin_tmp, cos_tmp)).T
-        Yf = Yf_tmp if Yf is None else np.hstack((Yf, Yf_tmp))  # n_time * n_chans
+    t1 = int(np.ceil(fs*t_begin))
+    t2 = int(np.ceil(fs*t_end))
+
+    # sin-cos template from the reference bank (phase unit: pi)
+    Yf = as_compute(sine_reference(freq_stim, n_hf, t2-t1+1, init_phase/np.pi, fs,
+                                   start=t1).signal.T)  # n_time * n_chans
 
     # recognition by extended CCA
     n_chans, n_features = Xtest.shape
@@ -373,36 +312,11 @@ def dsp_compute(Xclass1, Xclass2):
     if Xclass1.shape[0] != Xclass2.shape[0] or Xclass1.shape[1] != Xclass2.shape[1]:
         raise ValueError('The selected channels or sample points of two classes should be SAME.')
 
-    # print('Now, algorithm DSP is running...')
-    template_1 = Xclass1.mean(axis=2, keepdims=False)
-    template_2 = Xclass2.mean(axis=2, keepdims=False)
-    X_buff = np.vstack((template_1, template_2))
+    # scatter matrices & GEP solved by the shared N-class DSP core
+    eig_vals, eig_vectors = dsp_core([Xclass1.transpose((2, 0, 1)), Xclass2.transpose((2, 0, 1))],
+                                     n_components=None)
 
-    cov_all = np.cov(X_buff, rowvar=True, bias=False)
-    cov11 = cov_all[:template_1.shape[0], :template_1.shape[0]] # covariance of variables in Class1
-    cov22 = cov_all[template_1.shape[0]:, template_1.shape[0]:] # covariance of variables in Class2
-    cov12 = cov_all[:template_1.shape[0], template_1.shape[0]:] # covariance of variables between Class1 and Class2
-    cov21 = cov_all[template_1.shape[0]:, :template_1.shape[0]] # covariance of variables between Class2 and Class1
-    S_B = cov11 + cov22 - cov12 - cov21 # the between-class scatter matrix
-
-    covB = np.empty((Xclass1.shape[0], Xclass1.shape[0], Xclass1.shape[2]))
-    for i in range(Xclass1.shape[2]):
-        covB[:,:,i] = np.cov((Xclass1[:,:,i]-template_1))
-    cov_b1 = covB.mean(axis=-1, keepdims=False)
-
-    for i in range(Xclass2.shape[2]):
-        covB[:,:,i] = np.cov((Xclass2[:,:,i]-template_2))
-    cov_b2 = covB.mean(axis=-1, keepdims=False)
-    S_W = cov_b1 + cov_b2
-
-    eig_vals, eig_vectors = LA.eig(np.dot(LA.inv(S_W),S_B))
-    eig_vectors = eig_vectors[:, eig_vals.argsort()[::-1]] # return indices in ascending order and reverse
-
-    eig_vals.sort()
-    eig_vals = eig_vals[::-1] # sort in descending order
-    # print('Now, algorithm DSP is finished.')
-
-    return eig_vals, eig_vectors
+    return eig_vals, eig_vectors.T
 
 def dcpm_compute(Xclass1, Xclass2, Xtest, dsp_idx=None, cca_idx=None, cca_rr_idx=None):
     '''
@@ -419,65 +333,37 @@ def dcpm_compute(Xclass1, Xclass2, Xtest, dsp_idx=None, cca_idx=None, cca_rr_idx
     :param cca_rr_idx: int
         extract first cca_rr_idx values for coefficient of CCA. If None, set default values (half).
     :return:
+        rr_coef: ndarray
+            (2 * 5 * n_epochs), the five discrimination indices of each class
+            (2D correlation, negative Euclidean distance, CCA coefficient,
+            correlation of CCA filtered patterns with the template/test filter).
     '''
     if Xtest.ndim < 2:
         raise ValueError('Xtest should be equal to or greater than two dimensions.')
 
-    # print('Now, algorithm DCPM is running...')
     dsp_vals, dsp_vectors = dsp_compute(Xclass1, Xclass2)
 
     dsp_idx = int(dsp_idx) if dsp_idx is not None else int(np.round(Xclass1.shape[0]/2))
+    cca_idx = int(cca_idx) if cca_idx is not None else max(int(np.round(dsp_idx/2)), 1)
+    cca_rr_idx = int(cca_rr_idx) if cca_rr_idx is not None else max(int(np.round(dsp_idx/2)), 1)
     if Xclass1.ndim == 3:
         Xclass1 = Xclass1.mean(axis=-1)
     if Xclass2.ndim == 3:
         Xclass2 = Xclass2.mean(axis=-1)
-    Xclass1 = Xclass1 - Xclass1.mean(axis=-1, keepdims=True)
-    Xclass2 = Xclass2 - Xclass2.mean(axis=-1, keepdims=True)
-
-    # average points across trials projected on feature subspaces of DSP
-    template_1 = np.dot(dsp_vectors[:,:dsp_idx].T, Xclass1) # out: (dsp_idx * n_times)
-    template_2 = np.dot(dsp_vectors[:,:dsp_idx].T, Xclass2) # out: (dsp_idx * n_times)
-
-    # zero means
-    if Xtest.ndim == 3:
-        dim_idx = Xtest.shape[-1]
-        Xtest = Xtest - Xtest.mean(axis=1, keepdims=True)
-    else:
-        dim_idx = 1
-        Xtest = Xtest - Xtest.mean(axis=-1, keepdims=True)
-
-    rr_coef = np.zeros((2,5,dim_idx))
-    for i in range(dim_idx):
-        test_data = np.dot(dsp_vectors[:,:dsp_idx].T, Xtest[:,:,i]) # out: (dsp_idx * n_times)
-
-        rr_coef[0,0,i] = np.corrcoef(template_1.reshape((1,-1)), test_data.reshape((1,-1)))[0,1] # p11
-        rr_coef[1,0,i] = np.corrcoef(template_2.reshape((1,-1)), test_data.reshape((1,-1)))[0,1] # p21
-        rr_coef[0,1,i] = np.cov(template_1-test_data).diagonal().mean() # p12
-        rr_coef[1,1,i] = np.cov(template_2-test_data).diagonal().mean() # p22
-
-        U_class1, _, V_test1, _, rr1 = cca_manu(template_1, test_data)
-        U_class2, _, V_test2, _, rr2 = cca_manu(template_2, test_data)
-
-        cca_rr_idx = int(cca_rr_idx) if cca_rr_idx is not None else int(np.round(rr1.shape[1]/2))
-        cca_idx = int(cca_idx) if cca_idx is not None else int(np.round(U_class1.shape[1]/2))
-        rr_coef[0,2,i] = rr1[0, :cca_rr_idx].mean() # p13
-        rr_coef[1,2,i] = rr2[0, :cca_rr_idx].mean() # p23
-
-        buff1 = U_class1[:, :cca_idx].T.dot(template_1).reshape((1,-1))
-        buff2 = U_class1[:, :cca_idx].T.dot(test_data).reshape((1,-1))
-        rr_coef[0,3,i] = np.corrcoef(buff1, buff2)[0,1] # p14
-
-        buff1 = U_class2[:, :cca_idx].T.dot(template_2).reshape((1,-1))
-        buff2 = U_class2[:, :cca_idx].T.dot(test_data).reshape((1,-1))
-        rr_coef[1,3,i] = np.corrcoef(buff1, buff2)[0,1] # p24
-
-        buff1 = V_test1[:, :cca_idx].T.dot(template_1).reshape((1,-1))
-        buff2 = V_test1[:, :cca_idx].T.dot(test_data).reshape((1,-1))
-        rr_coef[0,4,i] = np.corrcoef(buff1, buff2)[0,1] # p15
-
-        buff1 = V_test2[:, :cca_idx].T.dot(template_2).reshape((1,-1))
-        buff2 = V_test2[:, :cca_idx].T.dot(test_data).reshape((1,-1))
-        rr_coef[1,4,i] = np.corrcoef(buff1, buff2)[0,1] # p25
+    if Xtest.ndim == 2:
+        Xtest = Xtest[..., np.newaxis]
+
+    # average points across trials & all test epochs projected on feature subspaces of DSP
+    w = as_compute(dsp_vectors[:, :dsp_idx].T)
+    templates = np.einsum('fc,mct->mft', w, as_compute(np.stack((Xclass1, Xclass2))))[:, np.newaxis, ...]
+    test_data = np.einsum('fc,cti->ift', w, as_compute(Xtest))
+
+    rr_coef = np.zeros((2, 5, Xtest.shape[-1]))
+    rr_coef[:, 0] = di1(templates, test_data)              # p11, p21
+    rr_coef[:, 1] = di2(templates, test_data)              # p12, p22
+    rr_coef[:, 2] = di3(templates, test_data, cca_rr_idx)  # p13, p23
+    rr_coef[:, 3] = di4(templates, test_data, cca_idx)     # p14, p24
+    rr_coef[:, 4] = di5(templates, test_data, cca_idx)     # p15, p25
 
     # rr_coef = rr_coef.sum(axis=1, keepdims=False)
     return  rr_coef
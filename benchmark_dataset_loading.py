@@ -27,6 +27,7 @@ from mne.filter import filter_data
 from sklearn.linear_model import LinearRegression
 
 import signal_processing_function as SPF 
+import epoch_store
 
 #%% prevent ticking 'F5'
 ???
@@ -67,22 +68,14 @@ del v, k, file, line       # release RAM
      
 
 #%% Load multiple data file & also can be used to process multiple data
-# CAUTION: may lead to RAM crash (5-D array takes more than 6125MB)
-# Now I know why people need 32G's RAM...PLEASE SKIP THIS PART!!!
+# one-time conversion into memmap epoch stores (one .mat in RAM at a time),
+# then every subject is opened lazily: only sliced channels/points are read
 filepath = r'E:\dataset\data'
-
-filelist = []
-for file in os.listdir(filepath):
-    full_path = os.path.join(filepath, file)
-    filelist.append(full_path)
-
-i = 0
-eeg = np.zeros((35, 64, 1500, 40, 6))
-for file in filelist:
-    temp = io.loadmat(file)
-    eeg[i,:,:,:,:] = temp['data']
-    i += 1
-    
-# add more codes here to achieve multiple data processing (PLEASE DON'T)
-    
-del temp, i, file, filelist, filepath, full_path
+storepath = r'E:\dataset\store'
+if not os.path.isdir(storepath):
+    epoch_store.convert_folder(filepath, storepath, layout='benchmark', sfreq=250,
+                               info=r'E:\dataset\Freq_Phase.mat')
+stores = epoch_store.open_folder(storepath)  # {subject: (40, 6, 64, 1500) memmap}
+
+# e.g. occipital channels of all subjects: (35, 40, 6, 9, 1500), ~0.9GB instead of 6GB
+# eeg = np.stack([store.load(chans=[53,54,55,56,57,58,60,61,62]) for store in stores.values()])
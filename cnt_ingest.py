@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel ingestion of Neuroscan .cnt recordings into epoch stores
+
+Replaces the read_raw_cnt -> concatenate_raws -> Epochs (event by event) ->
+filter_data (event by event) -> savemat routine copied in data_preprocessing,
+data_preprocessing_single, dp_for_drm and boruikang_loadData:
+    (1) scan: headers & annotations of all files (no data loaded), so the
+        output shape and the (event, trial) slot of every epoch are known
+    (2) ingest: files are read in a process pool, epochs are cut from the raw
+        buffer with one fancy index, all epochs of a file are filtered in one
+        batched filter_data call and written straight into the memmap stores
+        (see epoch_store) at their slots
+    (3) command line entry point
+
+Epochs crossing a file boundary or the recording's edges are dropped (as
+Epochs does for concatenated raws), events are ordered by their annotation
+description and trials by file order.
+
+Example:
+    python cnt_ingest.py D:\\SSVEP\\dataset\\code_VEP\\wuqiaoyi -o D:\\store\\wuqiaoyi
+        --tmin -1 --tmax 1 --l-freq 50 --h-freq 70 --drop M1 M2 --n-jobs 8 --keep-raw --mat
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+from numpy import newaxis as NA
+import scipy.io as io
+
+import mne
+from mne.filter import filter_data
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import epoch_store
+
+_CNT_KWARGS = {'eog':['HEO', 'VEO'], 'emg':['EMG'], 'ecg':['EKG'], 'verbose':False}
+
+# %% Epoching
+def epoch_index(samples, tmin, tmax, sfreq):
+    '''
+    Sample indices of epochs (tmax included, like mne.Epochs)
+
+    Parameters
+    ----------
+    samples : (n_epochs,)
+        onsets of events (in points of the raw buffer).
+    tmin, tmax : float
+        time range around events (s).
+    sfreq : float
+        sampling frequency.
+
+    Returns
+    -------
+    index : (n_epochs, n_times)
+    '''
+    start = int(round(tmin*sfreq))
+    stop = int(round(tmax*sfreq))
+    return np.asarray(samples)[:, NA] + np.arange(start, stop+1)
+
+def cut_epochs(data, samples, tmin, tmax, sfreq):
+    '''
+    Cut epochs from a raw buffer with one fancy index
+
+    Parameters
+    ----------
+    data : (n_chans, n_points)
+        raw data.
+    samples : (n_epochs,)
+        onsets of events.
+
+    Returns
+    -------
+    epochs : (n_epochs, n_chans, n_times)
+    '''
+    return data[:, epoch_index(samples, tmin, tmax, sfreq)].transpose((1, 0, 2))
+
+def _sort_key(description):
+    return (0, int(description)) if description.strip().isdigit() else (1, description)
+
+# %% Scan
+def list_cnt(paths):
+    '''.cnt files of the given files/folders, folders sorted by name.'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, file) for file in sorted(os.listdir(path))
+                      if file.lower().endswith('.cnt')]
+        else:
+            files.append(path)
+    return files
+
+def scan(files, tmin, tmax, drop_chans=(), event_ids=None):
+    '''
+    Plan the ingestion from headers & annotations only
+
+    Parameters
+    ----------
+    files : list of str
+        .cnt files, in the order of concatenation.
+    tmin, tmax : float
+        time range around events (s).
+    drop_chans : list, optional
+        EEG channels to exclude (e.g. ['M1', 'M2']).
+    event_ids : list of str, optional
+        annotation descriptions used as events, in output order.
+        The default is None (all descriptions, sorted).
+
+    Returns
+    -------
+    plan : dict
+        chan_info, sfreq, event_ids, n_trials & jobs
+        (file, samples, event index, trial index of each epoch).
+    '''
+    if not files:
+        raise ValueError('No .cnt file to ingest.')
+    headers = []
+    for file in files:
+        raw = mne.io.read_raw_cnt(file, preload=False, **_CNT_KWARGS)
+        picks = mne.pick_types(raw.info, emg=False, eeg=True, stim=False, eog=False,
+                               exclude=list(drop_chans))
+        chan_info = [raw.ch_names[i] for i in picks]
+        sfreq = raw.info['sfreq']
+        onsets = raw.time_as_index(raw.annotations.onset, use_rounding=True,
+                                   origin=raw.annotations.orig_time)  # as events_from_annotations
+        descriptions = [str(d) for d in raw.annotations.description]
+        headers.append((file, chan_info, sfreq, np.asarray(onsets, dtype=int), descriptions, raw.n_times))
+
+    chan_info, sfreq = headers[0][1], headers[0][2]
+    for file, chans, sf, onsets, descriptions, n_points in headers[1:]:
+        if chans != chan_info or sf != sfreq:
+            raise ValueError('Channels or sampling rate of %s differ from %s.' % (file, headers[0][0]))
+    if event_ids is None:
+        event_ids = sorted(set(sum([h[4] for h in headers], [])), key=_sort_key)
+    event_ids = [str(ei) for ei in event_ids]
+
+    # slot of every epoch: trials counted per event in file order
+    counts = np.zeros((len(event_ids)), dtype=int)
+    index = epoch_index(np.zeros((1), dtype=int), tmin, tmax, sfreq)[0]
+    jobs = []
+    for file, chans, sf, onsets, descriptions, n_points in headers:
+        events, trials, samples = [], [], []
+        for onset, description in zip(onsets, descriptions):
+            if description not in event_ids:
+                continue
+            if onset + index[0] < 0 or onset + index[-1] >= n_points:
+                continue  # out of the recording
+            ne = event_ids.index(description)
+            events.append(ne)
+            trials.append(counts[ne])
+            samples.append(onset)
+            counts[ne] += 1
+        jobs.append((file, np.array(samples, dtype=int), np.array(events, dtype=int),
+                     np.array(trials, dtype=int)))
+    n_trials = int(counts.min()) if len(counts) else 0  # equal trials per event
+    return {'chan_info':chan_info, 'sfreq':sfreq, 'event_ids':event_ids,
+            'n_trials':n_trials, 'counts':counts.tolist(), 'jobs':jobs}
+
+# %% Ingest
+def _ingest_file(file, samples, events, trials, chan_info, tmin, tmax, outputs, fir):
+    # worker: read one file, cut, filter & write its epochs
+    if samples.size == 0:
+        return 0
+    raw = mne.io.read_raw_cnt(file, preload=True, **_CNT_KWARGS)
+    data = raw.get_data(picks=chan_info) * 1e6   # uV, (n_chans, n_points)
+    sfreq = raw.info['sfreq']
+    epochs = cut_epochs(data, samples, tmin, tmax, sfreq)
+    del data
+    if 'raw' in outputs:
+        store = epoch_store.EpochStore(outputs['raw'], mode='r+')
+        store.data[events, trials] = epochs
+        store.data.flush()
+    if 'filtered' in outputs:
+        l_freq, h_freq, method = fir
+        store = epoch_store.EpochStore(outputs['filtered'], mode='r+')
+        store.data[events, trials] = filter_data(epochs, sfreq=sfreq, l_freq=l_freq,
+            h_freq=h_freq, method=method, n_jobs=1, verbose=False)
+        store.data.flush()
+    return samples.size
+
+def ingest(files, out_path, tmin, tmax, l_freq=None, h_freq=None, method='fir',
+           drop_chans=(), event_ids=None, keep_raw=False, dtype='float64', n_jobs=1):
+    '''
+    Ingest .cnt files into epoch stores
+
+    Parameters
+    ----------
+    files : list of str
+        .cnt files, in the order of concatenation.
+    out_path : str
+        path of the output store. Without filtering it holds raw epochs,
+        otherwise filtered epochs (raw epochs go to out_path + '_raw' if keep_raw).
+    tmin, tmax : float
+        time range around events (s).
+    l_freq, h_freq : float, optional
+        band of filter_data. The default is None (no filtering).
+    method : str, optional
+        'fir' or 'iir'. The default is 'fir'.
+    drop_chans : list, optional
+        EEG channels to exclude. The default is ().
+    event_ids : list of str, optional
+        annotation descriptions used as events. The default is None (all).
+    keep_raw : bool, optional
+        also store unfiltered epochs. The default is False.
+    dtype : optional
+        stored dtype. The default is 'float64'.
+    n_jobs : int, optional
+        number of worker processes, -1 means all processors. The default is 1.
+
+    Returns
+    -------
+    stores : dict, {'raw'/'filtered': EpochStore}
+    '''
+    plan = scan(files, tmin, tmax, drop_chans, event_ids)
+    shape = (len(plan['event_ids']), plan['n_trials'], len(plan['chan_info']),
+             epoch_index([0], tmin, tmax, plan['sfreq']).shape[1])
+    meta = {'event_ids':plan['event_ids'], 'tmin':tmin, 'files':list(files)}
+    filtering = l_freq is not None or h_freq is not None
+    outputs = {}
+    if filtering:
+        outputs['filtered'] = out_path
+        if keep_raw:
+            outputs['raw'] = out_path + '_raw'
+    else:
+        outputs['raw'] = out_path
+    for kind, path in outputs.items():
+        extra = {'filter':[l_freq, h_freq, method]} if kind == 'filtered' else {}
+        epoch_store.create(path, shape, plan['chan_info'], plan['sfreq'], dtype, **meta, **extra)
+
+    args = []
+    for file, samples, events, trials in plan['jobs']:
+        keep = trials < plan['n_trials']  # extra trials of unbalanced events
+        args.append((file, samples[keep], events[keep], trials[keep], plan['chan_info'],
+                     tmin, tmax, outputs, (l_freq, h_freq, method)))
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    n_jobs = max(1, min(n_jobs, len(args)))
+    if n_jobs == 1:
+        for arg in args:
+            _ingest_file(*arg)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_ingest_file, *zip(*args)))
+    return {kind:epoch_store.EpochStore(path) for kind, path in outputs.items()}
+
+def export_mat(store, mat_path, key='f_data'):
+    '''Save a store in the .mat layout of the analysis scripts ({key, 'chan_info'}).'''
+    io.savemat(mat_path, {key:np.asarray(store.data), 'chan_info':store.chans})
+
+# %% Command line
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest Neuroscan .cnt files into epoch stores')
+    parser.add_argument('inputs', nargs='+', help='.cnt files or folders of .cnt files')
+    parser.add_argument('-o', '--out', required=True, help='path of the output store')
+    parser.add_argument('--tmin', type=float, default=-1.)
+    parser.add_argument('--tmax', type=float, default=1.)
+    parser.add_argument('--l-freq', type=float, default=None)
+    parser.add_argument('--h-freq', type=float, default=None)
+    parser.add_argument('--method', default='fir', choices=['fir', 'iir'])
+    parser.add_argument('--drop', nargs='*', default=[], help='channels to exclude, e.g. M1 M2')
+    parser.add_argument('--events', nargs='*', default=None, help='annotation descriptions to keep')
+    parser.add_argument('--keep-raw', action='store_true', help='also store unfiltered epochs')
+    parser.add_argument('--dtype', default='float64')
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--mat', action='store_true', help='also export .mat files')
+    args = parser.parse_args(argv)
+
+    stores = ingest(list_cnt(args.inputs), args.out, args.tmin, args.tmax, args.l_freq,
+                    args.h_freq, args.method, args.drop, args.events, args.keep_raw,
+                    args.dtype, args.n_jobs)
+    for kind, store in stores.items():
+        print('%s: %s %s' % (kind, store.path, store.shape))
+        if args.mat:
+            export_mat(store, store.path + '.mat', 'f_data' if kind == 'filtered' else 'data')
+
+if __name__ == '__main__':
+    main()
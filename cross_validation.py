@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-validation harness for target identification algorithms
+
+1. Fold plans: lists of (train_trials, test_trials) on the trial axis
+    (1) kfold: contiguous test blocks (e.g. 6 folds of 10 trials)
+    (2) leave_one_block_out: one recording block as test set per fold
+    (3) random_repeats: random shuffles (e.g. 20 repeats in slice_analysis)
+2. srca_dataset: SRCA filtered dataset computed once for all folds
+    (SRCA is fitted on each trial's own rest state, so it is fold-invariant)
+3. cross_validate: run recognizers (from mcee) on every fold
+    datasets are shared with worker processes through memmap, folds run in
+    parallel and each accuracy is streamed into a csv results table
+
+Example:
+    folds = kfold(n_trials=60, n_folds=6)
+    datasets = {'origin':f_data[..., tar_chan_index, 1140:],
+                'srca':srca_dataset(f_data, tar_chans, model_chans, chans)}
+    recognizers = [('ori_trca', 'origin', mcee.TRCA),
+                   ('ori_strca', 'origin', partial(mcee.split_TRCA, 600)),
+                   ('srca_trca', 'srca', mcee.TRCA)]
+    acc = cross_validate(datasets, folds, recognizers, n_jobs=8, results='acc.csv')
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+
+import os
+import csv
+import time
+import shutil
+import tempfile
+import inspect
+from concurrent.futures import (ProcessPoolExecutor, as_completed)
+
+import mcee
+
+# %% Fold plans
+def kfold(n_trials, n_folds):
+    '''
+    Contiguous k-fold plan
+
+    Parameters
+    ----------
+    n_trials : int
+        number of trials per event.
+    n_folds : int
+        number of folds.
+
+    Returns
+    -------
+    folds : list of (train_trials, test_trials)
+    '''
+    test_blocks = np.array_split(np.arange(n_trials), n_folds)
+    return [(np.setdiff1d(np.arange(n_trials), test), test) for test in test_blocks]
+
+def leave_one_block_out(blocks):
+    '''
+    Leave-one-block-out plan
+
+    Parameters
+    ----------
+    blocks : (n_trials,)
+        block label of each trial.
+
+    Returns
+    -------
+    folds : list of (train_trials, test_trials)
+    '''
+    blocks = np.asarray(blocks)
+    return [(np.flatnonzero(blocks != b), np.flatnonzero(blocks == b)) for b in np.unique(blocks)]
+
+def random_repeats(n_trials, n_train, n_test=None, n_repeats=20, seed=0):
+    '''
+    Random shuffle plan
+
+    Parameters
+    ----------
+    n_trials : int
+        number of trials per event.
+    n_train : int
+        number of training trials.
+    n_test : int, optional
+        number of test trials. The default is None, i.e. the rest trials.
+    n_repeats : int, optional
+        number of shuffles. The default is 20.
+    seed : int, optional
+        random seed, which makes the plan reproducible. The default is 0.
+
+    Returns
+    -------
+    folds : list of (train_trials, test_trials)
+    '''
+    rng = np.random.default_rng(seed)
+    if n_test is None:
+        n_test = n_trials - n_train
+    folds = []
+    for nr in range(n_repeats):
+        order = rng.permutation(n_trials)
+        folds.append((order[:n_train], order[n_trials-n_test:]))
+    return folds
+
+# %% Fold-invariant intermediates
+def srca_dataset(data, tar_chans, model_chans, chans, regression='OLS', sp=1140):
+    '''
+    Apply one SRCA model to all trials of all events at once
+
+    Parameters
+    ----------
+    data : (n_events, n_trials, n_chans, n_times)
+        whole dataset.
+    tar_chans : list
+        names of target channels.
+    model_chans : list
+        names of SRCA channels for all target channels.
+    chans : list
+        names of all channels.
+    regression : str, optional
+        OLS, Ridge, Lasso or ElasticNet. The default is 'OLS'.
+    sp : int, optional
+        start point of mission state. The default is 1140.
+
+    Returns
+    -------
+    f_data : (n_events, n_trials, n_tar_chans, n_times-sp)
+        SRCA filtered dataset.
+    '''
+    n_events, n_trials = data.shape[:2]
+    plan = mcee.SRCA_Plan(tar_chans, model_chans, chans, regression, sp=sp)
+    f_data = plan(data.reshape((n_events*n_trials,) + data.shape[2:]))
+    return f_data.reshape((n_events, n_trials) + f_data.shape[1:])
+
+# %% Parallel evaluation
+_DATASETS = {}
+_CACHE = None
+
+def _set_datasets(datasets, cache_trials=None):
+    global _DATASETS, _CACHE
+    _DATASETS = dict(datasets)
+    _CACHE = mcee.SRCA_Cache(max_trials=cache_trials)
+
+def _load_datasets(paths, cache_trials=None):
+    # pool initializer: open every memmap once per worker
+    _set_datasets({name:np.load(path, mmap_mode='r') for name, path in paths.items()},
+                  cache_trials)
+
+def _accepts_cache(func):
+    try:
+        return 'cache' in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+def _run_fold(nf, fold, recognizers):
+    '''
+    Evaluate all recognizers on one fold
+
+    Returns
+    -------
+    rows : list of (fold, recognizer, accuracy, seconds)
+    '''
+    train_trials, test_trials = fold
+    rows = []
+    for name, dataset, func in recognizers:
+        data = _DATASETS[dataset]
+        train_data = np.asarray(data[:, train_trials, ...])
+        test_data = np.asarray(data[:, test_trials, ...])
+        kwargs = {'cache':_CACHE} if _accepts_cache(func) else {}
+        start = time.perf_counter()
+        result = func(train_data, test_data, **kwargs)
+        if isinstance(result, tuple):  # e.g. split_* return (rou, accuracy)
+            result = result[-1]
+        rows.append((nf, name, float(np.mean(result)), time.perf_counter()-start))
+    return rows
+
+def cross_validate(datasets, folds, recognizers, n_jobs=1, results=None, tmp_dir=None,
+                   cache_trials=4096):
+    '''
+    Cross-validation of target identification algorithms
+
+    Parameters
+    ----------
+    datasets : dict, {name: (n_events, n_trials, n_chans, n_times)}
+        datasets used by recognizers, e.g. origin & SRCA filtered data.
+        np.memmap arrays backed by .npy files are shared as they are.
+    folds : list of (train_trials, test_trials)
+        fold plan, see kfold, leave_one_block_out & random_repeats.
+    recognizers : list of (name, dataset, func)
+        func(train_data, test_data) returns accuracy (or a tuple ending
+        with accuracy). Use module-level functions or functools.partial,
+        which can be sent to worker processes. A func with a 'cache'
+        argument (SRCA recognizers) reuses SRCA filtered trials across folds.
+    n_jobs : int, optional
+        number of worker processes, -1 means all processors. The default is 1,
+        which runs in this process on the given arrays (no memmap copies).
+        Workers are spawned on Windows and import the calling script again,
+        so a script with n_jobs > 1 must keep its driver code under
+        if __name__ == '__main__'.
+    results : str, optional
+        path of the csv results table, each fold is appended as soon as it
+        is finished. The default is None.
+    tmp_dir : str, optional
+        directory of temporary memmap files. The default is None (system default).
+    cache_trials : int, optional
+        the largest number of SRCA filtered trials cached by each worker, the
+        least recently used ones are dropped. None means unbounded. The default
+        is 4096.
+
+    Returns
+    -------
+    accuracy : dict, {name: (n_folds,)}
+        accuracy of each recognizer on each fold.
+    '''
+    names = [name for name, dataset, func in recognizers]
+    if len(set(names)) != len(names):
+        raise ValueError('Names of recognizers must be unique.')
+    for name, dataset, func in recognizers:
+        if dataset not in datasets:
+            raise ValueError('Unknown dataset: ' + str(dataset))
+
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    n_jobs = max(1, min(n_jobs, len(folds)))
+    work_dir = None
+    accuracy = {name:np.full(len(folds), np.nan) for name in names}
+    table = open(results, 'w', newline='') if results is not None else None
+    try:
+        if table is not None:
+            writer = csv.writer(table)
+            writer.writerow(['fold', 'recognizer', 'accuracy', 'seconds'])
+        def collect(rows):
+            for nf, name, acc, seconds in rows:
+                accuracy[name][nf] = acc
+                if table is not None:
+                    writer.writerow([nf, name, acc, seconds])
+            if table is not None:
+                table.flush()
+
+        if n_jobs == 1:  # the given arrays are used as they are
+            _set_datasets(datasets, cache_trials)
+            for nf, fold in enumerate(folds):
+                collect(_run_fold(nf, fold, recognizers))
+        else:
+            # share datasets with workers through memmap (.npy) files
+            work_dir = tempfile.mkdtemp(prefix='cv_', dir=tmp_dir)
+            paths = {}
+            for name, data in datasets.items():
+                if isinstance(data, np.memmap) and str(data.filename).endswith('.npy'):
+                    paths[name] = data.filename
+                else:
+                    paths[name] = os.path.join(work_dir, '%s.npy' % name)
+                    np.save(paths[name], np.asarray(data))
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_load_datasets,
+                                     initargs=(paths, cache_trials)) as executor:
+                futures = [executor.submit(_run_fold, nf, fold, recognizers)
+                           for nf, fold in enumerate(folds)]
+                for future in as_completed(futures):
+                    collect(future.result())
+    finally:
+        if table is not None:
+            table.close()
+        _DATASETS.clear()
+        if _CACHE is not None:
+            _CACHE.clear()
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return accuracy
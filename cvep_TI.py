@@ -11,6 +11,8 @@ from numpy import (sin, cos, pi)
 from numpy import newaxis as NA
 import scipy.io as io
 import mcee
+import cross_validation as cv
+from functools import partial
 import pandas as pd
 import xlrd
 import matplotlib.pyplot as plt
@@ -25,70 +27,39 @@ nameList = ['yangman', 'gaorunyuan', 'wuqiaoyi']
 nameList = ['wuqiaoyi', 'gaorunyuan']
 
 n_cv = 6
+recognizers = [('ori_trca', 'origin', mcee.TRCA),
+               ('ori_strca', 'origin', partial(mcee.split_TRCA, 600)),
+               ('ori_etrca', 'origin', mcee.eTRCA),
+               ('ori_setrca', 'origin', partial(mcee.split_eTRCA, 600)),
+               ('srca_trca', 'srca', mcee.TRCA),
+               ('srca_strca', 'srca', partial(mcee.split_TRCA, 600)),
+               ('srca_etrca', 'srca', mcee.eTRCA),
+               ('srca_setrca', 'srca', partial(mcee.split_eTRCA, 600))]
+acc = {}
 
-ori_trca = np.zeros((len(nameList), n_cv))
-ori_strca = np.zeros((len(nameList), n_cv))
-ori_etrca = np.zeros((len(nameList), n_cv))
-ori_setrca = np.zeros((len(nameList), n_cv))
-
-srca_trca = np.zeros((len(nameList), n_cv))
-srca_etrca = np.zeros((len(nameList), n_cv))
-srca_strca = np.zeros((len(nameList), n_cv))
-srca_setrca = np.zeros((len(nameList), n_cv))
-
-for n_peo in range(len(nameList)):
-    people = nameList[n_peo]
-    eeg = io.loadmat(r'D:\SSVEP\dataset\preprocessed_data\cvep_8\%s\fir_50_70.mat' %(people))
-    f_data = eeg['f_data'][...,:2940]
-    chans = eeg['chan_info'].tolist()
-    n_events = f_data.shape[0]
-    del eeg
-
-    print("Now running " + people + "'s data...")
-
-    srca_model = io.loadmat(r'D:\SSVEP\realCV\code_VEP\%s\e_pCORR_0.mat' %(people))
-    model_info = srca_model['modelInfo'].flatten().tolist()
-    model_chans = []
-    for i in range(len(model_info)):
-        model_chans.append(model_info[i].tolist())
-    del model_info, i
-
-    for cv in range(n_cv):
-        print('CV: %d turn...' %(cv+1))
-        test_list = [i+cv*10 for i in range(10)]
-        # divide test/training dataset
-        train_data = np.delete(f_data, test_list, axis=1)
-        test_data = f_data[:,test_list,...]
-
-        srca_train_data = np.zeros((8,50,9,1800))
-        srca_test_data = np.zeros((8,10,9,1800))
-        for i in range(n_events):
-            srca_train_data[i,...] = mcee.apply_SRCA(train_data[i,...], tar_chans, model_chans, chans)
-            srca_test_data[i,...] = mcee.apply_SRCA(test_data[i,...], tar_chans, model_chans, chans)
-        
-        train_data = train_data[...,tar_chan_index,1140:]
-        test_data = test_data[...,tar_chan_index,1140:]
-        # target identification
-        _, ostrca = mcee.split_TRCA(600, train_data, test_data)
-        otrca = mcee.TRCA(train_data, test_data)
-        _, osetrca = mcee.split_eTRCA(600, train_data, test_data)
-        oetrca = mcee.eTRCA(train_data, test_data)
-        _, sstrca = mcee.split_TRCA(600, srca_train_data, srca_test_data)
-        strca = mcee.TRCA(srca_train_data, srca_test_data)
-        _, ssetrca = mcee.split_eTRCA(600, srca_train_data, srca_test_data)
-        setrca = mcee.eTRCA(srca_train_data, srca_test_data)
-
-        # save acc data
-        ori_trca[n_peo, cv] = otrca
-        ori_etrca[n_peo, cv] = oetrca
-        ori_strca[n_peo, cv] = ostrca
-        ori_setrca[n_peo, cv] = osetrca
-        srca_trca[n_peo, cv] = strca
-        srca_etrca[n_peo, cv] = setrca
-        srca_strca[n_peo, cv] = sstrca
-        srca_setrca[n_peo, cv] = ssetrca
-
-        print(str(cv+1) + 'th cross-validation complete!\n')
+# workers are spawned on Windows and import this script again
+if __name__ == '__main__':
+    for n_peo in range(len(nameList)):
+        people = nameList[n_peo]
+        eeg = io.loadmat(r'D:\SSVEP\dataset\preprocessed_data\cvep_8\%s\fir_50_70.mat' %(people))
+        f_data = eeg['f_data'][...,:2940]
+        chans = eeg['chan_info'].tolist()
+        del eeg
+
+        print("Now running " + people + "'s data...")
+
+        srca_model = io.loadmat(r'D:\SSVEP\realCV\code_VEP\%s\e_pCORR_0.mat' %(people))
+        model_info = srca_model['modelInfo'].flatten().tolist()
+        model_chans = []
+        for i in range(len(model_info)):
+            model_chans.append(model_info[i].tolist())
+        del model_info, i
+
+        # SRCA is fitted on each trial's own rest state: apply it once for all folds
+        datasets = {'origin':f_data[..., tar_chan_index, 1140:],
+                    'srca':cv.srca_dataset(f_data, tar_chans, model_chans, chans)}
+        acc[people] = cv.cross_validate(datasets, cv.kfold(f_data.shape[1], n_cv), recognizers,
+            n_jobs=n_cv, results=r'D:\SSVEP\realCV\code_VEP\%s\acc.csv' %(people))
 
 
 
@@ -111,15 +82,13 @@ for i in range(n_elements):  # config multi-stimuli
     stim_colors = np.concatenate((stim_colors, unit), axis=1)
 
 # %%
-rest = io.loadmat(r'D:\SSVEP\rest.mat')
-rest = rest['rest']
-rest = np.swapaxes(rest, 0,2)
-rest = np.swapaxes(rest, 1,-1)
-
-task = io.loadmat(r'D:\SSVEP\task.mat')
-task = task['task']
-task = np.swapaxes(task, 0,2)
-task = np.swapaxes(task, 1,-1)
-
-
-
+if __name__ == '__main__':
+    rest = io.loadmat(r'D:\SSVEP\rest.mat')
+    rest = rest['rest']
+    rest = np.swapaxes(rest, 0,2)
+    rest = np.swapaxes(rest, 1,-1)
+
+    task = io.loadmat(r'D:\SSVEP\task.mat')
+    task = task['task']
+    task = np.swapaxes(task, 0,2)
+    task = np.swapaxes(task, 1,-1)
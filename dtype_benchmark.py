@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+float32 vs float64 compute dtype benchmark
+
+Runs the recognizers of mcee and the unified framework of spatial_filters
+under both compute dtypes (see mcee.set_dtype & mcee.compute_dtype) on the
+same folds and reports accuracy, the largest difference of correlation
+coefficients and run time.
+
+Example:
+    python dtype_benchmark.py                      # synthetic 40-target SSVEP
+    python dtype_benchmark.py --store S15 --chans 53 54 55 56 57 58 60 61 62
+                                                   # an epoch_store subject
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+
+import time
+import argparse
+from functools import partial
+
+import mcee
+import spatial_filters as sf
+import cross_validation as cv
+
+# %% Data
+def synthetic_ssvep(n_events=40, n_trials=6, n_chans=9, n_times=1000, snr=0.005,
+                    sfreq=1000, seed=0):
+    '''
+    Sinusoidal SSVEP (8-15.8 Hz, 0.2 Hz step) in white noise
+
+    Returns
+    -------
+    data : (n_events, n_trials, n_chans, n_times), float32
+    freqs : (n_events,)
+    '''
+    rng = np.random.default_rng(seed)
+    freqs = 8 + 0.2*np.arange(n_events)
+    phases = 0.35*np.arange(n_events) % 2
+    ref = np.stack([mcee.sine_reference(freqs[ne], 3, n_times, phases[ne], sfreq).signal
+                    for ne in range(n_events)])            # (n_events, 6, n_times)
+    mixing = rng.standard_normal((n_chans, ref.shape[1]))  # same topography for all targets
+    signal = np.einsum('ch,eht->ect', mixing, ref)[:, np.newaxis, ...]
+    noise = rng.standard_normal((n_events, n_trials, n_chans, n_times))
+    data = np.sqrt(snr)*signal + noise
+    return data.astype(np.float32), freqs
+
+# %% Benchmark
+def trca_drift(train_data, test_data, ensemble=False):
+    '''Largest |r(float64) - r(float32)| of TRCA/eTRCA scoring.'''
+    rou = []
+    for dtype in (np.float64, np.float32):
+        with mcee.compute_dtype(dtype):
+            train, test = train_data.astype(dtype), test_data.astype(dtype)
+            w = mcee.TRCA_compute(train)
+            rou.append(mcee.trca_scoring(w, train.mean(axis=1), test, ensemble)[0])
+    return float(np.max(np.abs(rou[0] - rou[1])))
+
+def framework(filter_core, filter_type, train_data, test_data, freqs=None, **kwargs):
+    '''
+    Unified framework recognizer: (coefficients, accuracy) of spatial_filter.identify
+    '''
+    model = sf.spatial_filter(train_data, freqs=freqs, n_harmonics=3)
+    model.framework(filter_core, filter_type).build_filter()
+    r, predict, accuracy = model.identify(test_data, **kwargs)
+    return r, accuracy
+
+def benchmark(data, freqs, n_folds=6, stepwidth=100):
+    '''
+    Accuracy & run time of recognizers under both compute dtypes
+
+    Parameters
+    ----------
+    data : (n_events, n_trials, n_chans, n_times)
+        dataset.
+    freqs : (n_events,)
+        stimulus frequencies (for sCCA).
+    n_folds : int, optional
+        number of folds. The default is 6.
+    stepwidth : int, optional
+        segment length of split recognizers. The default is 100.
+
+    Returns
+    -------
+    report : dict, {recognizer: {dtype name: (accuracy, seconds)}}
+        TRCA, eTRCA, split & framework (sf_*) recognizers also hold 'max_dr',
+        the largest difference of correlation coefficients between both dtypes.
+    '''
+    recognizers = [('trca', mcee.TRCA),
+                   ('etrca', mcee.eTRCA),
+                   ('split_trca', partial(mcee.split_TRCA, stepwidth)),
+                   ('split_etrca', partial(mcee.split_eTRCA, stepwidth)),
+                   ('itcca', mcee.itCCA),
+                   ('scca', lambda train_data, test_data: mcee.sCCA(test_data, freqs, 3)),
+                   ('sf_trca', partial(framework, 'TRCA', 'origin')),
+                   ('sf_etrca', partial(framework, 'TRCA', ['origin', 'ensemble'])),
+                   ('sf_trca_r', partial(framework, 'TRCA', 'reference', freqs=freqs)),
+                   ('sf_cca', partial(framework, 'CCA', 'origin', freqs=freqs)),
+                   ('sf_dcpm', partial(framework, 'DCPM', 'origin', di=['1', '2']))]
+    folds = cv.kfold(data.shape[1], n_folds)
+    report = {}
+    for name, func in recognizers:
+        report[name], rou = {}, {}
+        for dtype in (np.float64, np.float32):
+            typed = data.astype(dtype)
+            accuracy, seconds, rou[dtype] = [], 0, []
+            with mcee.compute_dtype(dtype):
+                for train_trials, test_trials in folds:
+                    start = time.perf_counter()
+                    result = func(typed[:, train_trials], typed[:, test_trials])
+                    seconds += time.perf_counter() - start
+                    if isinstance(result, tuple):  # split & framework recognizers: (rou, accuracy)
+                        rou[dtype].append(result[0])
+                        result = result[-1]
+                    accuracy.append(result)
+            report[name][np.dtype(dtype).name] = (float(np.mean(accuracy)), seconds)
+        if rou[np.float64]:
+            report[name]['max_dr'] = max(float(np.max(np.abs(r64 - r32)))
+                                         for r64, r32 in zip(rou[np.float64], rou[np.float32]))
+    for name, ensemble in (('trca', False), ('etrca', True)):
+        report[name]['max_dr'] = max(trca_drift(data[:, train_trials], data[:, test_trials], ensemble)
+                                     for train_trials, test_trials in folds)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='float32 vs float64 compute dtype benchmark')
+    parser.add_argument('--store', default=None, help='epoch_store path of one subject')
+    parser.add_argument('--chans', nargs='*', default=None, help='channels of the store')
+    parser.add_argument('--points', nargs=2, type=int, default=None, help='start & stop points')
+    parser.add_argument('--freqs', nargs='*', type=float, default=None, help='stimulus frequencies')
+    parser.add_argument('--stepwidth', type=int, default=100)
+    args = parser.parse_args()
+    if args.store is not None:
+        import epoch_store
+        store = epoch_store.EpochStore(args.store)
+        chans = None if args.chans is None else [int(c) if c.isdigit() else c for c in args.chans]
+        data = store.load(chans=chans, points=args.points, dtype=np.float32)
+        freqs = args.freqs or store.meta.get('freqs')
+    else:
+        data, freqs = synthetic_ssvep()
+    report = benchmark(data, np.asarray(freqs), stepwidth=args.stepwidth)
+    print('%-12s %10s %10s %10s %10s %10s' % ('recognizer', 'acc64', 'acc32', 's64', 's32', 'max|dr|'))
+    for name, result in report.items():
+        (acc64, s64), (acc32, s32) = result['float64'], result['float32']
+        print('%-12s %10.4f %10.4f %10.3f %10.3f %10s' % (name, acc64, acc32, s64, s32,
+              '%.2e' % result['max_dr'] if 'max_dr' in result else '-'))
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped epoch store
+
+One subject = one binary file '<name>.dat' of epochs
+(n_events, n_trials, n_chans, n_times) + metadata '<name>.json' (shape, dtype,
+chan_info, sfreq, event_ids, freqs, phases). Epochs are opened as np.memmap,
+so only the channels & time points actually sliced are read from disk.
+
+1. EpochStore: open a store, lazy selection by events/trials/channels/time
+2. create: allocate a writable store
+3. from_mat: one-time converter from .mat files
+    (f_data/chan_info layout of data_preprocessing, or the
+     (n_chans, n_times, n_events, n_blocks) layout of the benchmark dataset)
+4. convert_folder & open_folder: multi-subject datasets
+
+Example:
+    convert_folder(r'E:\\dataset\\data', r'E:\\dataset\\store', layout='benchmark',
+                   sfreq=250, info=r'E:\\dataset\\Freq_Phase.mat')
+    stores = open_folder(r'E:\\dataset\\store')
+    data = stores['S15'].load(chans=['O1', 'OZ', 'O2'], tlim=(0.14, 0.64))
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+import scipy.io as io
+
+import os
+import json
+
+# %% Epoch store
+class EpochStore:
+    '''
+    Read-only epochs of one subject
+
+    Parameters
+    ----------
+    path : str
+        store path, without or with '.dat'/'.json'.
+
+    Attributes
+    ----------
+    data : np.memmap, (n_events, n_trials, n_chans, n_times)
+        lazy epochs, slicing it only reads the selected part.
+    chans : list
+        names of all channels.
+    sfreq : float
+        sampling frequency.
+    tmin : float
+        time of the first point of each epoch (s).
+    meta : dict
+        all metadata (event_ids, freqs, phases...).
+    '''
+    def __init__(self, path, mode='r'):
+        self.path = _store_path(path)
+        with open(self.path + '.json') as f:
+            self.meta = json.load(f)
+        self.data = np.memmap(self.path + '.dat', dtype=self.meta['dtype'], mode=mode,
+                              shape=tuple(self.meta['shape']))
+        self.chans = list(self.meta['chan_info'])
+        self.sfreq = self.meta['sfreq']
+        self.tmin = self.meta.get('tmin', 0)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def chan_index(self, chans):
+        '''Indices of channels given by names (or indices), padded names like 'O1 ' match.'''
+        return [self.chans.index(c.strip()) if isinstance(c, str) else int(c) for c in chans]
+
+    def time_slice(self, tlim):
+        '''Points of the time range (tmin, tmax) in seconds, tmax excluded.'''
+        start = int(round((tlim[0]-self.tmin)*self.sfreq))
+        stop = int(round((tlim[1]-self.tmin)*self.sfreq))
+        return slice(max(start, 0), stop)
+
+    def load(self, events=None, trials=None, chans=None, tlim=None, points=None, dtype=None):
+        '''
+        Read a selection of epochs into memory
+
+        Parameters
+        ----------
+        events : list, optional
+            indices of events. The default is None (all).
+        trials : list, optional
+            indices of trials. The default is None (all).
+        chans : list, optional
+            names or indices of channels. The default is None (all).
+        tlim : tuple, optional
+            (tmin, tmax) in seconds. The default is None (all).
+        points : slice or tuple, optional
+            (start, stop) points, used instead of tlim. The default is None.
+        dtype : optional
+            output dtype. The default is None (stored dtype).
+
+        Returns
+        -------
+        data : (n_events, n_trials, n_chans, n_times)
+        '''
+        if points is not None:
+            time_index = points if isinstance(points, slice) else slice(*points)
+        elif tlim is not None:
+            time_index = self.time_slice(tlim)
+        else:
+            time_index = slice(None)
+        n_events, n_trials, n_chans, n_times = self.data.shape
+        index = np.ix_(np.arange(n_events) if events is None else np.asarray(events),
+                       np.arange(n_trials) if trials is None else np.asarray(trials),
+                       np.arange(n_chans) if chans is None else self.chan_index(chans),
+                       np.arange(n_times)[time_index])
+        # one gather: only the selected points are read from disk
+        data = self.data[index]
+        return np.asarray(data, dtype=dtype)
+
+def _store_path(path):
+    for ext in ('.dat', '.json'):
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def create(path, shape, chan_info, sfreq, dtype='float64', tmin=0, **meta):
+    '''
+    Allocate a writable store
+
+    Parameters
+    ----------
+    path : str
+        store path.
+    shape : tuple
+        (n_events, n_trials, n_chans, n_times).
+    chan_info : list
+        names of channels.
+    sfreq : float
+        sampling frequency.
+    dtype : optional
+        stored dtype. The default is 'float64'.
+    tmin : float, optional
+        time of the first point of each epoch (s). The default is 0.
+    **meta :
+        other metadata, e.g. event_ids, freqs & phases.
+
+    Returns
+    -------
+    store : EpochStore (writable)
+    '''
+    path = _store_path(path)
+    if len(chan_info) != shape[2]:
+        raise ValueError('chan_info does not match the number of channels.')
+    header = {'shape':[int(s) for s in shape], 'dtype':np.dtype(dtype).str,
+              'chan_info':[str(c).strip() for c in chan_info], 'sfreq':float(sfreq),
+              'tmin':float(tmin)}
+    header.update({key:_jsonable(value) for key, value in meta.items()})
+    np.memmap(path + '.dat', dtype=dtype, mode='w+', shape=tuple(shape)).flush()
+    with open(path + '.json', 'w') as f:
+        json.dump(header, f)
+    return EpochStore(path, mode='r+')
+
+def from_mat(mat_file, path, layout='f_data', sfreq=1000, chan_info=None, dtype='float64',
+             key=None, **meta):
+    '''
+    One-time converter from a .mat file
+
+    Parameters
+    ----------
+    mat_file : str
+        .mat file.
+    path : str
+        store path.
+    layout : str, optional
+        'f_data': {'f_data':(n_events, n_trials, n_chans, n_times), 'chan_info'},
+        'benchmark': {'data':(n_chans, n_times, n_events, n_blocks)}.
+        The default is 'f_data'.
+    sfreq : float, optional
+        sampling frequency. The default is 1000.
+    chan_info : list, optional
+        names of channels. The default is None ('chan_info' of the file,
+        or channel numbers).
+    dtype : optional
+        stored dtype. The default is 'float64'.
+    key : str, optional
+        variable of the epochs. The default is None ('f_data' or 'data').
+    **meta :
+        other metadata, e.g. event_ids, freqs, phases & tmin.
+
+    Returns
+    -------
+    store : EpochStore
+    '''
+    mat = io.loadmat(mat_file)
+    if layout == 'f_data':
+        data = mat[key or 'f_data']
+    elif layout == 'benchmark':
+        data = mat[key or 'data'].transpose((2, 3, 0, 1))
+    else:
+        raise ValueError('Unknown layout: ' + str(layout))
+    if chan_info is None:
+        if 'chan_info' in mat:
+            chan_info = mat['chan_info'].tolist()
+        else:
+            chan_info = [str(nc) for nc in range(data.shape[2])]
+    store = create(path, data.shape, chan_info, sfreq, dtype, **meta)
+    for ne in range(data.shape[0]):  # one event at a time
+        store.data[ne] = data[ne]
+    store.data.flush()
+    return EpochStore(path)
+
+def convert_folder(src_dir, dst_dir, info=None, **kwargs):
+    '''
+    Convert every .mat file of a folder (one file per subject)
+
+    Parameters
+    ----------
+    src_dir : str
+        folder of .mat files.
+    dst_dir : str
+        folder of stores.
+    info : str, optional
+        .mat file with 'freqs' & 'phases' shared by all subjects
+        (e.g. Freq_Phase.mat of the benchmark dataset). The default is None.
+    **kwargs :
+        parameters of from_mat.
+
+    Returns
+    -------
+    paths : list of str
+    '''
+    if info is not None:
+        info = io.loadmat(info)
+        kwargs.setdefault('freqs', info['freqs'].ravel())
+        kwargs.setdefault('phases', info['phases'].ravel())
+    os.makedirs(dst_dir, exist_ok=True)
+    paths = []
+    for file in sorted(os.listdir(src_dir)):
+        name, ext = os.path.splitext(file)
+        if ext != '.mat':
+            continue
+        path = os.path.join(dst_dir, name)
+        from_mat(os.path.join(src_dir, file), path, **kwargs)
+        paths.append(path)
+    return paths
+
+def open_folder(folder):
+    '''
+    Open all stores of a folder
+
+    Returns
+    -------
+    stores : dict, {name: EpochStore}
+    '''
+    return {os.path.splitext(file)[0]:EpochStore(os.path.join(folder, file))
+            for file in sorted(os.listdir(folder)) if file.endswith('.json')}
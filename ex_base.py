@@ -4,6 +4,8 @@ Created on Thu Oct 29 19:49:39 2020
 
 @author: Brynhildr
 """
+import os
+import json
 import time
 
 import numpy as np
@@ -11,7 +13,6 @@ import scipy.io as sio
 
 import socket, struct, threading, queue
 from collections import deque
-from copy import deepcopy
 
 from psychopy import (core, visual, event, parallel)
 
@@ -182,33 +183,106 @@ class Amplifier:
     """
     class _Buff:
         """
-        Inner buffer object to store buffer data.
+        Inner ring buffer to store the newest lim_buff samples.
+        Storage is a preallocated (2*lim_buff, n_chans+1) array holding each
+        sample twice (at i and i+lim_buff), so the newest window is always a
+        contiguous slice and reading it never copies.
         """
         def __init__(self, lim_buff):
             self.lim_buff = lim_buff
-            self.buff = deque(maxlen=self.lim_buff)
-            for _ in range(self.lim_buff):
-                self.buff.append(None)
+            self.buff = None    # allocated at the first write (n_chans+1 unknown)
+            self.head = 0       # next write position, 0 <= head < lim_buff
             self.buff_size = 0
 
         def buffering(self, data):
-            for d in data:
-                value = self.buff.popleft()
-                self.buff.append(d)
-                if self.buff_size < self.lim_buff-1:
-                    self.buff_size += 1
+            data = np.atleast_2d(np.asarray(data, dtype=float))
+            n_points = data.shape[0]
+            if n_points == 0:
+                return
+            if self.buff is None:
+                self.buff = np.zeros((2*self.lim_buff, data.shape[1]))
+            self.buff_size = min(self.buff_size + n_points, self.lim_buff)
+            if n_points > self.lim_buff:
+                data = data[-self.lim_buff:]
+                n_points = self.lim_buff
+            # bulk write into both mirrors, wrapping around at most once
+            first = min(n_points, self.lim_buff - self.head)
+            for offset in (0, self.lim_buff):
+                self.buff[offset+self.head:offset+self.head+first] = data[:first]
+                self.buff[offset:offset+n_points-first] = data[first:]
+            self.head = (self.head + n_points) % self.lim_buff
 
         def access_buffer(self):
-            c_buffer = []
-            for _ in range(self.lim_buff):
-                d = self.buff.popleft()
-                if d:
-                    c_buffer.append(d)  # only access those are not None
-                self.buff.append(d)
-            return c_buffer
+            # view of the newest buff_size samples: (buff_size, n_chans+1)
+            if self.buff is None:
+                return np.empty((0, 0))
+            end = self.head + self.lim_buff
+            return self.buff[end-self.buff_size:end]
 
         def is_full(self):
-            return self.buff_size == self.lim_buff-1
+            return self.buff_size == self.lim_buff
+
+    class _Subscriber(queue.Queue):
+        """
+        Bounded input queue of one subscriber.
+        policy 'drop_oldest' discards the oldest package when full, 'block'
+        applies backpressure to the publisher. The sentinel None is always
+        delivered by close().
+        """
+        def __init__(self, maxsize=0, policy='drop_oldest'):
+            if policy not in ('drop_oldest', 'block'):
+                raise ValueError('Unknown policy: ' + str(policy))
+            super().__init__(maxsize)
+            self.policy = policy
+            self.closed = False
+            self.n_published = 0
+            self.n_dropped = 0
+            self.max_lag = 0
+
+        def _drop_oldest(self):
+            self._get()
+            self.unfinished_tasks -= 1
+            self.n_dropped += 1
+
+        def publish(self, package):
+            with self.not_full:
+                if self.closed:
+                    return False
+                if 0 < self.maxsize <= self._qsize():
+                    if self.policy == 'drop_oldest':
+                        self._drop_oldest()
+                    else:
+                        while self._qsize() >= self.maxsize and not self.closed:
+                            self.not_full.wait()
+                        if self.closed:
+                            return False
+                self._put(package)
+                self.unfinished_tasks += 1
+                self.n_published += 1
+                self.max_lag = max(self.max_lag, self._qsize())
+                self.not_empty.notify()
+            return True
+
+        def close(self):
+            with self.not_full:
+                if self.closed:
+                    return
+                self.closed = True
+                if self.policy == 'block':  # give a live consumer time to make room
+                    deadline = time.monotonic() + 1.0
+                    while 0 < self.maxsize <= self._qsize() and time.monotonic() < deadline:
+                        self.not_full.wait(deadline - time.monotonic())
+                if 0 < self.maxsize <= self._qsize():
+                    self._drop_oldest()
+                self._put(None)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+                self.not_full.notify_all()  # release a blocked publisher
+
+        def stats(self):
+            with self.mutex:
+                return {'lag': self._qsize(), 'max_lag': self.max_lag,
+                        'n_published': self.n_published, 'n_dropped': self.n_dropped}
 
     class _MarkerRuler:
         def __init__(self, marker=None, latency=0):
@@ -241,6 +315,7 @@ class Amplifier:
     def __init__(self):
         self.registered_handlers = {}
         self._input_queues = {}
+        self._subscribers = ()  # immutable snapshot read by the data pipeline
         self._output_queues = {}
         self._ts = {}
         self._t_data_pipeline = None
@@ -256,58 +331,68 @@ class Amplifier:
     def send(self, message):
         pass
 
+    def _publish_subscribers(self):
+        # swap the snapshot, called with register_lock held
+        self._subscribers = tuple(self._input_queues.values())
+
     def _data_pipeline(self):
         while True:
             try:
                 package = self.recv()
             except:
-                self.register_lock.acquire()
-                for key in self._input_queues:
-                    self._input_queues[key].put(None)
-                self.register_lock.release()
+                for subscriber in self._subscribers:
+                    subscriber.close()
                 break
-            # Should there be a lock?
-            self.register_lock.acquire()
-            for key in self._input_queues:
-                self._input_queues[key].put(package)
-            self.register_lock.release()
+            # no lock: the snapshot is replaced, never mutated
+            for subscriber in self._subscribers:
+                subscriber.publish(package)
+
+    def subscriber_stats(self):
+        """Lag counters of each subscriber: lag, max_lag, n_published, n_dropped."""
+        subscribers = dict(self._input_queues)
+        return {name: subscriber.stats() for name, subscriber in subscribers.items()}
 
     def establish_data_pipeline(self):
         self._t_data_pipeline = threading.Thread(target=self._data_pipeline, daemon=True, name='data_pipeline')
         self._t_data_pipeline.start()
 
-    def _save_handler(self, input_queue=None, file_name='default', info={}):
-        save_data = None
+    def _save_handler(self, input_queue=None, file_name='default', info={}, chunk_size=None):
+        # stream to <file_name>.raw/.events/.json, see StreamRecorder;
+        # convert offline with recording_to_mat
+        if chunk_size is None:
+            chunk_size = 4*self.srate
+        recorder = StreamRecorder(file_name, chunk_size=chunk_size, srate=self.srate, info=info)
         while True:
             package = input_queue.get()
             if package is None:
                 break
             r_data, extras = package
-            r_data = np.array(r_data).T
-            save_data = np.append(save_data, r_data, axis=1) if save_data is not None else r_data
+            if r_data is not None:
+                recorder.write(r_data)
             input_queue.task_done()
-        if save_data is not None and info is not None:
-            print('saving data...')
-            sio.savemat(file_name, {'data': save_data, 'info': info})
-        # np.save(file_name, save_data)
+        recorder.close()
 
-    def use_save_hook(self, file_name='default', info=None):
+    def use_save_hook(self, file_name='default', info=None, chunk_size=None):
         self.register_lock.acquire()
-        input_queue = queue.Queue()
+        input_queue = self._Subscriber()  # unbounded: never drop saved data
         self._input_queues['save'] = input_queue
+        self._publish_subscribers()
         self.register_lock.release()
-        kwargs={'file_name': file_name, 'input_queue': input_queue, 'info': info}
+        kwargs={'file_name': file_name, 'input_queue': input_queue, 'info': info,
+                'chunk_size': chunk_size}
         self._t_save_pipeline = threading.Thread(target=self._save_handler, args=(), kwargs=kwargs, daemon=True, name='save')
         self._t_save_pipeline.start()
 
     def unuse_save_hook(self):
         self.register_lock.acquire()
         if 'save' in self._input_queues:
-            self._input_queues['save'].put(None)
-            del self._input_queues['save']
+            input_queue = self._input_queues.pop('save')
+            self._publish_subscribers()
+            input_queue.close()
         self.register_lock.release()
 
-    def register_hook(self, name=None, data_type=None, handler=None, args=(), kwargs={}):
+    def register_hook(self, name=None, data_type=None, handler=None, args=(), kwargs={},
+                      maxsize=0, policy='drop_oldest'):
         if name is None:
             name = handler.__name__
 
@@ -318,15 +403,15 @@ class Amplifier:
                 'tlim': None
             }
 
-        self.registered_handlers[name] = (handler, args, kwargs, data_type)
+        self.registered_handlers[name] = (handler, args, kwargs, data_type, maxsize, policy)
 
     def use_hooks(self, names=None):
         if names is None:
             names = self.registered_handlers.keys()
         self.register_lock.acquire()
         for name in names:
-            handler, args, kwargs, data_type = self.registered_handlers[name]
-            input_queue = queue.Queue()
+            handler, args, kwargs, data_type, maxsize, policy = self.registered_handlers[name]
+            input_queue = self._Subscriber(maxsize, policy)
             output_queue = queue.Queue()
             self._input_queues[name] = input_queue
             self._output_queues[name] = output_queue
@@ -341,15 +426,17 @@ class Amplifier:
 
             self._ts[name] = threading.Thread(target=self._wrapper_handler, args=(), kwargs=wrapper_kwargs, name=name, daemon=True)
             self._ts[name].start()
+        self._publish_subscribers()
         self.register_lock.release()
 
     def unuse_hooks(self, names=None):
         self.register_lock.acquire()
         if names is None:
-            names = list(self._input_queues.keys())
-        for name in names:
-            self._input_queues[name].put(None)
-            del self._input_queues[name]
+            names = list(self._output_queues.keys())  # hooks only, not the save hook
+        input_queues = [self._input_queues.pop(name) for name in names]
+        self._publish_subscribers()
+        for name, input_queue in zip(names, input_queues):
+            input_queue.close()
             self._output_queues[name].put(None)
             del self._output_queues[name]
         self.register_lock.release()
@@ -364,14 +451,14 @@ class Amplifier:
 
         if process_type == 'fixed':
             lim_buff, latency = tlim
-            lim_buff = np.int(lim_buff*self.srate)
-            latency = np.int(latency*self.srate)
+            lim_buff = int(lim_buff*self.srate)
+            latency = int(latency*self.srate)
             buff = self._Buff(lim_buff)
             is_trigger = self._MarkerRuler(marker=label, latency=latency)
         elif process_type == 'label':
             f_p, r_p = tlim
-            f_p = np.int(f_p*self.srate)
-            r_p = np.int(r_p*self.srate)
+            f_p = int(f_p*self.srate)
+            r_p = int(r_p*self.srate)
             lim_buff = max(r_p, 0) - f_p
             latency = max(f_p, r_p, 0)
             r_p -= f_p
@@ -389,22 +476,24 @@ class Amplifier:
                 # initialization
                 r_data, extras = package
                 if process_type == 'realtime':
-                    eeg_data = deepcopy(r_data) # avoid reference trouble
+                    eeg_data = np.array(r_data) # avoid reference trouble
                     waiting_queue.append(eeg_data)
-                elif process_type == 'fixed':
-                    for d in r_data:
-                        if is_trigger(d) and buff.is_full():
-                            eeg_data = deepcopy(buff.access_buffer())
-                            waiting_queue.append(eeg_data)
-                        else:
-                            buff.buffering([d])
                 else:
-                    for d in r_data:
-                        if is_trigger(d) and buff.is_full():
-                            eeg_data = deepcopy(buff.access_buffer())
-                            waiting_queue.append(eeg_data[f_p:r_p])
-                        else:
-                            buff.buffering([d])
+                    # samples between triggers are buffered in bulk, a trigger
+                    # sample is consumed when it releases a window
+                    r_data = np.asarray(r_data)
+                    start = 0
+                    for i, d in enumerate(r_data):
+                        if is_trigger(d):
+                            buff.buffering(r_data[start:i])
+                            start = i
+                            if buff.is_full():
+                                eeg_data = buff.access_buffer()
+                                if process_type == 'label':
+                                    eeg_data = eeg_data[f_p:r_p]
+                                waiting_queue.append(eeg_data.copy())
+                                start = i + 1
+                    buff.buffering(r_data[start:])
 
                 for _ in range(len(waiting_queue)):
                     eeg_data = waiting_queue.popleft()
@@ -426,6 +515,181 @@ class Amplifier:
         else:
             return None, None
 
+class StreamRecorder:
+    """
+    Streaming recorder of amplifier packages with constant memory.
+    Packages are copied into fixed-size chunks, a background thread appends
+    full chunks to '<file_name>.raw' (sample-major, (n_points, n_rows)),
+    appends (position, label) of nonzero labels (last row) to
+    '<file_name>.events' and rewrites the small '<file_name>.json' header
+    (shape, dtype, srate & info). Everything before the last flushed chunk
+    survives a crash.
+    """
+    def __init__(self, file_name, chunk_size=4000, srate=1000, info=None,
+                 n_buffers=4, dtype='float64'):
+        self.raw_name, self.events_name, self.header_name = _recording_names(file_name)
+        self.chunk_size = chunk_size
+        self.srate = srate
+        self.info = info
+        self.n_buffers = n_buffers
+        self.dtype = np.dtype(dtype)
+        self.n_rows = None
+        self.n_points = 0   # points written to disk
+        self.n_events = 0
+        self._chunk = None
+        self._fill = 0
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        self._error = None
+        self._file = open(self.raw_name, 'wb')
+        self._events_file = open(self.events_name, 'wb')
+        self._t_writer = threading.Thread(target=self._writer, daemon=True, name='recorder')
+        self._t_writer.start()
+
+    def write(self, r_data):
+        if self._error is not None:
+            raise self._error
+        r_data = np.asarray(r_data, dtype=self.dtype)
+        if r_data.ndim == 1:
+            r_data = r_data[np.newaxis, :]
+        if self.n_rows is None:  # allocate the buffer pool at the first package
+            self.n_rows = r_data.shape[1]
+            for _ in range(self.n_buffers):
+                self._free.put(np.empty((self.chunk_size, self.n_rows), dtype=self.dtype))
+        start = 0
+        while start < r_data.shape[0]:
+            if self._chunk is None:
+                self._chunk = self._free.get()  # blocks when the writer falls behind
+            n_points = min(r_data.shape[0] - start, self.chunk_size - self._fill)
+            self._chunk[self._fill:self._fill+n_points] = r_data[start:start+n_points]
+            self._fill += n_points
+            start += n_points
+            if self._fill == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        # hand the current (partial) chunk to the writer
+        if self._chunk is not None and self._fill:
+            self._full.put((self._chunk, self._fill))
+            self._chunk, self._fill = None, 0
+
+    def close(self):
+        self.flush()
+        self._full.put(None)
+        self._t_writer.join()
+        self._file.close()
+        self._events_file.close()
+        self._write_header()
+        if self._error is not None:
+            raise self._error
+
+    def _writer(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            chunk, n_points = item
+            try:
+                self._file.write(chunk[:n_points].tobytes())
+                self._file.flush()
+                idxs = np.flatnonzero(chunk[:n_points, -1])
+                events = np.stack((self.n_points+idxs, chunk[idxs, -1]), axis=-1)
+                self._events_file.write(events.astype('<f8').tobytes())
+                self._events_file.flush()
+                self.n_events += len(idxs)
+                self.n_points += n_points
+                self._write_header()
+            except Exception as e:
+                self._error = e
+            self._free.put(chunk)
+
+    def _write_header(self):
+        try:
+            info = json.loads(json.dumps(self.info))
+        except TypeError:
+            info = repr(self.info)
+        header = {'dtype': self.dtype.str, 'n_rows': self.n_rows, 'n_points': self.n_points,
+                  'n_events': self.n_events, 'srate': self.srate, 'info': info}
+        tmp_name = self.header_name + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp_name, self.header_name)  # atomic: never a half-written header
+
+def _recording_names(file_name):
+    if file_name.endswith('.mat'):
+        file_name = file_name[:-4]
+    return file_name + '.raw', file_name + '.events', file_name + '.json'
+
+def load_recording(file_name):
+    """
+    Open a StreamRecorder recording.
+
+    Returns
+    -------
+    data : np.memmap, (n_points, n_rows)
+        samples, the last row is the label channel.
+    header : dict
+        dtype, n_rows, n_points, srate, info & events ((n_events, 2) array
+        of position & label).
+    """
+    raw_name, events_name, header_name = _recording_names(file_name)
+    with open(header_name) as f:
+        header = json.load(f)
+    header['events'] = np.fromfile(events_name, dtype='<f8').reshape(-1, 2)
+    dtype = np.dtype(header['dtype'])
+    n_rows = header['n_rows']
+    if not n_rows:
+        return np.empty((0, 0), dtype=dtype), header
+    # trust the raw file over the header after a crash
+    n_points = os.path.getsize(raw_name) // (dtype.itemsize*n_rows)
+    header['n_points'] = n_points
+    data = np.memmap(raw_name, dtype=dtype, mode='r', shape=(n_points, n_rows))
+    return data, header
+
+def recording_to_mat(file_name, mat_name, chan_info=None, tlim=None, event_ids=None):
+    """
+    Convert a recording to the .mat layouts used in this project.
+
+    Parameters
+    ----------
+    file_name : str
+        recording of StreamRecorder.
+    mat_name : str
+        output .mat file.
+    chan_info : list, optional
+        channel names (without the label channel).
+    tlim : tuple, optional
+        (tmin, tmax) in seconds around each event. If None, the continuous
+        {'data': (n_rows, n_points), 'info'} layout of the old save hook is
+        written, otherwise epochs {'f_data': (n_events, n_trials, n_chans,
+        n_times), 'chan_info'} (trials are cut to the rarest event).
+    event_ids : list, optional
+        labels used as events. The default is None (all labels, sorted).
+    """
+    data, header = load_recording(file_name)
+    if tlim is None:
+        mdict = {'data': np.asarray(data).T, 'info': header['info']}
+        if chan_info is not None:
+            mdict['chan_info'] = chan_info
+        sio.savemat(mat_name, mdict)
+        return
+    events = header['events']
+    start = int(round(tlim[0]*header['srate']))
+    stop = int(round(tlim[1]*header['srate'])) + 1
+    # drop events whose window is out of the recording
+    valid = (events[:, 0] + start >= 0) & (events[:, 0] + stop <= data.shape[0])
+    events = events[valid]
+    if event_ids is None:
+        event_ids = np.unique(events[:, 1])
+    positions = [events[events[:, 1] == ei, 0].astype(int) for ei in event_ids]
+    n_trials = min([len(pos) for pos in positions])
+    f_data = np.zeros((len(event_ids), n_trials, data.shape[1]-1, stop-start))
+    for ne, pos in enumerate(positions):
+        for nt, p in enumerate(pos[:n_trials]):
+            f_data[ne, nt] = data[p+start:p+stop, :-1].T
+    sio.savemat(mat_name, {'f_data': f_data,
+                           'chan_info': chan_info if chan_info is not None else []})
+
 class NoConnectionError(Exception):
     """No connection established."""
     pass
@@ -447,28 +711,28 @@ class Neuroscan(Amplifier):
     }
 
     def __init__(self, address=None, srate=1000, num_chans=68):
-        Amplifier.__init__()
+        Amplifier.__init__(self)
+        self.srate = srate
         self.address = address
         self.neuro_link = None
         self.num_chans = num_chans
         # the size of package in neuroscan data is srate/25*(num_chans+1)*4 bytes
-        self.pkg_size = srate/25*(num_chans+1)*4
+        self.pkg_size = int(srate/25*(num_chans+1)*4)
+        # reusable receive buffer, grown when a larger package arrives
+        self._recv_buff = bytearray(max(self.pkg_size, 12))
         self.timeout = 0.0625
         self.connected = False
         self.started = False
 
     def _unpack_header(self, b_header):
-        ch_id = struct.unpack('>4s', b_header[:4])
-
-        w_code = struct.unpack('>H', b_header[4:6])
-        w_request = struct.unpack('>H', b_header[6:8])
-        pkg_size = struct.unpack('>I', b_header[8:])
-
-        return (ch_id[0].decode('utf-8'), w_code[0], w_request[0], pkg_size[0])
+        ch_id, w_code, w_request, pkg_size = struct.unpack('>4sHHI', b_header)
+        return (ch_id.decode('utf-8'), w_code, w_request, pkg_size)
 
     def _unpack_data(self, num_chans, b_data):
-        fmt = '>' + str(num_chans + 1) + 'i'
-        data = np.array(list(struct.iter_unpack(fmt, b_data)), dtype=np.float)
+        # one big-endian int32 view of the package, then a single float copy
+        n_points = len(b_data) // (4*(num_chans+1))
+        data = np.frombuffer(b_data, dtype='>i4', count=n_points*(num_chans+1))
+        data = data.reshape(n_points, num_chans+1).astype(np.float64)
         data[:, :-1] *= 0.0298
         data[:, -1] -= 65280
         return data
@@ -486,28 +750,29 @@ class Neuroscan(Amplifier):
         return data.tobytes()
 
     def _recv(self, num_bytes):
-        fragments = []
-        done = False
+        # read into the reusable buffer, the returned memoryview is only
+        # valid until the next call
+        if len(self._recv_buff) < num_bytes:
+            self._recv_buff = bytearray(num_bytes)
+        view = memoryview(self._recv_buff)[:num_bytes]
         b_count = 0
-        while not done:
+        while b_count < num_bytes:
             try:
-                chunk = self.neuro_link.recv(num_bytes - b_count)
+                n_bytes = self.neuro_link.recv_into(view[b_count:], num_bytes - b_count)
             except socket.timeout:
                 return None
-
-            if b_count == num_bytes or not chunk:
-                done = True
-            b_count += len(chunk)
-            fragments.append(chunk)
-
-        b_data = b''.join(fragments)
-        return b_data
+            if n_bytes == 0:  # connection closed
+                break
+            b_count += n_bytes
+        return view[:b_count]
 
     def recv(self):
         extras = None
         header = None
         r_data = None
         b_header = self._recv(12)
+        if b_header is not None and len(b_header) < 12:
+            raise NoConnectionError('Connection closed by the server.')
         if b_header:
             header = self._unpack_header(b_header)
 
@@ -522,6 +787,8 @@ class Neuroscan(Amplifier):
 
     def command(self, method):
         if method == 'connect':
+            if self.neuro_link is None:
+                self.neuro_link = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.neuro_link.connect(self.address)
             self.connected = True
         elif method == 'start_acq':
@@ -569,33 +836,106 @@ class NeuroScanPort(NeuroPort):
     """
     class _Buff:
         """
-        Inner buffer object to store buffer data.
+        Inner ring buffer to store the newest lim_buff samples.
+        Storage is a preallocated (2*lim_buff, n_chans+1) array holding each
+        sample twice (at i and i+lim_buff), so the newest window is always a
+        contiguous slice and reading it never copies.
         """
         def __init__(self, lim_buff):
             self.lim_buff = lim_buff
-            self.buff = deque(maxlen=self.lim_buff)
-            for _ in range(self.lim_buff):
-                self.buff.append(None)
+            self.buff = None    # allocated at the first write (n_chans+1 unknown)
+            self.head = 0       # next write position, 0 <= head < lim_buff
             self.buff_size = 0
 
         def buffering(self, data):
-            for d in data:
-                value = self.buff.popleft()
-                self.buff.append(d)
-                if self.buff_size < self.lim_buff-1:
-                    self.buff_size += 1
+            data = np.atleast_2d(np.asarray(data, dtype=float))
+            n_points = data.shape[0]
+            if n_points == 0:
+                return
+            if self.buff is None:
+                self.buff = np.zeros((2*self.lim_buff, data.shape[1]))
+            self.buff_size = min(self.buff_size + n_points, self.lim_buff)
+            if n_points > self.lim_buff:
+                data = data[-self.lim_buff:]
+                n_points = self.lim_buff
+            # bulk write into both mirrors, wrapping around at most once
+            first = min(n_points, self.lim_buff - self.head)
+            for offset in (0, self.lim_buff):
+                self.buff[offset+self.head:offset+self.head+first] = data[:first]
+                self.buff[offset:offset+n_points-first] = data[first:]
+            self.head = (self.head + n_points) % self.lim_buff
 
         def access_buffer(self):
-            c_buffer = []
-            for _ in range(self.lim_buff):
-                d = self.buff.popleft()
-                if d:
-                    c_buffer.append(d)  # only access those are not None
-                self.buff.append(d)
-            return c_buffer
+            # view of the newest buff_size samples: (buff_size, n_chans+1)
+            if self.buff is None:
+                return np.empty((0, 0))
+            end = self.head + self.lim_buff
+            return self.buff[end-self.buff_size:end]
 
         def is_full(self):
-            return self.buff_size == self.lim_buff-1
+            return self.buff_size == self.lim_buff
+
+    class _Subscriber(queue.Queue):
+        """
+        Bounded input queue of one subscriber.
+        policy 'drop_oldest' discards the oldest package when full, 'block'
+        applies backpressure to the publisher. The sentinel None is always
+        delivered by close().
+        """
+        def __init__(self, maxsize=0, policy='drop_oldest'):
+            if policy not in ('drop_oldest', 'block'):
+                raise ValueError('Unknown policy: ' + str(policy))
+            super().__init__(maxsize)
+            self.policy = policy
+            self.closed = False
+            self.n_published = 0
+            self.n_dropped = 0
+            self.max_lag = 0
+
+        def _drop_oldest(self):
+            self._get()
+            self.unfinished_tasks -= 1
+            self.n_dropped += 1
+
+        def publish(self, package):
+            with self.not_full:
+                if self.closed:
+                    return False
+                if 0 < self.maxsize <= self._qsize():
+                    if self.policy == 'drop_oldest':
+                        self._drop_oldest()
+                    else:
+                        while self._qsize() >= self.maxsize and not self.closed:
+                            self.not_full.wait()
+                        if self.closed:
+                            return False
+                self._put(package)
+                self.unfinished_tasks += 1
+                self.n_published += 1
+                self.max_lag = max(self.max_lag, self._qsize())
+                self.not_empty.notify()
+            return True
+
+        def close(self):
+            with self.not_full:
+                if self.closed:
+                    return
+                self.closed = True
+                if self.policy == 'block':  # give a live consumer time to make room
+                    deadline = time.monotonic() + 1.0
+                    while 0 < self.maxsize <= self._qsize() and time.monotonic() < deadline:
+                        self.not_full.wait(deadline - time.monotonic())
+                if 0 < self.maxsize <= self._qsize():
+                    self._drop_oldest()
+                self._put(None)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+                self.not_full.notify_all()  # release a blocked publisher
+
+        def stats(self):
+            with self.mutex:
+                return {'lag': self._qsize(), 'max_lag': self.max_lag,
+                        'n_published': self.n_published, 'n_dropped': self.n_dropped}
 
     class _MarkerRuler:
         def __init__(self, marker=None, latency=0):
@@ -628,6 +968,7 @@ class NeuroScanPort(NeuroPort):
     def __init__(self):
         self.registered_handlers = {}
         self._input_queues = {}
+        self._subscribers = ()  # immutable snapshot read by the data pipeline
         self._output_queues = {}
         self._ts = {}
         self._t_data_pipeline = None
@@ -643,58 +984,68 @@ class NeuroScanPort(NeuroPort):
     def send(self, message):
         pass
 
+    def _publish_subscribers(self):
+        # swap the snapshot, called with register_lock held
+        self._subscribers = tuple(self._input_queues.values())
+
     def _data_pipeline(self):
         while True:
             try:
                 package = self.recv()
             except:
-                self.register_lock.acquire()
-                for key in self._input_queues:
-                    self._input_queues[key].put(None)
-                self.register_lock.release()
+                for subscriber in self._subscribers:
+                    subscriber.close()
                 break
-            # Should there be a lock?
-            self.register_lock.acquire()
-            for key in self._input_queues:
-                self._input_queues[key].put(package)
-            self.register_lock.release()
+            # no lock: the snapshot is replaced, never mutated
+            for subscriber in self._subscribers:
+                subscriber.publish(package)
+
+    def subscriber_stats(self):
+        """Lag counters of each subscriber: lag, max_lag, n_published, n_dropped."""
+        subscribers = dict(self._input_queues)
+        return {name: subscriber.stats() for name, subscriber in subscribers.items()}
 
     def establish_data_pipeline(self):
         self._t_data_pipeline = threading.Thread(target=self._data_pipeline, daemon=True, name='data_pipeline')
         self._t_data_pipeline.start()
 
-    def _save_handler(self, input_queue=None, file_name='default', info={}):
-        save_data = None
+    def _save_handler(self, input_queue=None, file_name='default', info={}, chunk_size=None):
+        # stream to <file_name>.raw/.events/.json, see StreamRecorder;
+        # convert offline with recording_to_mat
+        if chunk_size is None:
+            chunk_size = 4*self.srate
+        recorder = StreamRecorder(file_name, chunk_size=chunk_size, srate=self.srate, info=info)
         while True:
             package = input_queue.get()
             if package is None:
                 break
             r_data, extras = package
-            r_data = np.array(r_data).T
-            save_data = np.append(save_data, r_data, axis=1) if save_data is not None else r_data
+            if r_data is not None:
+                recorder.write(r_data)
             input_queue.task_done()
-        if save_data is not None and info is not None:
-            print('saving data...')
-            sio.savemat(file_name, {'data': save_data, 'info': info})
-        # np.save(file_name, save_data)
+        recorder.close()
 
-    def use_save_hook(self, file_name='default', info=None):
+    def use_save_hook(self, file_name='default', info=None, chunk_size=None):
         self.register_lock.acquire()
-        input_queue = queue.Queue()
+        input_queue = self._Subscriber()  # unbounded: never drop saved data
         self._input_queues['save'] = input_queue
+        self._publish_subscribers()
         self.register_lock.release()
-        kwargs={'file_name': file_name, 'input_queue': input_queue, 'info': info}
+        kwargs={'file_name': file_name, 'input_queue': input_queue, 'info': info,
+                'chunk_size': chunk_size}
         self._t_save_pipeline = threading.Thread(target=self._save_handler, args=(), kwargs=kwargs, daemon=True, name='save')
         self._t_save_pipeline.start()
 
     def unuse_save_hook(self):
         self.register_lock.acquire()
         if 'save' in self._input_queues:
-            self._input_queues['save'].put(None)
-            del self._input_queues['save']
+            input_queue = self._input_queues.pop('save')
+            self._publish_subscribers()
+            input_queue.close()
         self.register_lock.release()
 
-    def register_hook(self, name=None, data_type=None, handler=None, args=(), kwargs={}):
+    def register_hook(self, name=None, data_type=None, handler=None, args=(), kwargs={},
+                      maxsize=0, policy='drop_oldest'):
         if name is None:
             name = handler.__name__
 
@@ -705,15 +1056,15 @@ class NeuroScanPort(NeuroPort):
                 'tlim': None
             }
 
-        self.registered_handlers[name] = (handler, args, kwargs, data_type)
+        self.registered_handlers[name] = (handler, args, kwargs, data_type, maxsize, policy)
 
     def use_hooks(self, names=None):
         if names is None:
             names = self.registered_handlers.keys()
         self.register_lock.acquire()
         for name in names:
-            handler, args, kwargs, data_type = self.registered_handlers[name]
-            input_queue = queue.Queue()
+            handler, args, kwargs, data_type, maxsize, policy = self.registered_handlers[name]
+            input_queue = self._Subscriber(maxsize, policy)
             output_queue = queue.Queue()
             self._input_queues[name] = input_queue
             self._output_queues[name] = output_queue
@@ -728,15 +1079,17 @@ class NeuroScanPort(NeuroPort):
 
             self._ts[name] = threading.Thread(target=self._wrapper_handler, args=(), kwargs=wrapper_kwargs, name=name, daemon=True)
             self._ts[name].start()
+        self._publish_subscribers()
         self.register_lock.release()
 
     def unuse_hooks(self, names=None):
         self.register_lock.acquire()
         if names is None:
-            names = list(self._input_queues.keys())
-        for name in names:
-            self._input_queues[name].put(None)
-            del self._input_queues[name]
+            names = list(self._output_queues.keys())  # hooks only, not the save hook
+        input_queues = [self._input_queues.pop(name) for name in names]
+        self._publish_subscribers()
+        for name, input_queue in zip(names, input_queues):
+            input_queue.close()
             self._output_queues[name].put(None)
             del self._output_queues[name]
         self.register_lock.release()
@@ -751,14 +1104,14 @@ class NeuroScanPort(NeuroPort):
 
         if process_type == 'fixed':
             lim_buff, latency = tlim
-            lim_buff = np.int(lim_buff*self.srate)
-            latency = np.int(latency*self.srate)
+            lim_buff = int(lim_buff*self.srate)
+            latency = int(latency*self.srate)
             buff = self._Buff(lim_buff)
             is_trigger = self._MarkerRuler(marker=label, latency=latency)
         elif process_type == 'label':
             f_p, r_p = tlim
-            f_p = np.int(f_p*self.srate)
-            r_p = np.int(r_p*self.srate)
+            f_p = int(f_p*self.srate)
+            r_p = int(r_p*self.srate)
             lim_buff = max(r_p, 0) - f_p
             latency = max(f_p, r_p, 0)
             r_p -= f_p
@@ -776,22 +1129,24 @@ class NeuroScanPort(NeuroPort):
                 # initialization
                 r_data, extras = package
                 if process_type == 'realtime':
-                    eeg_data = deepcopy(r_data) # avoid reference trouble
+                    eeg_data = np.array(r_data) # avoid reference trouble
                     waiting_queue.append(eeg_data)
-                elif process_type == 'fixed':
-                    for d in r_data:
-                        if is_trigger(d) and buff.is_full():
-                            eeg_data = deepcopy(buff.access_buffer())
-                            waiting_queue.append(eeg_data)
-                        else:
-                            buff.buffering([d])
                 else:
-                    for d in r_data:
-                        if is_trigger(d) and buff.is_full():
-                            eeg_data = deepcopy(buff.access_buffer())
-                            waiting_queue.append(eeg_data[f_p:r_p])
-                        else:
-                            buff.buffering([d])
+                    # samples between triggers are buffered in bulk, a trigger
+                    # sample is consumed when it releases a window
+                    r_data = np.asarray(r_data)
+                    start = 0
+                    for i, d in enumerate(r_data):
+                        if is_trigger(d):
+                            buff.buffering(r_data[start:i])
+                            start = i
+                            if buff.is_full():
+                                eeg_data = buff.access_buffer()
+                                if process_type == 'label':
+                                    eeg_data = eeg_data[f_p:r_p]
+                                waiting_queue.append(eeg_data.copy())
+                                start = i + 1
+                    buff.buffering(r_data[start:])
 
                 for _ in range(len(waiting_queue)):
                     eeg_data = waiting_queue.popleft()
@@ -858,14 +1213,93 @@ class BaseDynamicStimuli:
             nElements=nElements, sizes=sizes, xys=xys, oris=oris, sfs=sfs, phases=phases,
             colors=colors, opacities=opacities, contrs=contrs)
 
+class StimulusSchedule:
+    """
+    Precomputed (n_frames, n_elements, 3) color table of one trial.
+    All frames are computed at once, so rendering a frame only takes a view.
+    """
+    def __init__(self, n_frames, refreshRate, freqs=None, phases=None, mode='sin',
+                 flash_func=np.sin, codes=None, framesPerBit=1):
+        """
+        :param n_frames: the number of frames of one trial.
+        :param refreshRate: the measured refresh rate of the monitor.
+        :param freqs: the frequency of each element, (nElements,)
+        :param phases: the initial phase of each element (pi unit), (nElements,)
+        :param mode: 'sin' (sampled sinusoid), 'square' (square wave) or 'code' (e.g. cVEP codes)
+        :param flash_func: the periodic function of 'sin' mode.
+        :param codes: 0/1 code sequences of 'code' mode, (nElements, code_length), repeated in a loop.
+        :param framesPerBit: the number of frames of each bit in 'code' mode.
+        """
+        frames = np.arange(n_frames)
+        if mode in ('sin', 'square'):
+            freqs = np.asarray(freqs, dtype=float)
+            phases = np.zeros_like(freqs) if phases is None else np.asarray(phases, dtype=float)
+            theta = 2*np.pi*frames[:, np.newaxis]*freqs/refreshRate + np.pi*phases
+            if mode == 'sin':
+                c_val = flash_func(theta)
+            else:
+                c_val = np.where(np.sin(theta) >= 0, 1., -1.)
+        elif mode == 'code':
+            codes = np.atleast_2d(np.asarray(codes))
+            bits = (frames // framesPerBit) % codes.shape[1]
+            c_val = 2.*codes[:, bits].T - 1
+        else:
+            raise ValueError('Unknown mode: ' + str(mode))
+        self.refreshRate = refreshRate
+        self.colors = np.ascontiguousarray(np.repeat(c_val[..., np.newaxis], 3, axis=-1))
+
+    def __len__(self):
+        return self.colors.shape[0]
+
+    def __getitem__(self, frameN):
+        # (nElements, 3) view of one frame, no allocation
+        return self.colors[frameN % self.colors.shape[0]]
+
+def frame_jitter(frameIntervals, refreshPeriod):
+    """
+    Frame-time jitter statistics.
+    :param frameIntervals: the recorded frame intervals (s), e.g. win.frameIntervals
+    :param refreshPeriod: the nominal refresh period (s)
+    :return: dict of n_frames, mean, std, p99 & max interval (s), and n_dropped
+        (intervals longer than 1.5 refresh periods)
+    """
+    intervals = np.asarray(frameIntervals, dtype=float)
+    if intervals.size == 0:
+        return {'n_frames': 0, 'mean': np.nan, 'std': np.nan, 'p99': np.nan,
+                'max': np.nan, 'n_dropped': 0}
+    return {'n_frames': intervals.size, 'mean': intervals.mean(), 'std': intervals.std(),
+            'p99': np.percentile(intervals, 99), 'max': intervals.max(),
+            'n_dropped': int(np.sum(intervals > 1.5*refreshPeriod))}
+
 class SSVEP(BaseDynamicStimuli):
 
+    def __init__(self, win):
+        super().__init__(win)
+        self.schedules = {}
+
     def computeColors(self, frameN, srate, freqs, phases, flash_func=np.sin):
         c_val = flash_func(2 * np.pi * freqs * frameN / srate + np.pi * phases)
         colors = np.tile(c_val, (3, 1)).T
         return colors
 
-    def update(self, frameN, freqs, phases, flash_func=np.sin, name='default'):
+    def setSchedule(self, n_frames, freqs=None, phases=None, name='default', **kwargs):
+        """
+        Precompute the color table of element array 'name' with the measured refresh rate.
+        :param n_frames: the number of frames of one trial.
+        :param kwargs: mode, flash_func, codes & framesPerBit of StimulusSchedule.
+        :return: the StimulusSchedule
+        """
+        self.schedules[name] = StimulusSchedule(n_frames, self.refreshRate, freqs, phases, **kwargs)
+        return self.schedules[name]
+
+    def update(self, frameN, freqs=None, phases=None, flash_func=np.sin, name='default'):
         els = self.els[name]
-        els.colors =  self.computeColors(frameN, self.refreshRate, freqs, phases, flash_func=flash_func)
-        els.draw()
\ No newline at end of file
+        if name in self.schedules:  # precomputed: only a view per frame
+            els.colors = self.schedules[name][frameN]
+        else:
+            els.colors =  self.computeColors(frameN, self.refreshRate, freqs, phases, flash_func=flash_func)
+        els.draw()
+
+    def frameJitter(self):
+        """Jitter statistics of win.frameIntervals (set win.recordFrameIntervals = True)."""
+        return frame_jitter(self.win.frameIntervals, self.refreshPeriod)
\ No newline at end of file
@@ -14,6 +14,8 @@ from scipy import signal
 
 import copy
 
+import mcee
+
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -49,50 +51,33 @@ del i
 #%% Filter bank:8-88Hz (10 bands/ 8Hz each)
 #%% IIR method
 # each band contain 8Hz's useful information with 1Hz's buffer zone
-n_bands = 10
-# for example, 1st band is actually 7Hz-17Hz
-sl_freq = [(8*(x+1)-4) for x in range(10)]  # the lowest stop frequencies
-pl_freq = [(8*(x+1)-2) for x in range(10)]  # the lowest pass frequencies
-ph_freq = [(8*(x+2)+2) for x in range(10)]  # the highest pass frequencies
-sh_freq = [(8*(x+2)+4) for x in range(10)]  # the highest stop frequencies
-
-# 5-D tension
-fb_data = np.zeros((n_bands, n_events, n_trials, n_chans, n_times))
-
-# make data through filter bank
-for i in range(n_bands):
-    # design Chebyshev-II iir band-pass filter
-    b, a = signal.iirdesign(wp=[pl_freq[i], ph_freq[i]], ws=[sl_freq[i], sh_freq[i]],
-                        gpass=3, gstop=18, analog=False, ftype='cheby1', fs=sfreq)
-    # filter data forward and backward to achieve zero-phase
-    fb_data[i,:,:,:,:] = signal.filtfilt(b=b, a=a, x=pk_sig, axis=-1)
-    del a, b
-    
-del i, sl_freq, pl_freq, ph_freq, sh_freq
+# for example, 1st band is actually 6Hz-18Hz (stop band: 4Hz & 20Hz)
+# Chebyshev-I band-pass filters (SOS form) designed once & cached by mcee.design_sos
+fb = mcee.FilterBank.uniform(sfreq, n_bands=10, base=8, width=2, buffer=2,
+                             ftype='cheby1', gpass=3, gstop=18, n_jobs=-1)
+n_bands = fb.n_bands
+
+# 5-D tension: (n_bands, n_events, n_trials, n_chans, n_times), zero-phase (sosfiltfilt)
+fb_data = fb.apply(pk_sig)
 print('Filter bank construction complete!')
 
 #%% IIR method 2
 # each band from m*8Hz to 90Hz
-n_bands = 10
-l_freq = [(8*(x+1)-2) for x in range(n_bands)]
-h_freq = 90
+fb = mcee.FilterBank.harmonic(sfreq, n_bands=10, base=8, width=2, high=90,
+                              order=5, rp=0.5, ftype='cheby1', n_jobs=-1)
+n_bands = fb.n_bands
 
 sns.set(style='whitegrid')
 
 fig, ax = plt.subplots(2, 1, figsize=(8, 6))
 
-# 5-D tension
-fb_data = np.zeros((n_events, n_bands, n_trials, n_chans, n_times))
+# 5-D tension: (n_bands, n_events, n_trials, n_chans, n_times)
+fb_data = fb.apply(pk_sig)
 
-# design Chebyshev I bandpass filter
 for i in range(n_bands):
-    b, a = signal.cheby1(N=5, rp=0.5, Wn=[l_freq[i], h_freq], btype='bandpass',
-                         analog=False, output='ba', fs=sfreq)
-    # filter data forward and backward to achieve zero-phase
-    fb_data[:,i,:,:,:] = signal.filtfilt(b=b, a=a, x=pk_sig, axis=-1)
     # plot figures
-    w, h = signal.freqz(b, a)
-    freq = (w*sfreq) / (2*np.pi)
+    w, h = signal.sosfreqz(fb.sos[i], worN=2048, fs=sfreq)
+    freq = w
     
     ax[0].plot(freq, 20*np.log10(abs(h)), label='band %d'%(i+1))
     ax[0].set_title('Frequency Response', fontsize=16)
@@ -108,7 +93,7 @@ for i in range(n_bands):
     ax[1].set_xlim([0, 200])
     ax[1].legend(loc='best')
     
-    del b, a, w, h, freq
+    del w, h, freq
 del i
 plt.show()
 
@@ -120,13 +105,12 @@ l_freq = [(8*(x+1)-2) for x in range(n_bands)]
 h_freq = 90
 
 # 5-D tension
-fb_data = np.zeros((n_bands, n_events, n_trials, n_chans, n_times))
+fb_data = np.zeros((n_bands, n_events, n_trials, n_chans, n_times), dtype=np.float32)
 
-# make data through filter bank
+# make data through filter bank: all events of one band in one call
 for i in range(n_bands):
-    for j in range(pk_sig.shape[0]):
-        fb_data[i,j,:,:,:] = filter_data(pk_sig[j,:,:,:], sfreq=sfreq,
-               l_freq=l_freq[i], h_freq=h_freq[i], n_jobs=4, filter_length='500ms',
-               l_trans_bandwidth=2, h_trans_bandwidth=2, method='fir',
-               phase='zero', fir_window='hamming', fir_design='firwin2',
-               pad='reflect_limited')
+    fb_data[i] = filter_data(pk_sig, sfreq=sfreq,
+           l_freq=l_freq[i], h_freq=h_freq, n_jobs=4, filter_length='500ms',
+           l_trans_bandwidth=2, h_trans_bandwidth=2, method='fir',
+           phase='zero', fir_window='hamming', fir_design='firwin2',
+           pad='reflect_limited')
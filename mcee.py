@@ -11,17 +11,34 @@ Created on Wed Dec 18 12:07:56 2019
     (6) template_phase: best initial phase of signal template
     (7) template_corr: compute correlation between real signal and template
     (8) apply_SRCA: apply SRCA model
+    (9) srca_coef: batched closed-form regression (all trials at once)
+    (10) SRCA_Plan & SRCA_Cache: compiled SRCA model & cache of filtered trials
+    (11) sine_reference: LRU bank of sine-cosine references (with QR factors & projector)
+    (12) set_dtype & compute_dtype: float32/float64 compute policy
+    (13) FilterBank: sub-band SOS filters designed once (design_sos LRU cache),
+        zero-phase multi-band filtering into one (n_bands, ...) tensor
+    (14) solve_gep: batched GEPs (Cholesky reduction), the eigen solver of
+        TRCA, DSP & the unified framework (spatial_filters)
     
 2. Two kinds of recursive algorithm to choose channels for SRCA optimization
     (1) stepwise_SRCA | including SNR, Corr and CCA method, intra-class optimization
     (2) stepwise_SRCA_fs | fisher score method, inter-class optimization
+    (3) SRCA_Gram | incremental Gram-matrix engine shared by the recursions above
 
 3. Target identification
-    (1) standard CCA
+    (1) standard CCA (cca_qr & cca_kernel: batched thin-QR/SVD CCA)
     (2) TRCA: including standard TRCA and extended-TRCA
         for normal signal and SRCA signal
-    (3) DCPM: 5 different descrimination indices for normal and SRCA signal
-    (4) corr_detect: single channel detection
+        (trca_matrix & trca_core: shared TRCA kernel, batched over events)
+        (trca_scoring: batched correlation tensor, predictions & accuracy)
+        (IncrementalTRCA: running sums, online update of one event's filter)
+        (split_view: zero-copy time segments for split_* recognizers)
+    (3) filter bank: fb_TRCA, fb_eTRCA, fb_sCCA & fb_itCCA
+        (fb_weights & fb_fusion: a*n^-b+c weighted sum of squared coefficients)
+    (4) DCPM: 5 different descrimination indices for normal and SRCA signal
+        (dsp_scatter & dsp_core: N-class DSP solved once)
+        (dcpm_scoring: batched indices of all test trials & templates)
+    (5) corr_detect: single channel detection
 
 
 @ author: Brynhildr
@@ -36,13 +53,119 @@ from numpy import corrcoef as CORR
 from numpy import newaxis as NA
 from numpy import (sin, cos)
 
+from scipy import signal
 from sklearn import linear_model
 
-import copy
+import os
 import time
+import hashlib
 from math import pi
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# %% Compute dtype policy
+# signals, templates & score tensors use the compute dtype; covariance
+# accumulation, regressions & eigen/singular value solves are promoted to float64
+_DTYPES = [np.dtype(np.float64)]
+
+def get_dtype():
+    '''Current compute dtype.'''
+    return _DTYPES[-1]
+
+def set_dtype(dtype):
+    '''
+    Set the global compute dtype
+
+    Parameters
+    ----------
+    dtype : np.float32 or np.float64
+    '''
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('Compute dtype must be float32 or float64.')
+    _DTYPES[0] = dtype
+
+@contextmanager
+def compute_dtype(dtype):
+    '''
+    Temporary compute dtype, e.g.
+        with compute_dtype(np.float32):
+            acc = TRCA(train_data, test_data)
+    '''
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('Compute dtype must be float32 or float64.')
+    _DTYPES.append(dtype)
+    try:
+        yield dtype
+    finally:
+        _DTYPES.pop()
+
+def as_compute(data):
+    '''data in the compute dtype (no copy if it already is).'''
+    return np.asarray(data, dtype=get_dtype())
 
 # %% Basic operating function
+# batched multi-linear regression (closed-form)
+def srca_coef(model_input, model_target, regression='OLS', alpha=1.0, l1_ratio=1.0):
+    '''
+    Fit the regression of every trial at once through the stacked normal equations
+
+    Parameters
+    ----------
+    model_input : (n_trials, n_chans, n_times) or (n_trials, n_times)
+        rest-state data of regression channels.
+    model_target : (n_trials, n_times)
+        rest-state data of target channel.
+    regression : str, optional
+        OLS, Ridge, Lasso or ElasticNet. The default is 'OLS'.
+        OLS & Ridge are solved in closed form, Lasso & ElasticNet still use sklearn.
+    alpha : float, optional
+        parameters used in Ridge, Lasso and EN regression. The default is 1.0.
+    l1_ratio : float, optional
+        parameters used in EN regression. The default is 1.0.
+
+    Returns
+    -------
+    coef : (n_trials, n_chans)
+        regression coefficients of each trial.
+    intercept : (n_trials,)
+        intercepts (baseline drift) of each trial.
+    '''
+    if model_input.ndim == 2:  # single regression channel
+        model_input = model_input[:, NA, :]
+    n_trials = model_input.shape[0]
+    n_chans = model_input.shape[1]
+    if regression in ['OLS', 'Ridge']:
+        # center data, which equals to fitting the intercept
+        input_mean = model_input.mean(axis=-1)   # (n_trials, n_chans)
+        target_mean = model_target.mean(axis=-1) # (n_trials,)
+        X = model_input - input_mean[..., NA]
+        y = model_target - target_mean[:, NA]
+        # normal equations: (X @ X.T + alpha*I) @ coef = X @ y
+        gram = np.einsum('tcp,tdp->tcd', X, X)   # (n_trials, n_chans, n_chans)
+        cross = np.einsum('tcp,tp->tc', X, y)    # (n_trials, n_chans)
+        if regression == 'Ridge':
+            gram[:, np.arange(n_chans), np.arange(n_chans)] += alpha
+        coef = np.linalg.solve(gram, cross[..., NA])[..., 0]
+        intercept = target_mean - np.einsum('tc,tc->t', coef, input_mean)
+    else:  # no closed-form solution
+        coef = np.zeros((n_trials, n_chans))
+        intercept = np.zeros((n_trials))
+        for i in range(n_trials):
+            if regression == 'Lasso':
+                L = linear_model.Lasso(alpha=alpha).fit(model_input[i, ...].T, model_target[i, :].T)
+            elif regression == 'ElasticNet':
+                L = linear_model.ElasticNet(alpha=alpha, l1_ratio=l1_ratio).fit(model_input[i, ...].T,
+                model_target[i, :].T)
+            else:
+                raise ValueError('Unknown regression method: ' + str(regression))
+            coef[i, :] = L.coef_
+            intercept[i] = L.intercept_
+    return coef, intercept
+
 # spatial regression component analysis (main function)
 def srca(model_input, model_target, data_input, data_target, regression='OLS',
         alpha=1.0, l1_ratio=1.0):
@@ -71,22 +194,10 @@ def srca(model_input, model_target, data_input, data_target, regression='OLS',
     extract : (n_trials, n_times)
         SRCA filtered data.
     '''
-    n_trials = data_input.shape[0]
-    n_times = data_input.shape[-1]
-    estimate = np.zeros((n_trials, n_times))  # estimate signal
-    for i in range(n_trials):  # basic operating unit: (n_times, n_chans), (n_times, 1)
-        if regression == 'OLS':
-            L = linear_model.LinearRegression().fit(model_input[i, ...].T, model_target[i, :].T)
-        elif regression == 'Ridge':
-            L = linear_model.Ridge(alpha=alpha).fit(model_input[i, ...].T, model_target[i, :].T)
-        elif regression == 'Lasso':
-            L = linear_model.Lasso(alpha=alpha).fit(model_input[i, ...].T, model_target[i, :].T)
-        elif regression == 'ElasticNet':
-            L = linear_model.ElasticNet(alpha=alpha, l1_ratio=l1_ratio).fit(model_input[i, ...].T,
-            model_target[i, :].T)
-        RI = L.intercept_
-        RC = L.coef_
-        estimate[i, :] = np.dot(RC, data_input[i, ...]) + RI
+    if data_input.ndim == 2:  # single regression channel
+        data_input = data_input[:, NA, :]
+    coef, intercept = srca_coef(model_input, model_target, regression, alpha, l1_ratio)
+    estimate = np.einsum('tc,tcp->tp', coef, data_input) + intercept[:, NA]  # estimate signal
     extract = data_target - estimate
     return extract
 
@@ -104,12 +215,9 @@ def snr_time(data):
     snr : float
         the mean of SNR sequence.
     '''
-    snr = np.zeros((data.shape[1]))             # (n_times)
-    ex = np.mat(np.mean(data, axis=0))          # one-channel data: (1, n_times)
-    temp = np.mat(np.ones((1, data.shape[0])))  # (1, n_trials)
-    minus = (temp.T * ex).A                     # (n_trials, n_times)
-    ex = (ex.A) ** 2                            # signal's power
-    var = np.mean((data - minus)**2, axis=0)    # noise's power (avg)
+    ex = np.mean(data, axis=0, keepdims=True)   # one-channel data: (1, n_times)
+    var = np.mean((data - ex)**2, axis=0)       # noise's power (avg)
+    ex = ex ** 2                                # signal's power
     snr = ex/var
     return snr
 
@@ -128,11 +236,9 @@ def pearson_corr(data):
         corr sequence.
     '''
     template = data.mean(axis=0)
-    n_trials = data.shape[0]
-    corr = np.zeros((n_trials))
-    for i in range(n_trials):
-        corr[i] = np.sum(np.tril(np.corrcoef(template, data[i,:]),-1))
-    del i
+    template = template - template.mean()
+    data = data - data.mean(axis=-1, keepdims=True)
+    corr = (data @ template) / np.sqrt(np.sum(data**2, axis=-1) * (template @ template))
     return corr
 
 # compute Fisher Score
@@ -158,15 +264,77 @@ def fisher_score(data):
     # inter-class divergence
     ite_d = np.sum(sampleNum * (miu - all_miu)**2, axis=0)
     # intra-class divergence
-    itr_d= np.zeros((groupNum, featureNum))
-    for i in range(groupNum):
-        for j in range(featureNum):
-            itr_d[i,j] = np.sum((data[i,:,j] - miu[i,j])**2)
+    itr_d = np.sum((data - miu[:, NA, :])**2, axis=1)  # (n_events, n_times)
     # fisher score
     fs = (ite_d) / np.sum(itr_d, axis=0)
     return fs
 
 # make sine wave
+class SineReference:
+    '''
+    Sine-cosine reference signal with its orthogonal decomposition
+    Arrays are read-only since they are shared through the reference bank.
+
+    Attributes
+    ----------
+    signal : (2*n_harmonics, n_points)
+        sin & cos wave of each harmonic (sin_1, cos_1, sin_2, cos_2, ...).
+    q : (n_points, 2*n_harmonics)
+        orthonormal basis of signal.T (QR factorization).
+    r : (2*n_harmonics, 2*n_harmonics)
+        upper triangular factor, signal.T = q @ r.
+    projector : (n_points, n_points)
+        orthogonal projector q @ q.T onto the reference subspace, built on first use.
+    '''
+    def __init__(self, freq, phase, n_harmonics, sfreq, n_points, start=0):
+        time_point = np.arange(start, start+n_points) / sfreq
+        harmonics = np.arange(1, n_harmonics+1)[:, NA]
+        arg = 2*pi*freq*harmonics*time_point + pi*phase  # (n_harmonics, n_points)
+        self.signal = np.stack((sin(arg), cos(arg)), axis=1).reshape((2*n_harmonics, n_points))
+        self.q, self.r = LA.qr(self.signal.T)
+        self._projector = None
+        for array in (self.signal, self.q, self.r):
+            array.flags.writeable = False
+
+    @property
+    def projector(self):
+        if self._projector is None:
+            self._projector = self.q @ self.q.T
+            self._projector.flags.writeable = False
+        return self._projector
+
+@lru_cache(maxsize=64)
+def _sine_reference(freq, phase, n_harmonics, sfreq, n_points, start):
+    return SineReference(freq, phase, n_harmonics, sfreq, n_points, start)
+
+def sine_reference(freq, n_harmonics, n_points, phase=0, sfreq=1000, start=0):
+    '''
+    Reference bank: sine-cosine reference signals kept in a bounded LRU cache
+    keyed by (freq, phase, n_harmonics, sfreq, n_points, start)
+
+    Parameters
+    ----------
+    freq : float
+        frequency / Hz.
+    n_harmonics : int
+        number of harmonics.
+    n_points : int
+        number of sampling points.
+    phase : float, optional
+        0-2 (unit: pi). The default is 0.
+    sfreq : float/int, optional
+        sampling frequency. The default is 1000.
+    start : int, optional
+        index of the first sampling point. The default is 0.
+
+    Returns
+    -------
+    reference : SineReference
+        read-only reference signal, QR factors & projector.
+    '''
+    return _sine_reference(float(freq), float(phase), int(n_harmonics), float(sfreq),
+                           int(n_points), int(start))
+
 def sinw(freq, time, phase, sfreq=1000):
     '''
     make sine wave
@@ -188,9 +356,7 @@ def sinw(freq, time, phase, sfreq=1000):
         sequence.
     '''
     n_point = int(time*sfreq)
-    time_point = np.linspace(0, (n_point-1)/sfreq, n_point)
-    wave = sin(2*pi*freq*time_point + pi*phase)
-    return wave
+    return sine_reference(freq, 1, n_point, phase, sfreq).signal[0, :].copy()
 
 # choose best template phase
 def template_phase(data, freq, step=100, sfreq=1000):
@@ -212,18 +378,22 @@ def template_phase(data, freq, step=100, sfreq=1000):
     best_phase : float
         0-1.
     '''
-    time = data.shape[-1] / sfreq
-    phase = [2*x/step for x in range(step)]
-    corr = np.zeros((step))
+    phase = np.arange(step) * 2 / step
+    # sin(x + pi*p) = sin(x)*cos(pi*p) + cos(x)*sin(pi*p): all phases from one reference
+    reference = sine_reference(freq, 1, data.shape[-1], 0, sfreq).signal
+    tar_template = cos(pi*phase)[:, NA]*reference[0] + sin(pi*phase)[:, NA]*reference[1]
     sig_template = np.mean(data, axis=0)
-    for i in range(step):
-        tar_template = sinw(freq=freq, time=time, phase=phase[i], sfreq=sfreq)
-        corr[i] = np.sum(np.tril(np.corrcoef(sig_template, tar_template), -1))
-    del i
+    corr = _corr_rows(tar_template, sig_template)
     index = np.max(np.where(corr == np.max(corr)))
     best_phase = index*2/100
     return best_phase
 
+def _corr_rows(X, y):
+    # Pearson correlation coefficient between each row of X and y
+    X = X - X.mean(axis=-1, keepdims=True)
+    y = y - y.mean()
+    return (X @ y) / np.sqrt(np.sum(X**2, axis=-1) * (y @ y))
+
 # compute correlation with artificial template
 def template_corr(data, freq, phase, sfreq=1000):
     '''
@@ -242,16 +412,187 @@ def template_corr(data, freq, phase, sfreq=1000):
     corr : (n_trials,)
         correlation sequence.
     '''
-    n_trials = data.shape[0]
-    time_length = data.shape[-1] / sfreq
-    template = sinw(freq, time_length, phase, sfreq)
-    corr = np.zeros((n_trials))
-    for i in range(n_trials):
-        corr[i] = np.sum(np.tril(np.corrcoef(template, data[i,:]),-1))
-    return corr
+    template = sine_reference(freq, 1, data.shape[-1], phase, sfreq).signal[0, :]
+    return _corr_rows(data, template)
+
+# compiled SRCA model
+class SRCA_Plan:
+    '''
+    SRCA model of several target channels, compiled for repeated application
+    Channel names are resolved to indices once; the regression channels of all
+    targets are gathered into one union, so the fitted per-trial coefficients
+    form a (n_trials, n_targets, n_union) array and all target channels are
+    estimated with a single batched matmul.
+
+    Parameters
+    ----------
+    tar_chans : list
+        names of target channels.
+    model_chans : list
+        names of SRCA channels for all target channels.
+    chans : list
+        names of all channels.
+    regression : str, optional
+        OLS, Ridge, Lasso or ElasticNet. The default is 'OLS'.
+    alpha : float, optional
+        parameters used in Ridge, Lasso and EN regression. The default is 1.0.
+    l1_ratio : float, optional
+        parameters used in EN regression. The default is 1.0.
+    sp : int, optional
+        start point of mission state. The default is 1140.
+    rest : tuple, optional
+        (start, end) points of rest state. The default is (0, 1000).
+    '''
+    def __init__(self, tar_chans, model_chans, chans, regression='OLS', alpha=1.0,
+                 l1_ratio=1.0, sp=1140, rest=(0, 1000)):
+        self.tar_index = np.array([chans.index(tc) for tc in tar_chans], dtype=int)
+        index = [[chans.index(mc) for mc in model_chan] for model_chan in model_chans]
+        self.union = np.array(sorted(set(sum(index, []))), dtype=int)
+        # positions of each target's regression channels in the union
+        self.model_index = [np.searchsorted(self.union, idx).astype(int) for idx in index]
+        self.regression = regression
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+        self.sp = sp
+        self.rest = slice(*rest)
+        self.key = (tuple(tar_chans), tuple(tuple(mc) for mc in model_chans), regression,
+                    alpha, l1_ratio, sp, tuple(rest))
+
+    def coef(self, data):
+        '''
+        Fit the regression of all target channels & trials
+
+        Parameters
+        ----------
+        data : (n_trials, n_chans, n_times)
+            dataset.
+
+        Returns
+        -------
+        coef : (n_trials, n_targets, n_union)
+            regression coefficients (zero for channels out of a target's model).
+        intercept : (n_trials, n_targets)
+            intercepts of each trial & target.
+        '''
+        n_trials = data.shape[0]
+        n_targets = len(self.tar_index)
+        w_i = data[:, self.union, self.rest].astype(np.float64)      # (n_trials, n_union, n_times)
+        w_o = data[:, self.tar_index, self.rest].astype(np.float64)  # (n_trials, n_targets, n_times)
+        coef = np.zeros((n_trials, n_targets, len(self.union)))
+        intercept = np.zeros((n_trials, n_targets))
+        if self.regression in ['OLS', 'Ridge']:
+            # one Gram matrix of the union serves every target
+            input_mean = w_i.mean(axis=-1)
+            target_mean = w_o.mean(axis=-1)
+            X = w_i - input_mean[..., NA]
+            Y = w_o - target_mean[..., NA]
+            gram = np.einsum('tcp,tdp->tcd', X, X)   # (n_trials, n_union, n_union)
+            cross = np.einsum('tkp,tcp->tkc', Y, X)  # (n_trials, n_targets, n_union)
+            for ntc, idx in enumerate(self.model_index):
+                if len(idx) == 0:
+                    continue
+                sub = gram[:, idx[:, NA], idx]
+                if self.regression == 'Ridge':
+                    sub[:, np.arange(len(idx)), np.arange(len(idx))] += self.alpha
+                coef[:, ntc, idx] = np.linalg.solve(sub, cross[:, ntc, idx][..., NA])[..., 0]
+            intercept = target_mean - np.einsum('tkc,tc->tk', coef, input_mean)
+        else:
+            for ntc, idx in enumerate(self.model_index):
+                coef[:, ntc, idx], intercept[:, ntc] = srca_coef(w_i[:, idx, :], w_o[:, ntc, :],
+                    self.regression, self.alpha, self.l1_ratio)
+        return coef, intercept
+
+    def apply(self, data):
+        '''
+        Apply SRCA model
+
+        Parameters
+        ----------
+        data : (n_trials, n_chans, n_times)
+            dataset.
+
+        Returns
+        -------
+        f_data : (n_trials, n_targets, n_times-sp)
+            SRCA filtered data.
+        '''
+        dtype = get_dtype()
+        coef, intercept = self.coef(data)
+        estimate = np.einsum('tkc,tcp->tkp', coef.astype(dtype),
+                             as_compute(data[:, self.union, self.sp:]))
+        return as_compute(data[:, self.tar_index, self.sp:]) - estimate - intercept.astype(dtype)[..., NA]
+
+    __call__ = apply
+
+
+class SRCA_Cache:
+    '''
+    Cache of SRCA filtered trials, keyed by (model key, test trial)
+    SRCA is fitted on each trial's own rest state, so one trial filtered by one
+    model never changes: applying the same models to the same trials again
+    (e.g. in cross-validation) is served from the cache.
+
+    Parameters
+    ----------
+    max_trials : int, optional
+        the largest number of cached trials, the least recently used ones are
+        dropped. The default is None (unbounded).
+    '''
+    def __init__(self, max_trials=None):
+        self.max_trials = max_trials
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def trial_key(trial):
+        return (trial.shape, trial.dtype.str,
+                hashlib.blake2b(np.ascontiguousarray(trial), digest_size=16).digest())
+
+    def apply(self, plan, data, trial_ids=None):
+        '''
+        Apply SRCA model through the cache
+
+        Parameters
+        ----------
+        plan : SRCA_Plan
+            compiled SRCA model.
+        data : (n_trials, n_chans, n_times)
+            dataset.
+        trial_ids : list, optional
+            hashable identities of trials. The default is None, i.e. trials
+            are identified by their content.
+
+        Returns
+        -------
+        f_data : (n_trials, n_targets, n_times-sp)
+            SRCA filtered data.
+        '''
+        if trial_ids is None:
+            trial_ids = [self.trial_key(trial) for trial in data]
+        keys = [(plan.key, get_dtype().str, tid) for tid in trial_ids]
+        missing = [i for i, key in enumerate(keys) if key not in self.store]
+        self.misses += len(missing)
+        self.hits += len(keys) - len(missing)
+        if missing:
+            for i, f_trial in zip(missing, plan(data[missing])):
+                self.store[keys[i]] = f_trial
+        f_data = np.stack([self.store[key] for key in keys])
+        for key in keys:
+            self.store.move_to_end(key)
+        if self.max_trials is not None:
+            while len(self.store) > self.max_trials:
+                self.store.popitem(last=False)
+        return f_data
+
+    def clear(self):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+
 
 # apply SRCA model
-def apply_SRCA(data, tar_chans, model_chans, chans, regression='OLS', sp=1140):
+def apply_SRCA(data, tar_chans, model_chans, chans, regression='OLS', sp=1140, cache=None):
     '''
     Apply SRCA model in test dataset
     
@@ -269,31 +610,21 @@ def apply_SRCA(data, tar_chans, model_chans, chans, regression='OLS', sp=1140):
         OLS, Ridge, Lasso or ElasticNet. The default is 'OLS'.
     sp : int, optional
         start point of mission state. The default is 1140.
+    cache : SRCA_Cache, optional
+        reuse filtered trials. The default is None.
         
     Returns
     -------
     f_data : (n_trials, n_chans, n_times)
         SRCA filtered data.
     '''
-    n_trials = data.shape[0]
-    n_chans = len(tar_chans)
-    n_times = data.shape[-1] - sp
-    f_data = np.zeros((n_trials, n_chans, n_times))
-    for ntc in range(len(tar_chans)):
-        target_channel = tar_chans[ntc]
-        model_chan = model_chans[ntc]
-        w_i = np.zeros((n_trials, len(model_chan), 1000))
-        sig_i = np.zeros((n_trials, len(model_chan), n_times))
-        for nc in range(len(model_chan)):
-            w_i[:, nc, :] = data[:, chans.index(model_chan[nc]), :1000]
-            sig_i[:, nc, :] = data[:, chans.index(model_chan[nc]), sp:]
-        del nc
-        w_o = data[:, chans.index(target_channel), :1000]
-        sig_o = data[:, chans.index(target_channel), sp:]
-        w_ex_s = srca(model_input=w_i, model_target=w_o, data_input=sig_i,
-                      data_target=sig_o, regression=regression)
-        f_data[:, ntc, :] = w_ex_s
-    return f_data
+    plan = SRCA_Plan(tar_chans, model_chans, chans, regression, sp=sp)
+    return _apply_plan(plan, data, cache)
+
+def _apply_plan(plan, data, cache=None):
+    if cache is not None:
+        return cache.apply(plan, data)
+    return plan(data)
 
 # zero mean normalization (if necessary)
 def zero_mean(data, axis):
@@ -349,8 +680,236 @@ def corr_coef(X, y):
 
     return corrcoef.mean()
 
+# batched generalized eigenvalue problems
+def solve_gep(matrix_A, matrix_B=None, n_components=1):
+    '''
+    Batched Generalized Eigenvalue Problems (GEPs): A*W = B*W*Lambda
+    B = L*L.T (Cholesky), so the GEPs of all leading axes (e.g. bands & events)
+    become one batched symmetric eigenproblem: (L^-1)*A*(L^-T)*V = V*Lambda,
+    W = (L^-T)*V. The sign of each eigenvector is fixed: its largest-magnitude
+    element is positive.
+
+    Parameters
+    ----------
+    matrix_A : (..., n_chans, n_chans)
+        symmetric matrices.
+    matrix_B : (..., n_chans, n_chans), optional
+        symmetric positive definite matrices. If None, B = E (Type II).
+    n_components : int or None, optional
+        number of eigenvectors kept (descending eigenvalues). The default is 1.
+        None keeps all.
+
+    Returns
+    -------
+    e_va : (..., n_components)
+        eigenvalues in descending order (float64).
+    w : (..., n_components, n_chans)
+        unit-norm eigenvectors (float64).
+    '''
+    matrix_A = np.asarray(matrix_A, dtype=np.float64)
+    n_chans = matrix_A.shape[-1]
+    if n_components is None:
+        n_components = n_chans
+    if matrix_B is None:
+        e_va, vec = LA.eigh(matrix_A)
+    else:
+        inv_L = LA.inv(LA.cholesky(np.asarray(matrix_B, dtype=np.float64)))
+        e_va, vec = LA.eigh(inv_L @ matrix_A @ inv_L.swapaxes(-1, -2))
+        vec = inv_L.swapaxes(-1, -2) @ vec
+    # eigh returns ascending eigenvalues
+    e_va = e_va[..., ::-1][..., :n_components]
+    w = vec[..., ::-1][..., :n_components].swapaxes(-1, -2)
+    w = w / LA.norm(w, axis=-1, keepdims=True)
+    peak = np.take_along_axis(w, np.argmax(np.abs(w), axis=-1)[..., NA], axis=-1)
+    return e_va, w * np.sign(peak)
+
 
 # %% Stepwise SRCA
+class SRCA_Gram:
+    """
+    Stepwise engine for SRCA training.
+    The channel-by-channel Gram matrices of rest-state data are computed once per trial,
+        so adding, deleting or swapping one regression channel is a rank-one update
+        (bordered inverse) or downdate of the current inverse, instead of a refit.
+    """
+    def __init__(self, w, w_target, signal_data, data_target, regression='OLS',
+                 alpha=1.0, l1_ratio=1.0):
+        """
+        Parameters
+        ----------
+        w : (n_trials, n_chans, n_times)
+            background part input data array.
+        w_target : (n_trials, n_times)
+            background part target data array.
+        signal_data : (n_trials, n_chans, n_times)
+            signal part input data array.
+        data_target : (n_trials, n_times)
+            signal part target data array.
+        regression : str, optional
+            OLS, Ridge, Lasso or ElasticNet. The default is 'OLS'.
+            Lasso & ElasticNet have no closed-form solution and are refitted by srca().
+        alpha : float, optional
+            parameters used in Ridge, Lasso and EN regression. The default is 1.0.
+        l1_ratio : float, optional
+            parameters used in EN regression. The default is 1.0.
+        """
+        self.w = w
+        self.w_target = w_target
+        self.signal_data = signal_data
+        self.data_target = data_target
+        self.regression = regression
+        self.alpha = alpha
+        self.l1_ratio = l1_ratio
+        self.n_trials = w.shape[0]
+        self.closed_form = regression in ['OLS', 'Ridge']
+        if self.closed_form:
+            # centered Gram matrices & cross terms: computed once
+            self.input_mean = w.mean(axis=-1)          # (n_trials, n_chans)
+            self.target_mean = w_target.mean(axis=-1)  # (n_trials,)
+            X = w - self.input_mean[..., NA]
+            y = w_target - self.target_mean[:, NA]
+            self.gram = np.einsum('tcp,tdp->tcd', X, X)  # (n_trials, n_chans, n_chans)
+            self.cross = np.einsum('tcp,tp->tc', X, y)   # (n_trials, n_chans)
+            if regression == 'Ridge':
+                n_chans = w.shape[1]
+                self.gram[:, np.arange(n_chans), np.arange(n_chans)] += alpha
+
+    def inverse(self, index):
+        '''
+        Inverse Gram matrices of model channels, (n_trials, k, k)
+        '''
+        if not self.closed_form:
+            return None
+        if len(index) == 0:
+            return np.zeros((self.n_trials, 0, 0))
+        return LA.inv(self.gram[:, index, :][:, :, index])
+
+    def remove(self, inv, l):
+        '''
+        Downdate the inverse after deleting the l-th model channel, O(k^2) per trial
+        '''
+        if not self.closed_form:
+            return None
+        keep = [i for i in range(inv.shape[-1]) if i != l]
+        a = inv[:, keep, l]  # (n_trials, k-1)
+        return inv[:, keep, :][:, :, keep] - a[:, :, NA]*a[:, NA, :]/inv[:, l, l][:, NA, NA]
+
+    def scores(self, inv, index, candidates, objective):
+        '''
+        Evaluate the objective function for each "model channels + one candidate" set
+
+        Parameters
+        ----------
+        inv : (n_trials, k, k)
+            inverse Gram matrices of current model channels.
+        index : list of int
+            indices of current model channels.
+        candidates : list of int
+            indices of candidate channels.
+        objective : callable
+            objective(extract) -> float.
+
+        Returns
+        -------
+        para : (n_candidates,)
+        '''
+        para = np.zeros((len(candidates)))
+        if not self.closed_form:
+            for nc, m in enumerate(candidates):
+                temp_index = index + [m]
+                extract = srca(self.w[:, temp_index, :], self.w_target,
+                               self.signal_data[:, temp_index, :], self.data_target,
+                               self.regression, self.alpha, self.l1_ratio)
+                para[nc] = objective(extract)
+            return para
+        # shared by all candidates
+        coef = np.einsum('tij,tj->ti', inv, self.cross[:, index])  # (n_trials, k)
+        task = self.signal_data[:, index, :]                         # (n_trials, k, n_times)
+        estimate = np.einsum('tk,tkp->tp', coef, task)
+        for nc, m in enumerate(candidates):
+            # bordered inverse: Schur complement of the new channel
+            g = self.gram[:, index, m]                               # (n_trials, k)
+            u = np.einsum('tij,tj->ti', inv, g)
+            schur = self.gram[:, m, m] - np.einsum('ti,ti->t', g, u)
+            coef_m = (self.cross[:, m] - np.einsum('ti,ti->t', g, coef)) / schur
+            new_coef = coef - u*coef_m[:, NA]
+            intercept = self.target_mean - np.einsum('tk,tk->t', new_coef,
+                self.input_mean[:, index]) - coef_m*self.input_mean[:, m]
+            # estimate = new_coef @ task + coef_m * task_m + intercept
+            temp_estimate = estimate - coef_m[:, NA]*np.einsum('tk,tkp->tp', u, task)
+            temp_estimate += coef_m[:, NA]*self.signal_data[:, m, :] + intercept[:, NA]
+            para[nc] = objective(self.data_target - temp_estimate)
+        return para
+
+def stepwise_search(chans, mpara, engine, objective):
+    '''
+    Forward & backward stepwise recursion shared by SRCA_train and stepwise_SRCA_fs
+
+    Parameters
+    ----------
+    chans : list
+        the list order corresponds to the data array's.
+    mpara : float
+        the mean of original signal's parameters.
+    engine : SRCA_Gram
+    objective : callable
+        objective(extract) -> float.
+
+    Returns
+    -------
+    model_chans : list
+    para_change : list
+    '''
+    pool = list(range(len(chans)))  # candidate channels
+    core = []                        # model channels
+    inv = engine.inverse(core)
+    para_change = []
+    stop = False
+    j = 1
+    while pool:
+        # add 1 channel respectively & keep the one which can improve parameters most
+        compare_para = engine.scores(inv, core, pool, objective) - mpara
+        chan_index = np.max(np.where(compare_para == np.max(compare_para)))
+        core.append(pool.pop(chan_index))
+        para_change.append(compare_para[chan_index])
+        inv = engine.inverse(core)
+        if j == 1:
+            print('Complete ' + str(j) + 'th loop')
+            j += 1
+            continue
+        # add judge condition to stop program while achieving the target
+        if para_change[-1] < np.max(para_change):
+            stop = True
+            break
+        if not pool:
+            break
+        # delete one channel except the latest one, then add a new one
+        swap_para = np.zeros((len(core)-1))
+        swap_index = []
+        for l in range(len(core)-1):
+            temp_core = core[:l] + core[l+1:]
+            temp_para = engine.scores(engine.remove(inv, l), temp_core, pool, objective) - mpara
+            add_index = np.max(np.where(temp_para == np.max(temp_para)))
+            swap_index.append(add_index)
+            swap_para[l] = temp_para[add_index]
+        # judge if there's improvement
+        if np.max(swap_para) > np.max(para_change):
+            delete_index = np.max(np.where(swap_para == np.max(swap_para)))
+            del core[delete_index]
+            core.append(pool.pop(swap_index[delete_index]))
+            para_change.append(swap_para[delete_index])
+            inv = engine.inverse(core)
+            print('Complete ' + str(j) + 'th loop')
+        else:
+            print('Complete ' + str(j) + 'th loop')
+            print("Already best in " + str(j) + " channels' condition!")
+        j += 1
+    # the last added channel makes no improvement
+    if stop:
+        core = core[:-1]
+    model_chans = [chans[i] for i in core]
+    return model_chans, para_change
+
 def SRCA_train(chans, mpara, w, w_target, signal_data, data_target, method='SNR',
                 regression='OLS', alpha=1.0, l1_ratio=1.0, freq=None, phase=None, sfreq=1000):
     '''
@@ -399,260 +958,22 @@ def SRCA_train(chans, mpara, w, w_target, signal_data, data_target, method='SNR'
     para_change : list
         list of parameter's alteration
     '''
-    # initialize variables
     print('Stepwise SRCA training...')
-    start = time.perf_counter()   
-    j = 1
-    compare_para = np.zeros((len(chans)))
-    max_loop = len(chans)   
-    remain_chans = []
-    para_change = []
-    temp_para = []
-    core_data = []
-    core_w = []
-    # begin loop
-    active = True
-    while active and len(chans) <= max_loop:
-        # initialization
-        compare_para = np.zeros((len(chans)))
-        mtemp_para = np.zeros((len(chans)))
-        # add 1 channel respectively & compare the parameter
-        for i in range(len(chans)):
-            # avoid reshape error in multi-dimension array
-            if j == 1:
-                temp_w = w[:,i,:]
-                temp_data = signal_data[:,i,:]
-            else:
-                temp_w = np.zeros((j, w.shape[0], w.shape[2]))
-                temp_w[:j-1, :, :] = core_w
-                temp_w[j-1, :, :] = w[:,i,:]                
-                temp_data = np.zeros((j, signal_data.shape[0], signal_data.shape[2]))
-                temp_data[:j-1, :, :] = core_data
-                temp_data[j-1, :, :] = signal_data[:,i,:]
-            # multi-linear regression & parameter computation
-            temp_extract = srca(temp_w, w_target, temp_data, data_target, regression)
-            del temp_w, temp_data 
-            if method == 'SNR':
-                temp_para = snr_time(temp_extract)
-            elif method == 'Corr':
-                temp_para = pearson_corr(temp_extract)
-            elif method == 'CCA':
-                temp_para = template_corr(temp_extract, freq=freq, phase=phase, sfreq=sfreq)
-            # compare the parameter with original one
-            mtemp_para[i] = np.mean(temp_para)
-            compare_para[i] = mtemp_para[i] - mpara
-        # keep the channels which can improve parameters most
-        chan_index = np.max(np.where(compare_para == np.max(compare_para)))
-        remain_chans.append(chans.pop(chan_index))
-        para_change.append(np.max(compare_para))
-        del temp_extract, compare_para, mtemp_para, temp_para      
-        # avoid reshape error at the beginning of Forward EE while refreshing data
-        if j == 1: 
-            core_w = w[:, chan_index, :]
-            core_data = signal_data[:, chan_index, :]
-            # refresh data
-            signal_data = np.delete(signal_data, chan_index, axis=1)
-            w = np.delete(w ,chan_index, axis=1)
-            # significant loop mark
-            print('Complete ' + str(j) + 'th loop')        
-        # begin stepwise part (delete & add) 
-        if j == 2:  
-            # save new data
-            temp_core_w = np.zeros((j, w.shape[0], w.shape[2]))
-            temp_core_w[0, :, :] = core_w
-            temp_core_w[1, :, :] = w[:, chan_index, :]
-            core_w = copy.deepcopy(temp_core_w)
-            del temp_core_w
-            temp_core_data = np.zeros((j, signal_data.shape[0], signal_data.shape[2]))
-            temp_core_data[0, :, :] = core_data
-            temp_core_data[1, :, :] = signal_data[:, chan_index, :]
-            core_data = copy.deepcopy(temp_core_data)
-            del temp_core_data
-            # add judge condition to stop program while achieving the target
-            if para_change[-1] < np.max(para_change):
-                print('Stepwise complete!')
-                end = time.perf_counter()
-                print('Recursive running time: ' + str(end - start) + 's')
-                # if this judgement is not passed, then there's no need to continue
-                active = False
-            # delete 1st channel, then add a new one
-            else:
-                # refresh data
-                signal_data = np.delete(signal_data, chan_index, axis=1)
-                w = np.delete(w, chan_index, axis=1)
-                # initialization
-                temp_1_chans = copy.deepcopy(remain_chans)
-                temp_1_data = copy.deepcopy(core_data)
-                temp_1_w = copy.deepcopy(core_w)
-                # delete 1st channel
-                del temp_1_chans[0]
-                temp_1_data = np.delete(temp_1_data, 0, axis=0)
-                temp_1_w = np.delete(temp_1_w, 0, axis=0)
-                # add one channel
-                temp_2_compare_para = np.zeros((signal_data.shape[1]))
-                for k in range(signal_data.shape[1]):
-                    temp_2_w = np.zeros((2, w.shape[0], w.shape[2]))
-                    temp_2_w[0, :, :] = temp_1_w
-                    temp_2_w[1, :, :] = w[:, k, :]
-                    temp_2_data = np.zeros((2, signal_data.shape[0], signal_data.shape[2]))
-                    temp_2_data[0, :, :] = temp_1_data
-                    temp_2_data[1, :, :] = signal_data[:, k, :]
-                    # mlr & compute parameters
-                    temp_2_extract = mlr(model_input=temp_2_w, model_target=w_target,
-                                         data_input=temp_2_data, data_target=data_target,
-                                         regression=regression)
-                    if method == 'SNR':
-                        temp_2_para = snr_time(temp_2_extract)
-                    elif method == 'Corr':
-                        temp_2_para = pearson_corr(temp_2_extract)
-                    elif method == 'CCA':
-                        temp_2_para = template_corr(temp_2_extract, freq=freq, phase=phase, sfreq=sfreq)
-                    mtemp_2_para = np.mean(temp_2_para)
-                    temp_2_compare_para[k] = mtemp_2_para - mpara
-                # keep the best choice
-                temp_2_chan_index = np.max(np.where(temp_2_compare_para == np.max(temp_2_compare_para)))
-                # judge if there's any improvement
-                if temp_2_compare_para[temp_2_chan_index] > para_change[-1]:  # has improvement
-                    # refresh data
-                    chan_index = temp_2_chan_index
-                    remain_chans.append(chans.pop(chan_index))
-                    para_change.append(temp_2_compare_para[temp_2_chan_index])
-                    # delete useless data & add new data
-                    core_w = np.delete(core_w, 0, axis=0)
-                    temp_2_core_w = np.zeros((2, w.shape[0], w.shape[2]))
-                    temp_2_core_w[0, :, :] = core_w
-                    temp_2_core_w[1, :, :] = w[:, chan_index, :]
-                    core_w = copy.deepcopy(temp_2_core_w)
-                    del temp_2_core_w
-                    core_data = np.delete(core_data, 0, axis=0)
-                    temp_2_core_data = np.zeros((2, signal_data.shape[0], signal_data.shape[2]))
-                    temp_2_core_data[0, :, :] = core_data
-                    temp_2_core_data[1, :, :] = signal_data[:, chan_index, :]
-                    core_data = copy.deepcopy(temp_2_core_data)
-                    del temp_2_core_data
-                    signal_data = np.delete(signal_data, chan_index, axis=1)
-                    w = np.delete(w, chan_index, axis=1)
-                    # release RAM
-                    del remain_chans[0]
-                    del temp_2_chan_index, temp_2_extract, temp_2_para
-                    del mtemp_2_para, temp_2_compare_para, temp_2_w, temp_2_data
-                    del temp_1_chans, temp_1_data, temp_1_w
-                    # significant loop mark
-                    print('Complete ' + str(j) + 'th loop')               
-                else:  # no improvement
-                    # release RAM
-                    del temp_1_chans, temp_1_data, temp_1_w
-                    # reset
-                    print("Already best in 2 channels' contidion!")
-        # now we have at least 3 elements in remain_chans,
-        # delete one channel, then add a new one
-        if j > 2:
-            # save data
-            temp_core_w = np.zeros((j, w.shape[0], w.shape[2]))
-            temp_core_w[:j-1, :, :] = core_w
-            temp_core_w[j-1, :, :] = w[:, chan_index, :]
-            core_w = copy.deepcopy(temp_core_w)
-            del temp_core_w
-            temp_core_data = np.zeros((j, signal_data.shape[0], signal_data.shape[2]))
-            temp_core_data[:j-1, :, :] = core_data
-            temp_core_data[j-1, :, :] = signal_data[:, chan_index, :]
-            core_data = copy.deepcopy(temp_core_data)
-            del temp_core_data
-            # add judge condition to stop program while achieving the target
-            if para_change[-1] < np.max(para_change):
-                print('Stepwise complete!')
-                end = time.perf_counter()
-                print('Recursive running time: ' + str(end - start) + 's')
-                # if this judge is not passed, then there's no need to continue
-                active = False
-            # now the last para_change is still the largest in the total sequence
-            else:
-                # refresh data
-                signal_data = np.delete(signal_data, chan_index, axis=1)
-                w = np.delete(w, chan_index, axis=1)
-                # initialization (make copies)
-                temp_3_chans = copy.deepcopy(remain_chans)
-                temp_3_compare_para = np.zeros((len(temp_3_chans)-1))
-                temp_3_chan_index = []
-                # delete one channel except the latest one
-                for l in range(len(temp_3_chans)-1):
-                    # initialization (make copies)
-                    temp_4_chans = copy.deepcopy(remain_chans)
-                    temp_4_data = copy.deepcopy(core_data)
-                    temp_4_w = copy.deepcopy(core_w)
-                    # delete one channel
-                    del temp_4_chans[l]
-                    temp_4_data = np.delete(temp_4_data, l, axis=0)
-                    temp_4_w = np.delete(temp_4_w, l, axis=0)
-                    # add one channel
-                    temp_4_compare_para = np.zeros((signal_data.shape[1]))
-                    for m in range(signal_data.shape[1]):
-                        temp_5_w = np.zeros((j, w.shape[0], w.shape[2]))
-                        temp_5_w[:j-1, :, :] = temp_4_w
-                        temp_5_w[j-1, :, :] = w[:, m, :]               
-                        temp_5_data = np.zeros((j, signal_data.shape[0], signal_data.shape[2]))
-                        temp_5_data[:j-1, :, :] = temp_4_data
-                        temp_5_data[j-1, :, :] = signal_data[:, m, :]
-                        # mlr & compute para
-                        temp_5_extract = mlr(model_input=temp_5_w, model_target=w_target,
-                                             data_input=temp_5_data, data_target=data_target,
-                                             regression=regression)
-                        if method == 'SNR':
-                            temp_5_para = snr_time(temp_5_extract)
-                        elif method == 'Corr':
-                            temp_5_para = pearson_corr(temp_5_extract)
-                        elif method == 'CCA':
-                            temp_5_para = template_corr(temp_5_extract, freq=freq, phase=phase, sfreq=sfreq)
-                        mtemp_5_para = np.mean(temp_5_para)
-                        temp_4_compare_para[m] = mtemp_5_para - mpara
-                    # keep the best choice
-                    temp_4_chan_index = np.max(np.where(temp_4_compare_para == np.max(temp_4_compare_para)))
-                    temp_3_chan_index.append(str(temp_4_chan_index))
-                    temp_3_compare_para[l] = temp_4_compare_para[temp_4_chan_index]
-                # judge if there's improvement
-                if np.max(temp_3_compare_para) > np.max(para_change):  # has improvement
-                    # find index
-                    delete_chan_index = np.max(np.where(temp_3_compare_para == np.max(temp_3_compare_para)))
-                    add_chan_index = int(temp_3_chan_index[delete_chan_index])
-                    # operate (refresh data)
-                    del remain_chans[delete_chan_index]
-                    remain_chans.append(chans[add_chan_index])
-                    chan_index = add_chan_index
-                    para_change.append(temp_3_compare_para[delete_chan_index])
-                    # delete useless data & add new data
-                    core_w = np.delete(core_w, delete_chan_index, axis=0)                   
-                    temp_6_core_w = np.zeros((core_w.shape[0]+1, core_w.shape[1], core_w.shape[2]))
-                    temp_6_core_w[:core_w.shape[0], :, :] = core_w
-                    temp_6_core_w[core_w.shape[0], :, :] = w[:, add_chan_index, :]
-                    core_w = copy.deepcopy(temp_6_core_w)
-                    del temp_6_core_w               
-                    core_data = np.delete(core_data, delete_chan_index, axis=0)              
-                    temp_6_core_data = np.zeros((core_data.shape[0]+1, core_data.shape[1], core_data.shape[2]))
-                    temp_6_core_data[:core_data.shape[0], :, :] = core_data
-                    temp_6_core_data[core_data.shape[0], :, :] = signal_data[:, add_chan_index, :]
-                    core_data = copy.deepcopy(temp_6_core_data)
-                    del temp_6_core_data                
-                    signal_data = np.delete(signal_data, add_chan_index, axis=1)
-                    w = np.delete(w, add_chan_index, axis=1)
-                    del chans[add_chan_index]
-                    # release RAM
-                    del temp_3_chans, temp_3_compare_para, temp_3_chan_index
-                    del temp_4_chans, temp_4_data, temp_4_w, temp_4_compare_para, temp_4_chan_index
-                    del temp_5_data, temp_5_w, temp_5_extract, mtemp_5_para, temp_5_para
-                    # significant loop mark
-                    print('Complete ' + str(j) + 'th loop')
-                # no improvement
-                else:
-                    # release RAM
-                    del temp_3_chans, temp_3_compare_para, temp_3_chan_index
-                    del temp_4_chans, temp_4_data, temp_4_w, temp_4_compare_para, temp_4_chan_index
-                    del temp_5_data, temp_5_w, temp_5_extract, mtemp_5_para, temp_5_para
-                    # reset
-                    print('Complete ' + str(j) + 'th loop')
-                    print("Already best in " + str(j) + " channels' condition!")    
-        j += 1    
-    remain_chans = remain_chans[:len(remain_chans)-1]
-    return remain_chans, para_change
+    start = time.perf_counter()
+    def objective(extract):
+        if method == 'SNR':
+            para = snr_time(extract)
+        elif method == 'Corr':
+            para = pearson_corr(extract)
+        elif method == 'CCA':
+            para = template_corr(extract, freq=freq, phase=phase, sfreq=sfreq)
+        return np.mean(para)
+    engine = SRCA_Gram(w, w_target, signal_data, data_target, regression, alpha, l1_ratio)
+    model_chans, para_change = stepwise_search(chans, mpara, engine, objective)
+    print('Stepwise complete!')
+    end = time.perf_counter()
+    print('Recursive running time: ' + str(end - start) + 's')
+    return model_chans, para_change
 
 def stepwise_SRCA_fs(chans, mfs, w, w_target, signal_data, data_target, regression):
     '''
@@ -668,180 +989,195 @@ def stepwise_SRCA_fs(chans, mfs, w, w_target, signal_data, data_target, regressi
         para_change: list of fisher score's alteration
     '''
     print('Running Stepwise SRCA...')
-    start = time.perf_counter()   
-    j = 1   
-    max_loop = len(chans)   
-    remain_chans = []
-    snr_change = []
-    core_data = []
-    core_w = []
-    active = True
+    start = time.perf_counter()
+    n_events = w.shape[0]
     n_trials = w.shape[1]
-    n_times_w = w.shape[-1]
-    n_times_s = signal_data.shape[-1]
-    while active and len(chans) <= max_loop:
-        compare_snr = np.zeros((len(chans)))
-        mtemp_snr = np.zeros((len(chans)))
-        for i in range(len(chans)):
-            temp_extract = np.zeros_like(data_target)
-            if j == 1:
-                temp_w = w[:, :, i,:]
-                temp_data = signal_data[:, :, i, :]
-                for kk in range(2):
-                    temp_extract[kk, :, :] = mlr(temp_w[kk, :, :], w_target[kk, :, :],
-                    temp_data[kk, :, :], data_target[kk, :, :], regression)
-            else:
-                temp_w = np.zeros((j, 2, n_trials, n_times_w))
-                temp_w[:-1, :, :, :] = core_w
-                temp_w[-1, :, :, :] = w[:, :, i, :]                
-                temp_data = np.zeros((j, 2, n_trials, n_times_s))
-                temp_data[:-1, :, :, :] = core_data
-                temp_data[-1, :, :, :] = signal_data[:, :, i, :]
-                for kk in range(2):
-                    temp_extract[kk, :, :] = mlr(temp_w[:, kk, :, :], w_target[kk, :, :],
-                    temp_data[:, kk, :, :], data_target[kk, :, :], regression)
-            mtemp_snr[i] = np.mean(fisher_score(temp_extract))
-            compare_snr[i] = mtemp_snr[i] - mfs
-        chan_index = np.max(np.where(compare_snr == np.max(compare_snr)))
-        remain_chans.append(chans.pop(chan_index))
-        snr_change.append(np.max(compare_snr))    
-        if j == 1: 
-            core_w = w[:, :, chan_index, :]
-            core_data = signal_data[:, :, chan_index, :]
-            signal_data = np.delete(signal_data, chan_index, axis=2)
-            w = np.delete(w ,chan_index, axis=2)
-            print('Complete ' + str(j) + 'th loop')         
-        if j == 2:  
-            temp_core_w = np.zeros((j, 2, n_trials, n_times_w))
-            temp_core_w[0, :, :, :] = core_w
-            temp_core_w[1, :, :, :] = w[:, :, chan_index, :]
-            core_w = copy.deepcopy(temp_core_w)
-            temp_core_data = np.zeros((j, 2, n_trials, n_times_s))
-            temp_core_data[0, :, :, :] = core_data
-            temp_core_data[1, :, :, :] = signal_data[:, :, chan_index, :]
-            core_data = copy.deepcopy(temp_core_data)
-            if snr_change[-1] < np.max(snr_change):
-                print('Stepwise EE complete!')
-                end = time.perf_counter()
-                print('Recursive running time: ' + str(end - start) + 's')
-                active = False
-            else:
-                signal_data = np.delete(signal_data, chan_index, axis=2)
-                w = np.delete(w, chan_index, axis=2)
-                temp_1_chans = copy.deepcopy(remain_chans)
-                temp_1_data = copy.deepcopy(core_data)
-                temp_1_w = copy.deepcopy(core_w)
-                del temp_1_chans[0]
-                temp_1_data = np.delete(temp_1_data, 0, axis=0)
-                temp_1_w = np.delete(temp_1_w, 0, axis=0)
-                temp_2_compare_snr = np.zeros((signal_data.shape[2]))
-                for k in range(signal_data.shape[2]):
-                    temp_2_w = np.zeros((2, 2, n_trials, n_times_w))
-                    temp_2_w[0, :, :, :] = temp_1_w
-                    temp_2_w[1, :, :, :] = w[:, :, k, :]
-                    temp_2_data = np.zeros((2, 2, n_trials, n_times_s))
-                    temp_2_data[0, :, :, :] = temp_1_data
-                    temp_2_data[1, :, :, :] = signal_data[:, :, k, :]
-                    temp_2_extract = np.zeros_like(data_target)
-                    for kk in range(2):
-                        temp_2_extract[kk, :, :] = mlr(temp_2_w[:, kk, :, :],
-                            w_target[kk, :, :], temp_2_data[:, kk, :, :],
-                            data_target[kk, :, :], regression)
-                    mtemp_2_snr = np.mean(fisher_score(temp_2_extract))
-                    temp_2_compare_snr[k] = mtemp_2_snr - mfs
-                temp_2_chan_index = np.max(np.where(temp_2_compare_snr == np.max(temp_2_compare_snr)))
-                if temp_2_compare_snr[temp_2_chan_index] > snr_change[-1]:
-                    chan_index = temp_2_chan_index
-                    remain_chans.append(chans.pop(chan_index))
-                    snr_change.append(temp_2_compare_snr[temp_2_chan_index])
-                    core_w = np.delete(core_w, 0, axis=0)
-                    temp_2_core_w = np.zeros((2, 2, n_trials, n_times_w))
-                    temp_2_core_w[0, :, :, :] = core_w
-                    temp_2_core_w[1, :, :, :] = w[:, :, chan_index, :]
-                    core_w = copy.deepcopy(temp_2_core_w)
-                    core_data = np.delete(core_data, 0, axis=0)
-                    temp_2_core_data = np.zeros((2, 2, n_trials, n_times_s))
-                    temp_2_core_data[0, :, :, :] = core_data
-                    temp_2_core_data[1, :, :, :] = signal_data[:, :, chan_index, :]
-                    core_data = copy.deepcopy(temp_2_core_data)
-                    signal_data = np.delete(signal_data, chan_index, axis=2)
-                    w = np.delete(w, chan_index, axis=2)
-                    del remain_chans[0]
-                    print('Complete ' + str(j) + 'th loop')               
-                else:
-                    print("Already best in 2 channels' contidion!")
-        if j > 2:
-            temp_core_w = np.zeros((j, 2, n_trials, n_times_w))
-            temp_core_w[:-1, :, :, :] = core_w
-            temp_core_w[-1, :, :, :] = w[:, :, chan_index, :]
-            core_w = copy.deepcopy(temp_core_w)
-            temp_core_data = np.zeros((j, 2, n_trials, n_times_s))
-            temp_core_data[:-1, :, :, :] = core_data
-            temp_core_data[-1, :, :, :] = signal_data[:, :, chan_index, :]
-            core_data = copy.deepcopy(temp_core_data)
-            if snr_change[-1] < np.max(snr_change):
-                print('Stepwise EE complete!')
-                end = time.perf_counter()
-                print('Recursive running time: ' + str(end - start) + 's')
-                active = False
+    # regression is trial-wise, so events & trials share one axis in the engine
+    engine = SRCA_Gram(w.reshape((n_events*n_trials,) + w.shape[2:]),
+                       w_target.reshape((n_events*n_trials, -1)),
+                       signal_data.reshape((n_events*n_trials,) + signal_data.shape[2:]),
+                       data_target.reshape((n_events*n_trials, -1)), regression)
+    def objective(extract):
+        return np.mean(fisher_score(extract.reshape((n_events, n_trials, -1))))
+    model_chans, snr_change = stepwise_search(chans, mfs, engine, objective)
+    print('Stepwise EE complete!')
+    end = time.perf_counter()
+    print('Recursive running time: ' + str(end - start) + 's')
+    return model_chans, snr_change
+
+
+# %% Filter bank
+@lru_cache(maxsize=128)
+def _design_sos(sfreq, band, stop, order, ftype, rp, rs, gpass, gstop):
+    if stop is not None:  # order from pass & stop band edges
+        sos = signal.iirdesign(wp=list(band), ws=list(stop), gpass=gpass, gstop=gstop,
+                               analog=False, ftype=ftype, output='sos', fs=sfreq)
+    else:
+        sos = signal.iirfilter(N=order, Wn=list(band), rp=rp, rs=rs, btype='bandpass',
+                               analog=False, ftype=ftype, output='sos', fs=sfreq)
+    sos.flags.writeable = False
+    return sos
+
+def design_sos(sfreq, band, stop=None, order=5, ftype='cheby1', rp=0.5, rs=40, gpass=3, gstop=18):
+    '''
+    Band-pass IIR filter in second-order sections, kept in a bounded LRU cache
+    keyed by (sfreq, band edges, order & ripples)
+
+    Parameters
+    ----------
+    sfreq : float
+        sampling frequency.
+    band : tuple
+        (low, high) pass band edges / Hz.
+    stop : tuple, optional
+        (low, high) stop band edges / Hz, the order is then the minimum one
+        meeting gpass & gstop (iirdesign). The default is None (fixed order).
+    order : int, optional
+        filter order (without stop band). The default is 5.
+    ftype : str, optional
+        'cheby1', 'cheby2', 'butter' or 'ellip'. The default is 'cheby1'.
+    rp, rs : float, optional
+        pass band ripple & stop band attenuation / dB. The default is 0.5 & 40.
+    gpass, gstop : float, optional
+        pass band loss & stop band attenuation of iirdesign / dB. The default is 3 & 18.
+
+    Returns
+    -------
+    sos : (n_sections, 6)
+        read-only second-order sections.
+    '''
+    stop = None if stop is None else (float(stop[0]), float(stop[1]))
+    return _design_sos(float(sfreq), (float(band[0]), float(band[1])), stop, int(order),
+                       ftype, float(rp), float(rs), float(gpass), float(gstop))
+
+class FilterBank:
+    '''
+    Sub-band filters designed once (SOS form) and applied with zero-phase
+    sosfiltfilt. Outputs are (n_bands, ...) tensors whose band axis is batched
+    by TRCA_compute, trca_scoring & cca_kernel (FB-TRCA/FBCCA).
+
+    Parameters
+    ----------
+    sfreq : float
+        sampling frequency.
+    bands : list of tuple
+        (low, high) pass band edges of each sub-band / Hz.
+    stops : list of tuple, optional
+        (low, high) stop band edges of each sub-band. The default is None.
+    dtype : optional
+        dtype of outputs. The default is np.float32.
+    n_jobs : int, optional
+        number of threads, -1 means all processors. The default is 1.
+    max_cached : int, optional
+        number of filtered datasets kept by cached(). The default is 2.
+    **design :
+        other parameters of design_sos (order, ftype, rp, rs, gpass, gstop).
+    '''
+    def __init__(self, sfreq, bands, stops=None, dtype=np.float32, n_jobs=1, max_cached=2,
+                 **design):
+        self.sfreq = sfreq
+        self.bands = [tuple(band) for band in bands]
+        self.stops = [None]*len(self.bands) if stops is None else [tuple(s) for s in stops]
+        self.dtype = np.dtype(dtype)
+        self.n_jobs = n_jobs
+        self.max_cached = max_cached
+        self.design = design
+        # sosfilt needs writable sections: copy the shared designs
+        self.sos = [design_sos(sfreq, band, stop, **design).copy()
+                    for band, stop in zip(self.bands, self.stops)]
+        self.store = OrderedDict()
+
+    @classmethod
+    def harmonic(cls, sfreq, n_bands=10, base=8, width=2, high=90, **kwargs):
+        '''
+        Sub-bands from m*base-width to high Hz (m = 1, ..., n_bands),
+        the filter bank of FBCCA (Chen et al. 2015).
+        '''
+        bands = [(base*(nb+1)-width, high) for nb in range(n_bands)]
+        return cls(sfreq, bands, **kwargs)
+
+    @classmethod
+    def uniform(cls, sfreq, n_bands=10, base=8, width=2, buffer=2, **kwargs):
+        '''
+        Sub-bands from m*base-width to (m+1)*base+width Hz, each with buffer Hz
+        transition bands on both sides (minimum order by iirdesign).
+        '''
+        bands = [(base*(nb+1)-width, base*(nb+2)+width) for nb in range(n_bands)]
+        stops = [(low-buffer, high+buffer) for low, high in bands]
+        return cls(sfreq, bands, stops, **kwargs)
+
+    @property
+    def n_bands(self):
+        return len(self.sos)
+
+    def apply(self, data, out=None):
+        '''
+        Filter data through all sub-bands
+
+        Parameters
+        ----------
+        data : (..., n_times)
+            input data array, e.g. (n_events, n_trials, n_chans, n_times).
+        out : (n_bands, ..., n_times), optional
+            preallocated output. The default is None.
+
+        Returns
+        -------
+        fb_data : (n_bands, ..., n_times)
+            filtered data.
+        '''
+        data = np.asarray(data)
+        if out is None:
+            out = np.empty((self.n_bands,) + data.shape, dtype=self.dtype)
+        elif out.shape != (self.n_bands,) + data.shape:
+            raise ValueError('out must be of shape (n_bands,) + data.shape.')
+        # one job per (band, leading index), so threads are busy with few bands too
+        n_lead = data.shape[0] if data.ndim > 1 else 1
+        jobs = [(nb, nl) for nb in range(self.n_bands) for nl in range(n_lead)]
+
+        def run(job):
+            nb, nl = job
+            if data.ndim > 1:
+                out[nb, nl] = signal.sosfiltfilt(self.sos[nb], data[nl], axis=-1)
             else:
-                signal_data = np.delete(signal_data, chan_index, axis=2)
-                w = np.delete(w, chan_index, axis=2)
-                temp_3_chans = copy.deepcopy(remain_chans)
-                temp_3_compare_snr = np.zeros((len(temp_3_chans)-1))
-                temp_3_chan_index = []
-                for l in range(len(temp_3_chans)-1):
-                    temp_4_chans = copy.deepcopy(remain_chans)
-                    temp_4_data = copy.deepcopy(core_data)
-                    temp_4_w = copy.deepcopy(core_w)
-                    del temp_4_chans[l]
-                    temp_4_data = np.delete(temp_4_data, l, axis=0)
-                    temp_4_w = np.delete(temp_4_w, l, axis=0)
-                    temp_4_compare_snr = np.zeros((signal_data.shape[2]))
-                    for m in range(signal_data.shape[2]):
-                        temp_5_w = np.zeros((j, 2, n_trials, n_times_w))
-                        temp_5_w[:-1, :, :, :] = temp_4_w
-                        temp_5_w[-1, :, :, :] = w[:, :, m, :]               
-                        temp_5_data = np.zeros((j, 2, n_trials, n_times_s))
-                        temp_5_data[:-1, :, :, :] = temp_4_data
-                        temp_5_data[-1, :, :, :] = signal_data[:, :, m, :]
-                        temp_5_extract = np.zeros_like(data_target)
-                        for kk in range(2):
-                            temp_5_extract[kk, :, :] = mlr(temp_5_w[:, kk, :, :],
-                                w_target[kk, :, :], temp_5_data[:, kk, :, :],
-                                data_target[kk, :, :], regression)
-                        mtemp_5_snr = np.mean(fisher_score(temp_5_extract))
-                        temp_4_compare_snr[m] = mtemp_5_snr - mfs
-                    temp_4_chan_index = np.max(np.where(temp_4_compare_snr == np.max(temp_4_compare_snr)))
-                    temp_3_chan_index.append(str(temp_4_chan_index))
-                    temp_3_compare_snr[l] = temp_4_compare_snr[temp_4_chan_index]
-                if np.max(temp_3_compare_snr) > np.max(snr_change):
-                    delete_chan_index = np.max(np.where(temp_3_compare_snr == np.max(temp_3_compare_snr)))
-                    add_chan_index = int(temp_3_chan_index[delete_chan_index])
-                    del remain_chans[delete_chan_index]
-                    remain_chans.append(chans[add_chan_index])
-                    chan_index = add_chan_index
-                    snr_change.append(temp_3_compare_snr[delete_chan_index])
-                    core_w = np.delete(core_w, delete_chan_index, axis=0)                   
-                    temp_6_core_w = np.zeros((core_w.shape[0]+1, 2, core_w.shape[2], core_w.shape[-1]))
-                    temp_6_core_w[:-1, :, :, :] = core_w
-                    temp_6_core_w[-1, :, :, :] = w[:, :, add_chan_index, :]
-                    core_w = copy.deepcopy(temp_6_core_w)
-                    core_data = np.delete(core_data, delete_chan_index, axis=0)              
-                    temp_6_core_data = np.zeros((core_data.shape[0]+1, 2, core_data.shape[2], core_data.shape[-1]))
-                    temp_6_core_data[:-1, :, :, :] = core_data
-                    temp_6_core_data[-1, :, :, :] = signal_data[:, :, add_chan_index, :]
-                    core_data = copy.deepcopy(temp_6_core_data)
-                    signal_data = np.delete(signal_data, add_chan_index, axis=2)
-                    w = np.delete(w, add_chan_index, axis=2)
-                    del chans[add_chan_index]
-                    print('Complete ' + str(j) + 'th loop')
-                else:
-                    print('Complete ' + str(j) + 'th loop')
-                    print("Already best in " + str(j) + " channels' condition!")    
-        j += 1    
-    remain_chans = remain_chans[:len(remain_chans)-1]
-    return remain_chans, snr_change
+                out[nb] = signal.sosfiltfilt(self.sos[nb], data, axis=-1)
+
+        n_jobs = os.cpu_count() if self.n_jobs in (None, -1) else self.n_jobs
+        if n_jobs <= 1:
+            for job in jobs:
+                run(job)
+        else:  # sosfiltfilt releases the GIL in its inner loops
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(jobs))) as executor:
+                list(executor.map(run, jobs))
+        return out
+
+    __call__ = apply
+
+    def cached(self, data):
+        '''
+        Filtered data served from a small cache keyed by the content of data,
+        so experiments on the same dataset filter it only once.
+
+        Returns
+        -------
+        fb_data : (n_bands, ..., n_times)
+            read-only filtered data.
+        '''
+        data = np.asarray(data)
+        key = (data.shape, data.dtype.str,
+               hashlib.blake2b(np.ascontiguousarray(data), digest_size=16).digest())
+        if key in self.store:
+            self.store.move_to_end(key)
+            return self.store[key]
+        fb_data = self.apply(data)
+        fb_data.flags.writeable = False
+        self.store[key] = fb_data
+        while len(self.store) > self.max_cached:
+            self.store.popitem(last=False)
+        return fb_data
+
+    def clear(self):
+        self.store.clear()
 
 
 # %% Canonical Correlation Analysis
@@ -866,14 +1202,70 @@ def sin_model(base_freq, n_bands, time, phase=0, sfreq=1000):
         sine/cosine wave model.
     """
     n_point = int(time*sfreq)
-    model = np.zeros((int(2*n_bands), n_point))
-    time_point = np.linspace(0, (n_point-1)/sfreq, n_point)
-    
-    for i in range(n_bands):
-        model[i*2, :] = sin(2*pi*(i+1)*base_freq*time_point + pi*phase)
-        model[i*2+1, :] = cos(2*pi*(i+1)*base_freq*time_point + pi*phase)
-    
-    return model
+    return sine_reference(base_freq, n_bands, n_point, phase, sfreq).signal.copy()
+
+def cca_qr(data, center=True):
+    '''
+    Thin QR factorization used by the CCA kernel
+
+    Parameters
+    ----------
+    data : ndarray, (..., n_chans, n_points)
+        input data array.
+    center : bool, optional
+        remove the mean of each channel. The default is True.
+
+    Returns
+    -------
+    q : ndarray, (..., n_points, n_chans)
+        orthonormal basis of data.T.
+    r : ndarray, (..., n_chans, n_chans)
+        upper triangular factor, data.T = q @ r.
+    '''
+    data = as_compute(data)
+    if center:
+        data = data - data.mean(axis=-1, keepdims=True)
+    return LA.qr(data.swapaxes(-1, -2))
+
+def cca_kernel(X, Y, center=True, weights=False):
+    '''
+    Batched CCA through thin-QR of both sides and the SVD of Qx.T @ Qy.
+    Leading axes of X & Y are broadcast, so many test trials and candidate
+    references are solved at once; (n_points, n_points) matrices are never formed.
+
+    Parameters
+    ----------
+    X : ndarray, (..., n_chans_x, n_points), or (q, r) from cca_qr
+        first dataset.
+    Y : ndarray, (..., n_chans_y, n_points), or (q, r) from cca_qr
+        second dataset, e.g. SineReference.signal or templates.
+    center : bool, optional
+        remove the mean of each channel (ignored for (q, r) inputs). The default is True.
+    weights : bool, optional
+        also return canonical weights. The default is False.
+
+    Returns
+    -------
+    rho : ndarray, (..., min(n_chans_x, n_chans_y))
+        all canonical correlations in descending order.
+    w_x : ndarray, (..., n_chans_x, n_chans_x)
+        canonical weights of X ordered by columns (only if weights=True),
+        w_x.T @ Xc @ Xc.T @ w_x = I.
+    w_y : ndarray, (..., n_chans_y, n_chans_y)
+        canonical weights of Y ordered by columns (only if weights=True).
+    '''
+    q_x, r_x = X if isinstance(X, tuple) else cca_qr(X, center)
+    q_y, r_y = Y if isinstance(Y, tuple) else cca_qr(Y, center)
+    M = (q_x.swapaxes(-1, -2) @ q_y).astype(np.float64)  # (..., n_chans_x, n_chans_y)
+    if not weights:
+        return np.clip(LA.svd(M, compute_uv=False), 0, 1)
+    U, rho, Vh = LA.svd(M, full_matrices=True)
+    shape_x = np.broadcast_shapes(r_x.shape, U.shape)
+    shape_y = np.broadcast_shapes(r_y.shape, Vh.shape)
+    r_x, r_y = r_x.astype(np.float64), r_y.astype(np.float64)
+    w_x = LA.solve(np.broadcast_to(r_x, shape_x), np.broadcast_to(U, shape_x))
+    w_y = LA.solve(np.broadcast_to(r_y, shape_y), np.broadcast_to(Vh.swapaxes(-1, -2), shape_y))
+    return np.clip(rho, 0, 1), w_x, w_y
 
 def CCA_compute(data, model, mode='data'):
     """
@@ -888,26 +1280,16 @@ def CCA_compute(data, model, mode='data'):
     Returns
     -------
     w : (n_chans or n_bands,)
-        spatial filters for eeg data (or model)
+        spatial filters for eeg data (or model), refering to the largest
+        canonical correlation.
 
     """
+    rho, w_x, w_y = cca_kernel(data, model, weights=True)
     if mode == 'data':
-        Z = data.T
-        projection = model.T @ LA.inv(model @ model.T) @ model
+        w = w_x[:, 0]
     elif mode == 'model':
-        Z = model.T
-        projection = data.T @ LA.inv(data @ data.T) @ data
-
-    # unified framework: type I
-    matrix_A = Z.T @ projection @ projection.T @ Z
-    matrix_B = Z.T @ Z
-
-    # solve generalized eigenvalue problem
-    e_va, e_vec = LA.eig(LA.inv(matrix_A) @ matrix_B)
-    w_index = np.argmax(e_va)
-    w = e_vec[:, w_index].T
-
-    return w
+        w = w_y[:, 0]
+    return w / LA.norm(w)
 
 def sCCA(data, base_freq, n_bands, sfreq=1000):
     """
@@ -924,33 +1306,16 @@ def sCCA(data, base_freq, n_bands, sfreq=1000):
     accuracy : float, 0-1
     """
     n_events = data.shape[0]
-    n_tests = data.shape[1]
     n_points = data.shape[-1]
-    signal_time = n_points/sfreq
-    r = np.zeros((n_events, n_tests, n_events))
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            # preparation
-            test = data[nete, nte, ...]
-            for netr in range(n_events):
-                model = sin_model(base_freq[netr], n_bands, signal_time)
-                # compute spatial filters 
-                w_X = CCA_compute(test, model, mode='data')
-                w_Y = CCA_compute(test, model, mode='model')
-
-                # dimensionality reduction
-                trans_X, trans_Y = w_X @ test, w_Y @ model
-
-                # compute correlation
-                r[nete, nte, netr] = corr_coef(trans_X, trans_Y)
+    model = np.stack([sine_reference(base_freq[netr], n_bands, n_points, sfreq=sfreq).signal
+                      for netr in range(n_events)])  # (n_events, 2*n_bands, n_points)
+
+    # r: (n_events(test), n_tests, n_events(model)), the largest canonical correlation
+    q_x, r_x = cca_qr(data)  # one factorization per test trial
+    r = cca_kernel((q_x[:, :, NA, ...], r_x[:, :, NA, ...]), cca_qr(model))[..., 0]
     
     # compute accuracy
-    accuracy = 0
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[nete, nte, :]) == nete:
-                accuracy += 1
-    accuracy /= (n_events*n_tests)
+    accuracy = np.mean(np.argmax(r, axis=-1) == np.arange(n_events)[:, NA])
 
     return accuracy
 
@@ -969,82 +1334,212 @@ def itCCA(train_data, test_data):
     accuracy : float, 0-1
     """
     n_events = train_data.shape[0]
-    n_tests = test_data.shape[1]
     template = train_data.mean(axis=1)  # (n_events, n_chans, n_points)
-    r = np.zeros((n_events, n_tests, n_events))
-
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            # preparation
-            test = test_data[nete, nte, ...]
-            for netr in range(n_events):
-                model = template[netr, ...]
-                # compute spatial filters
-                w_X = CCA_compute(test, model, mode='data')
-                w_Y = CCA_compute(test, model, mode='model')
-                
-                # dimensionality reduction
-                trans_X, trans_Y = w_X @ test, w_Y @ model
-
-                # compute correlation
-                r[nete, nte, netr] = corr_coef(trans_X, trans_Y)
+
+    # r: (n_events(test), n_tests, n_events(template)), the largest canonical correlation
+    q_x, r_x = cca_qr(test_data)  # one factorization per test trial
+    r = cca_kernel((q_x[:, :, NA, ...], r_x[:, :, NA, ...]), cca_qr(template))[..., 0]
     
     # compute accuracy
-    accuracy = 0
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[nete, nte, :]) == nete:
-                accuracy += 1
-    accuracy /= (n_events*n_tests)
+    accuracy = np.mean(np.argmax(r, axis=-1) == np.arange(n_events)[:, NA])
 
     return accuracy
 
 
 # %% Target identification: TRCA method (series)
 # pre-functions
+def trca_matrix(data, include_self=False):
+    '''
+    Covariance matrices of TRCA for all events at once
+    The inter-trial matrix uses the sum-of-trials identity:
+        sum_{i!=j} Xi @ Xj.T = (sum Xi) @ (sum Xi).T - sum Xi @ Xi.T
+
+    Parameters
+    ----------
+    data : (..., n_events, n_trials, n_chans, n_times)
+        input data array, leading axes (e.g. time segments) are batched.
+    include_self : bool, optional
+        whether S contains the terms of i==j. The default is False.
+
+    Returns
+    -------
+    s : (..., n_events, n_chans, n_chans)
+        inter-channels' inter-trial covariance (sum, unnormalized, float64).
+    q : (..., n_events, n_chans, n_chans)
+        inter-channel covariance (sum, unnormalized, float64).
+    '''
+    data = np.asarray(data, dtype=np.float64)  # S = UU.T - Q cancels: accumulate in float64
+    n_trials, n_chans, n_times = data.shape[-3:]
+    concat = data.swapaxes(-3, -2).reshape(data.shape[:-3] + (n_chans, n_trials*n_times))
+    q = concat @ concat.swapaxes(-1, -2)
+    u = data.sum(axis=-3)  # (..., n_events, n_chans, n_times)
+    s = u @ u.swapaxes(-1, -2)
+    if not include_self:
+        s -= q
+    return s, q
+
+def trca_core(data, n_components=1, include_self=False):
+    '''
+    Shared TRCA kernel: solve S @ w = lambda * Q @ w of each event
+
+    Parameters
+    ----------
+    data : (..., n_events, n_trials, n_chans, n_times)
+        input data array, leading axes (e.g. time segments) are batched.
+    n_components : int or None, optional
+        number of eigenvectors kept (descending eigenvalues).
+        The default is 1; None keeps all.
+    include_self : bool, optional
+        whether S contains the terms of i==j. The default is False.
+
+    Returns
+    -------
+    e_va : (..., n_events, n_components)
+        generalized eigenvalues in descending order.
+    w : (..., n_events, n_components, n_chans)
+        unit-norm eigenvectors.
+    '''
+    s, q = trca_matrix(data, include_self)
+    return solve_gep(s, q, n_components)  # all leading axes & events in one batched solve
+
 def TRCA_compute(data):
     '''
     Task-related component analysis (TRCA)
 
     Parameters
     ----------
-    data : (n_events, n_trials, n_chans, n_times)
+    data : (..., n_events, n_trials, n_chans, n_times)
         input data array (default z-scored after bandpass filtering).
 
     Returns
     -------
-    w : (n_events, n_chans)
+    w : (..., n_events, n_chans)
         eigenvector refering to the largest eigenvalue.
 
     '''
-    # basic information
-    n_events = data.shape[0]
-    n_trials= data.shape[1]
-    n_chans = data.shape[2]
-    n_times = data.shape[-1]
+    return trca_core(data)[1][..., 0, :]
 
-    # compute spatial filter W 
-    w = np.zeros((n_events, n_chans))
-    for ne in range(n_events):
-        # matrix Q: inter-channel covariance
-        q = np.zeros((n_chans, n_chans))
-        temp_Q = data[ne, ...].swapaxes(0,1).reshape((n_chans,-1), order='C')
-        q = (temp_Q@temp_Q.T) / (n_trials*n_times)
-        # matrix S: inter-channels' inter-trial covariance
-        s = np.zeros_like(q)
-        for nt_i in range(n_trials):
-            for nt_j in range(n_trials):
-                if nt_i != nt_j:
-                    data_i = data[ne, nt_i, ...]
-                    data_j = data[ne, nt_j, ...]
-                    s += (data_i@data_j.T) / n_times
-        # generalized eigenvalue problem
-        e_va, e_vec = LA.eig(LA.inv(q)@s)
-        w_index = np.argmax(e_va)
-        #w[ne, :] = e_vec[:, e_va.argsort()[::-1]][:,0].T
-        w[ne, :] = e_vec[:, w_index].T
-        #e_value = np.array(sorted(e_va, reverse=True))
-    return w
+class IncrementalTRCA:
+    '''
+    TRCA model updated trial by trial (online recalibration)
+    Running sums of each event are kept, so a new labelled trial costs
+    O(n_chans^2 * n_times) and only its event's eigenproblem is solved again:
+        U = sum a_i * Xi, Q = sum a_i * Xi @ Xi.T, S = U @ U.T - sum a_i^2 * Xi @ Xi.T
+    with a_i = forgetting^(age of trial i). forgetting = 1 gives TRCA_compute.
+
+    Parameters
+    ----------
+    n_events : int
+        number of events.
+    n_chans : int
+        number of channels.
+    n_times : int
+        number of time points.
+    forgetting : float, optional
+        exponential forgetting factor (0, 1]. The default is 1 (no forgetting).
+    n_components : int, optional
+        number of spatial filters of each event. The default is 1.
+
+    Attributes
+    ----------
+    w : (n_events, n_chans) or (n_events, n_components, n_chans)
+        spatial filters (zero until an event has 2 trials).
+    template : (n_events, n_chans, n_times)
+        (weighted) average of each event's trials.
+    n_trials : (n_events,)
+        number of trials received by each event.
+    '''
+    def __init__(self, n_events, n_chans, n_times, forgetting=1.0, n_components=1):
+        if not 0 < forgetting <= 1:
+            raise ValueError('forgetting must be in (0, 1].')
+        self.forgetting = forgetting
+        self.n_components = n_components
+        self.sum = np.zeros((n_events, n_chans, n_times))
+        self.q = np.zeros((n_events, n_chans, n_chans))
+        self.q_self = np.zeros((n_events, n_chans, n_chans))  # sum a_i^2 * Xi @ Xi.T
+        self.weight = np.zeros((n_events))                    # sum a_i
+        self.n_trials = np.zeros((n_events), dtype=int)
+        self.e_va = np.zeros((n_events, n_components))
+        self._w = np.zeros((n_events, n_components, n_chans))
+
+    @classmethod
+    def from_data(cls, train_data, forgetting=1.0, n_components=1):
+        '''
+        Initial model from a training dataset (n_events, n_trials, n_chans, n_times),
+        trials are added in order.
+        '''
+        n_events, n_trials, n_chans, n_times = train_data.shape
+        model = cls(n_events, n_chans, n_times, forgetting, n_components)
+        if forgetting == 1:  # all sums at once
+            data = np.asarray(train_data, dtype=np.float64)
+            model.sum = data.sum(axis=1)
+            model.q = np.einsum('ekct,ekdt->ecd', data, data, optimize=True)
+            model.q_self = model.q.copy()
+            model.weight[:] = n_trials
+            model.n_trials[:] = n_trials
+            for ne in range(n_events):
+                model._solve(ne)
+        else:
+            for ne in range(n_events):
+                for nt in range(n_trials):
+                    model.update(train_data[ne, nt], ne, solve=False)
+                model._solve(ne)
+        return model
+
+    @property
+    def w(self):
+        if self.n_components == 1:
+            return self._w[:, 0, :]
+        return self._w
+
+    @property
+    def template(self):
+        return self.sum / np.maximum(self.weight, 1e-12)[:, NA, NA]
+
+    def update(self, trial, event, solve=True):
+        '''
+        Add one labelled trial
+
+        Parameters
+        ----------
+        trial : (n_chans, n_times)
+            new trial.
+        event : int
+            index of its event.
+        solve : bool, optional
+            solve the event's eigenproblem again. The default is True.
+        '''
+        x = np.asarray(trial, dtype=np.float64)
+        xx = x @ x.T
+        a = self.forgetting
+        self.sum[event] *= a
+        self.sum[event] += x
+        self.q[event] = a*self.q[event] + xx
+        self.q_self[event] = a*a*self.q_self[event] + xx
+        self.weight[event] = a*self.weight[event] + 1
+        self.n_trials[event] += 1
+        if solve:
+            self._solve(event)
+
+    def _solve(self, event):
+        # S @ w = lambda * Q @ w of one event, as trca_core
+        if self.n_trials[event] < 2:
+            return
+        u = self.sum[event]
+        s = u @ u.T - self.q_self[event]
+        self.e_va[event], self._w[event] = solve_gep(s, self.q[event], self.n_components)
+
+    def scoring(self, test_data, ensemble=False):
+        '''
+        Target identification with the current model (see trca_scoring)
+
+        Returns
+        -------
+        r : (n_events(template), n_tests, n_events(test))
+        predict : (n_events, n_tests)
+        accuracy : float, 0-1
+        '''
+        return trca_scoring(self._w[:, 0, :], self.template, test_data, ensemble)
 
 def pearson_corr2(data_A, data_B):
     """
@@ -1068,6 +1563,104 @@ def pearson_corr2(data_A, data_B):
 
     return corr2
 
+def split_view(data, stepwidth):
+    '''
+    Divide the time axis into segments without copying
+
+    Parameters
+    ----------
+    data : (..., n_times)
+        input data array.
+    stepwidth : int
+        length of each segment, the tail shorter than stepwidth is dropped.
+
+    Returns
+    -------
+    seg_data : (seg_num, ..., stepwidth)
+        view of data.
+    '''
+    seg_num = data.shape[-1] // stepwidth
+    seg_data = data[..., :seg_num*stepwidth].reshape(data.shape[:-1] + (seg_num, stepwidth))
+    return np.moveaxis(seg_data, -2, 0)
+
+def trca_predict(r):
+    '''
+    Predictions & accuracy from TRCA correlation coefficients
+
+    Parameters
+    ----------
+    r : (..., n_events(template), n_tests, n_events(test))
+        correlation coefficients.
+
+    Returns
+    -------
+    predict : (..., n_events, n_tests)
+        predicted label of each test trial.
+    accuracy : float (or array of leading axes), 0-1
+    '''
+    n_events = r.shape[-1]
+    predict = np.argmax(r, axis=-3).swapaxes(-1, -2)
+    accuracy = np.mean(predict == np.arange(n_events)[:, NA], axis=(-2, -1))
+    return predict, accuracy
+
+def trca_scoring(w, template, test_data, ensemble=False):
+    '''
+    Batched TRCA/eTRCA target identification
+    All test trials & templates are projected with one einsum, each side is
+    normalized on its own and the whole correlation tensor is one matmul, so
+    no (templates, tests, filters, points) product is formed:
+        TRCA: Pearson correlation of 1-D projections
+        eTRCA: pearson_corr2 of 2-D projections
+    Leading axes (e.g. time segments) of all inputs are batched.
+
+    Parameters
+    ----------
+    w : (..., n_events, n_chans)
+        spatial filters.
+    template : (..., n_events, n_chans, n_times)
+        templates of each event.
+    test_data : (..., n_events, n_tests, n_chans, n_times) or
+                (..., n_events(model), n_events, n_tests, n_chans, n_times)
+        test dataset, the latter is used when test data depend on the
+        template's event (e.g. SRCA models).
+    ensemble : bool, optional
+        eTRCA (all filters) or TRCA (the event's own filter). The default is False.
+
+    Returns
+    -------
+    r : (..., n_events(template), n_tests, n_events(test))
+        correlation coefficients.
+    predict : (..., n_events, n_tests)
+        predicted label of each test trial.
+    accuracy : float (or array of leading axes), 0-1
+    '''
+    dtype = get_dtype()
+    w, template, test_data = w.astype(dtype), as_compute(template), as_compute(test_data)
+    per_model = (test_data.ndim - template.ndim == 2)
+    model = 'm' if per_model else ''
+    if ensemble:
+        temp_test = np.einsum('...fc,...%sekct->...%sekft' % (model, model), w, test_data)
+        temp_template = np.einsum('...fc,...mct->...mft', w, template)
+        # (filters, points) flattened: one matmul instead of a 5-D product
+        temp_test = temp_test.reshape(temp_test.shape[:-2] + (-1,))
+        temp_template = temp_template.reshape(temp_template.shape[:-2] + (-1,))
+    else:
+        temp_test = np.einsum('...mc,...%sekct->...mekt' % model, w, test_data)
+        temp_template = np.einsum('...mc,...mct->...mt', w, template)
+        per_model = True  # the projections of each filter differ
+    # centre & normalize each side on its own, then contract the time (& filter) axis
+    temp_test = temp_test - temp_test.mean(axis=-1, keepdims=True)
+    temp_template = temp_template - temp_template.mean(axis=-1, keepdims=True)
+    temp_test = temp_test / np.sqrt(np.sum(temp_test**2, axis=-1, keepdims=True))
+    temp_template = temp_template / np.sqrt(np.sum(temp_template**2, axis=-1, keepdims=True))
+    if per_model:  # (..., m, e, k, x) @ (..., m, 1, x, 1)
+        r = (temp_test @ temp_template[..., NA, :, NA])[..., 0]
+    else:          # (..., e, k, x) @ (..., 1, x, m)
+        r = np.moveaxis(temp_test @ temp_template[..., NA, :, :].swapaxes(-1, -2), -1, -3)
+    r = r.swapaxes(-1, -2)  # (..., n_events, n_tests, n_events)
+    predict, accuracy = trca_predict(r)
+    return r, predict, accuracy
+
 # For origin data
 def TRCA(train_data, test_data):
     '''
@@ -1091,20 +1684,7 @@ def TRCA(train_data, test_data):
     w = TRCA_compute(train_data)        # spatial filter W: (n_events, n_chans)
 
     # target identification
-    r = np.zeros((n_events, n_tests, n_events))
-    for netr in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            for nete in range(n_events):  # n_events in test dataset
-                temp_test = w[netr, :] @ test_data[nete, nte, ...]
-                temp_template = w[netr, :] @ template[netr, ...]
-                r[netr, nte, nete] = corr_coef(temp_test, temp_template)
-    # compute accuracy
-    accuracy = []
-    for nete in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, nete]) == nete:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    r, predict, accuracy = trca_scoring(w, template, test_data)
 
     return accuracy
 
@@ -1128,22 +1708,8 @@ def eTRCA(train_data, test_data):
     template = train_data.mean(axis=1)  # template data: (n_events, n_chans, n_times)
     w = TRCA_compute(train_data)        # spatial filter W: (n_events, n_chans)
 
-    # target identification
-    r = np.zeros((n_events, n_tests, n_events))
-    for netr in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            for nete in range(n_events):  # n_events in test dataset
-                temp_test = w @ test_data[nete, nte, ...]
-                temp_template = w @ template[netr, ...]
-                r[netr, nte, nete] = pearson_corr2(temp_test, temp_template)
-
-    # compute accuracy
-    accuracy = []
-    for nete in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, nete]) == nete:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    # ensemble target identification
+    r, predict, accuracy = trca_scoring(w, template, test_data, ensemble=True)
 
     return accuracy
 
@@ -1187,132 +1753,54 @@ def split_TRCA(stepwidth, train_data, test_data, mode='total'):
 
     """
     # basic parameters
-    n_events = test_data.shape[0]
-    n_tests = test_data.shape[1]
-    n_chans = test_data.shape[2]
-    n_times = test_data.shape[-1]
     template = train_data.mean(axis=1)  # (n_events, n_chans, n_times)
-    seg_num = int(n_times/stepwidth)
-    
-    # split data
-    seg_test_data = np.zeros((1, n_events, n_tests, n_chans, stepwidth))
-    seg_template = np.zeros((1, n_events, n_chans, stepwidth))
-    for i in range(seg_num):
-        # seg_test_data: (seg_num, n_events, n_trials, n_chans, stepwidth)
-        seg_test_data = np.concatenate((seg_test_data,
-            test_data[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-        # seg_template: (seg_num, n_events, n_chans, stepwidth)
-        seg_template = np.concatenate((seg_template,
-            template[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-    seg_test_data = np.delete(seg_test_data, 0, axis=0)
-    seg_template = np.delete(seg_template, 0, axis=0)
+
+    # split data (views)
+    seg_test_data = split_view(test_data, stepwidth)  # (seg_num, n_events, n_trials, n_chans, stepwidth)
+    seg_template = split_view(template, stepwidth)    # (seg_num, n_events, n_chans, stepwidth)
 
     if mode == 'partial':  # only divide the test dataset
-        # compute spatial filter w
+        # compute spatial filter w: (n_events, n_chans)
         w = TRCA_compute(train_data)
+    elif mode == 'total':  # divide both the training and test dataset
+        # compute spatial filter w: (seg_num, n_events, n_chans)
+        w = TRCA_compute(split_view(train_data, stepwidth))
+    else:
+        raise ValueError('Unknown mode: ' + str(mode))
 
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for netr in range(n_events):  # n_events in training dataset
-                for nte in range(n_tests):
-                    for nete in range(n_events):  # n_events in test dataset
-                        temp_test = w[netr, :] @ seg_test_data[seg, nete, nte, ...]
-                        temp_template = w[netr, :] @ seg_template[seg, netr, ...]
-                        rou[seg, netr, nte, nete] = corr_coef(temp_test, temp_template)
+    # split target identification: (seg_num, n_events, n_tests, n_events)
+    rou = trca_scoring(w, seg_template, seg_test_data)[0]
 
-    elif mode == 'total':  # divide both the training and test dataset
-        # compute spatial filter w
-        seg_w = np.zeros((1, n_events, n_chans))
-        for i in range(seg_num):
-            temp_w = TRCA_compute(train_data[..., i*stepwidth:(i+1)*stepwidth])
-            seg_w = np.concatenate((seg_w, temp_w[NA, ...]), axis=0)
-        seg_w = np.delete(seg_w, 0, axis=0)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for netr in range(n_events):  # n_events in training dataset
-                for nte in range(n_tests):
-                    for nete in range(n_events):  # n_events in test dataset
-                        temp_test = seg_w[seg, netr, :] @ seg_test_data[seg, nete, nte, ...]
-                        temp_template = seg_w[seg, netr, :] @ seg_template[seg, netr, ...]
-                        rou[seg, netr, nte, nete] = corr_coef(temp_test, temp_template)
-        
     # compute accuracy
-    accuracy = []
     r = np.sum(rou, axis=0)
-    for nete in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, nete]) == nete:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    accuracy = trca_predict(r)[1]
 
     return rou, accuracy
 
 def split_eTRCA(stepwidth, train_data, test_data, mode='total'):
 
     # basic parameters
-    n_events = test_data.shape[0]
-    n_tests = test_data.shape[1]
-    n_chans = test_data.shape[2]
-    n_times = test_data.shape[-1]
     template = train_data.mean(axis=1)  # (n_events, n_chans, n_times)
-    seg_num = int(n_times/stepwidth)
-    
-    # split data
-    seg_test_data = np.zeros((1, n_events, n_tests, n_chans, stepwidth))
-    seg_template = np.zeros((1, n_events, n_chans, stepwidth))
-    for i in range(seg_num):
-        # seg_test_data: (seg_num, n_events, n_trials, n_chans, stepwidth)
-        seg_test_data = np.concatenate((seg_test_data,
-                        test_data[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-        # seg_template: (seg_num, n_events, n_chans, stepwidth)
-        seg_template = np.concatenate((seg_template,
-                        template[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-    seg_test_data = np.delete(seg_test_data, 0, axis=0)
-    seg_template = np.delete(seg_template, 0, axis=0)
+
+    # split data (views)
+    seg_test_data = split_view(test_data, stepwidth)  # (seg_num, n_events, n_trials, n_chans, stepwidth)
+    seg_template = split_view(template, stepwidth)    # (seg_num, n_events, n_chans, stepwidth)
 
     if mode == 'partial':  # only divide the test dataset
-        # compute spatial filter w
+        # compute spatial filter w: (n_events, n_chans)
         w = TRCA_compute(train_data)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for netr in range(n_events):  # n_events in training dataset
-                for nte in range(n_tests):
-                    for nete in range(n_events):  # n_events in test dataset
-                        temp_test = w @ seg_test_data[seg, nete, nte, ...]
-                        temp_template = w @ seg_template[seg, netr, ...]
-                        rou[seg, netr, nte, nete] = pearson_corr2(temp_test, temp_template)
-
     elif mode == 'total':  # divide both the training and test dataset
-        # compute spatial filter w
-        seg_w = np.zeros((1, n_events, n_chans))
-        for i in range(seg_num):
-            temp_w = TRCA_compute(train_data[..., i*stepwidth:(i+1)*stepwidth])
-            seg_w = np.concatenate((seg_w, temp_w[NA, ...]), axis=0)
-        seg_w = np.delete(seg_w, 0, axis=0)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for netr in range(n_events):  # n_events in training dataset
-                for nte in range(n_tests):
-                    for nete in range(n_events):  # n_events in test dataset
-                        temp_test = seg_w[seg, ...] @ seg_test_data[seg, nete, nte, ...]
-                        temp_template = seg_w[seg, ...] @ seg_template[seg, netr, ...]
-                        rou[seg, netr, nte, nete] = pearson_corr2(temp_test, temp_template)
+        # compute spatial filter w: (seg_num, n_events, n_chans)
+        w = TRCA_compute(split_view(train_data, stepwidth))
+    else:
+        raise ValueError('Unknown mode: ' + str(mode))
+
+    # split target identification: (seg_num, n_events, n_tests, n_events)
+    rou = trca_scoring(w, seg_template, seg_test_data, ensemble=True)[0]
 
     # compute accuracy
-    accuracy = []
     r = np.sum(rou, axis=0)
-    for nete in range(n_events):  # n_events in training dataset
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, nete]) == nete:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    accuracy = trca_predict(r)[1]
 
     return rou, accuracy
 
@@ -1325,7 +1813,7 @@ def split_eTRCA_R():
 
 # For SRCA data
 def SRCA_TRCA(train_data, test_data, tar_chans, model_chans, chans,
-              regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140):
+              regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, cache=None):
     '''
     TRCA for SRCA data
     class A using SRCA model A should be more adapted then class B using model A
@@ -1350,6 +1838,8 @@ def SRCA_TRCA(train_data, test_data, tar_chans, model_chans, chans,
         parameters used in EN regression. The default is 1.0.
     sp : int, optional
         start point of mission state. The default is 1140.
+    cache : SRCA_Cache, optional
+        reuse SRCA filtered trials across calls. The default is None.
 
     Returns
     -------
@@ -1363,47 +1853,31 @@ def SRCA_TRCA(train_data, test_data, tar_chans, model_chans, chans,
     n_times = train_data.shape[-1] - sp
 
     # config correct srca process on training dataset
-    model_sig = np.zeros((n_events, n_trains, n_chans, n_times))
+    plans = [SRCA_Plan(tar_chans, model_chans[ne::n_events], chans, regression, alpha,
+                       l1_ratio, sp) for ne in range(n_events)]  # one model per event
+    model_sig = np.zeros((n_events, n_trains, n_chans, n_times), dtype=get_dtype())
     for ne in range(n_events):
-        temp_model = model_chans[ne::n_events]  # length: len(tar_chans)
-        model_sig[ne, ...] = apply_SRCA(train_data[ne, ...], tar_chans, temp_model, chans,
-                                        regression, sp)
-    del ne, temp_model
+        model_sig[ne, ...] = _apply_plan(plans[ne], train_data[ne, ...], cache)
+    del ne
 
     # apply different srca models on one trial's data
     n_tests = test_data.shape[1]
-    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times))
-    for nes in range(n_events):      # n_events in SRCA model
-        temp_model = model_chans[nes::n_events]
-        for ner in range(n_events):  # n_events in real data
-            target_sig[nes, ner, ...] = apply_SRCA(test_data[ner, ...], tar_chans, temp_model,
-                                                        chans, regression, sp)
-    del nes, ner
+    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times), dtype=get_dtype())
+    test_trials = test_data.reshape((n_events*n_tests,) + test_data.shape[2:])
+    for nes in range(n_events):  # n_events in SRCA model, all test trials at once
+        target_sig[nes, ...] = _apply_plan(plans[nes], test_trials, cache).reshape(
+            (n_events, n_tests, n_chans, n_times))
 
     template = model_sig.mean(axis=1)  # template data: (n_events, n_chans, n_times)
     w = TRCA_compute(model_sig)        # Spatial filter W: (n_events, n_chans)
 
     # target identification
-    r = np.zeros((n_events, n_tests, n_events))  # (n_events srca, n_tests, n_events test)
-    for nes in range(n_events):                  # n_events in srca model
-        for nte in range(n_tests):               # n_tests
-            for ner in range(n_events):          # n_events in real test dataset
-                temp_test = w[nes, :] @ target_sig[nes, ner, nte,...]
-                temp_template = w[nes, :] @ template[nes, ...]
-                r[nes, nte, ner] = corr_coef(temp_test, temp_template)
-
-    # compute accuracy
-    accuracy = []
-    for ner in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, ner]) == ner:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    r, predict, accuracy = trca_scoring(w, template, target_sig)
 
     return accuracy
 
 def SRCA_eTRCA(train_data, test_data, tar_chans, model_chans, chans,
-               regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140):
+               regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, cache=None):
     '''
     Ensemble-TRCA without filter banks
     Parameters:
@@ -1416,6 +1890,7 @@ def SRCA_eTRCA(train_data, test_data, tar_chans, model_chans, chans,
         alpha: float | default 1.0, parameters used in Ridge, Lasso and EN regression
         l1_ratio: float | default 1.0, parameters used in EN regression
         sp: int | start point of mission state (default 1140)
+        cache: SRCA_Cache | default None, reuse SRCA filtered trials across calls
     Returns:
         accuracy: int | the number of correct identifications
     '''  
@@ -1424,43 +1899,26 @@ def SRCA_eTRCA(train_data, test_data, tar_chans, model_chans, chans,
     n_trains = train_data.shape[1]
     n_chans = len(tar_chans)
     n_times = train_data.shape[-1] - sp
-    model_sig = np.zeros((n_events, n_trains, n_chans, n_times))
+    plans = [SRCA_Plan(tar_chans, model_chans[ne::n_events], chans, regression, alpha,
+                       l1_ratio, sp) for ne in range(n_events)]  # one model per event
+    model_sig = np.zeros((n_events, n_trains, n_chans, n_times), dtype=get_dtype())
     for ne in range(n_events):
-        temp_model = model_chans[ne::n_events]  # length: len(tar_chans)
-        model_sig[ne, :, :, :] = apply_SRCA(train_data[ne, ...], tar_chans,
-        temp_model, chans, regression, sp)
-    del ne, temp_model
+        model_sig[ne, ...] = _apply_plan(plans[ne], train_data[ne, ...], cache)
+    del ne
 
     # apply different srca models on one trial's data
     n_tests = test_data.shape[1]
-    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times))
-    for nes in range(n_events):  # n_events in SRCA model
-        temp_model = model_chans[nes::n_events]
-        for ner in range(n_events):
-            target_sig[nes, ner, ...] = apply_SRCA(test_data[ner, ...],
-            tar_chans, temp_model, chans, regression, sp)
-    del nes, ner
+    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times), dtype=get_dtype())
+    test_trials = test_data.reshape((n_events*n_tests,) + test_data.shape[2:])
+    for nes in range(n_events):  # n_events in SRCA model, all test trials at once
+        target_sig[nes, ...] = _apply_plan(plans[nes], test_trials, cache).reshape(
+            (n_events, n_tests, n_chans, n_times))
 
     template = model_sig.mean(axis=1)
     w = TRCA_compute(model_sig)
 
-    # Ensemble target identification
-    r = np.zeros((n_events, n_tests, n_events))  # (n_events srca, n_tests, n_events test)
-    for nes in range(n_events):                  # n_events in srca model
-        for nte in range(n_tests):               # n_tests
-            for ner in range(n_events):          # n_events in test dataset
-                temp_test = np.dot(w, target_sig[nes, ner, nte, ...])
-                temp_template = np.dot(w, template[nes, ...])
-                r[nes, nte, ner] = pearson_corr2(temp_test, temp_template)
-    del nes, nte, ner
-
-    # Compute accuracy
-    accuracy = []
-    for ner in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, ner]) == ner:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    # ensemble target identification
+    r, predict, accuracy = trca_scoring(w, template, target_sig, ensemble=True)
 
     return accuracy
 
@@ -1471,7 +1929,7 @@ def SRCA_eTRCA_R():
     pass
 
 def split_SRCA_TRCA(stepwidth, train_data, test_data, tar_chans, model_chans, chans,
-                    regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, mode='total'):
+                    regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, mode='total', cache=None):
     
     # basic parameters
     n_events = test_data.shape[0]
@@ -1482,82 +1940,44 @@ def split_SRCA_TRCA(stepwidth, train_data, test_data, tar_chans, model_chans, ch
     seg_num = int(n_times/stepwidth)
 
     # config correct srca process on training dataset
-    model_sig = np.zeros((n_events, n_trains, n_chans, n_times))
+    plans = [SRCA_Plan(tar_chans, model_chans[ne::n_events], chans, regression, alpha,
+                       l1_ratio, sp) for ne in range(n_events)]  # one model per event
+    model_sig = np.zeros((n_events, n_trains, n_chans, n_times), dtype=get_dtype())
     for ne in range(n_events):
-        temp_model = model_chans[ne::n_events]  # length: len(tar_chans)
-        model_sig[ne, ...] = apply_SRCA(train_data[ne, ...], tar_chans, temp_model,
-            chans, regression, sp)
+        model_sig[ne, ...] = _apply_plan(plans[ne], train_data[ne, ...], cache)
     template = model_sig.mean(axis=1)  # template data: (n_events, n_chans, n_times)
     del ne
 
-    # apply different srca models on one trial's data
-    n_tests = test_data.shape[1]
-    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times))
-    for ne_tr in range(n_events):      # n_events in SRCA model
-        temp_model = model_chans[ne_tr::n_events]
-        for ne_re in range(n_events):  # n_events in real data
-            target_sig[ne_tr, ne_re, ...] = apply_SRCA(test_data[ne_re, ...], tar_chans,
-                temp_model, chans, regression, sp)
-    del ne_tr, ne_re
-
-    # split data
-    seg_target_data = np.zeros((1, n_events, n_events, n_tests, n_chans, stepwidth))
-    seg_template = np.zeros((1, n_events, n_chans, stepwidth))
-    for i in range(seg_num):
-        # seg_target_data: (seg_num, n_events, n_events, n_trials, n_chans, stepwidth)
-        seg_target_data = np.concatenate((seg_target_data,
-            target_sig[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-        # seg_template: (seg_num, n_events, n_chans, stepwidth)
-        seg_template = np.concatenate((seg_template,
-            template[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-    seg_target_data = np.delete(seg_target_data, 0, axis=0)
-    seg_template = np.delete(seg_template, 0, axis=0)
-    
+    # split data (views)
+    seg_template = split_view(template, stepwidth)  # (seg_num, n_events, n_chans, stepwidth)
+
     if mode == 'partial':  # only divide the test dataset
-        # compute spatial filter w
+        # compute spatial filter w: (n_events, n_chans)
         w = TRCA_compute(model_sig)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for nes in range(n_events):                  # n_events in srca model
-                for nte in range(n_tests):               # n_tests
-                    for ner in range(n_events):          # n_events in real test dataset
-                        temp_test = w[nes, :] @ seg_target_data[seg, nes, ner, nte, ...]
-                        temp_template = w[nes, :] @ seg_template[seg, nes, ...]
-                        rou[seg, nes, nte, ner] = corr_coef(temp_test, temp_template)
-    
     elif mode == 'total':  # divide both the training and test dataset
-        # compute spatial filter w
-        seg_w = np.zeros((1, n_events, n_chans))
-        for i in range(seg_num):
-            temp_w = TRCA_compute(model_sig[..., i*stepwidth:(i+1)*stepwidth])
-            seg_w = np.concatenate((seg_w, temp_w[NA, ...]), axis=0)
-        seg_w = np.delete(seg_w, 0, axis=0)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for nes in range(n_events):                  # n_events in srca model
-                for nte in range(n_tests):               # n_tests
-                    for ner in range(n_events):          # n_events in real test dataset
-                        temp_test = seg_w[seg, nes, :] @ seg_target_data[seg, nes, ner, nte, ...]
-                        temp_template = seg_w[seg, nes, :] @ seg_template[seg, nes, ...]
-                        rou[seg, nes, nte, ner] = corr_coef(temp_test, temp_template)
+        # compute spatial filter w: (seg_num, n_events, n_chans)
+        w = TRCA_compute(split_view(model_sig, stepwidth))
+    else:
+        raise ValueError('Unknown mode: ' + str(mode))
+
+    # apply different srca models on one trial's data & score model by model,
+    # so only one model's (n_events, n_tests, n_chans, n_times) signal is held
+    test_trials = test_data.reshape((n_events*n_tests,) + test_data.shape[2:])
+    rou = np.zeros((seg_num, n_events, n_tests, n_events), dtype=get_dtype())
+    for nes in range(n_events):  # n_events in SRCA model
+        target_sig = _apply_plan(plans[nes], test_trials, cache).reshape(
+            (n_events, n_tests, n_chans, n_times))
+        rou[:, nes, ...] = trca_scoring(w[..., nes:nes+1, :], seg_template[:, nes:nes+1, ...],
+            split_view(target_sig, stepwidth))[0][:, 0, ...]
 
     # compute accuracy
-    accuracy = []
     r = np.sum(rou, axis=0)
-    for ner in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, ner]) == ner:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    accuracy = trca_predict(r)[1]
 
     return rou, accuracy
 
 def split_SRCA_eTRCA(stepwidth, train_data, test_data, tar_chans, model_chans, chans,
-                    regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, mode='total'):
+                    regression='OLS', alpha=1.0, l1_ratio=1.0, sp=1140, mode='total', cache=None):
 
     # basic parameters
     n_events = test_data.shape[0]
@@ -1568,77 +1988,39 @@ def split_SRCA_eTRCA(stepwidth, train_data, test_data, tar_chans, model_chans, c
     seg_num = int(n_times/stepwidth)
 
     # config correct srca process on training dataset
-    model_sig = np.zeros((n_events, n_trains, n_chans, n_times))
+    plans = [SRCA_Plan(tar_chans, model_chans[ne::n_events], chans, regression, alpha,
+                       l1_ratio, sp) for ne in range(n_events)]  # one model per event
+    model_sig = np.zeros((n_events, n_trains, n_chans, n_times), dtype=get_dtype())
     for ne in range(n_events):
-        temp_model = model_chans[ne::n_events]  # length: len(tar_chans)
-        model_sig[ne, ...] = apply_SRCA(train_data[ne, ...], tar_chans, temp_model,
-            chans, regression, sp)
+        model_sig[ne, ...] = _apply_plan(plans[ne], train_data[ne, ...], cache)
     template = model_sig.mean(axis=1)  # template data: (n_events, n_chans, n_times)
     del ne
 
-    # apply different srca models on one trial's data
-    n_tests = test_data.shape[1]
-    target_sig = np.zeros((n_events, n_events, n_tests, n_chans, n_times))
-    for nes in range(n_events):      # n_events in SRCA model
-        temp_model = model_chans[nes::n_events]
-        for ner in range(n_events):  # n_events in real data
-            target_sig[nes, ner, ...] = apply_SRCA(test_data[ner, ...], tar_chans,
-                temp_model, chans, regression, sp)
-    del nes, ner
-
-    # split data
-    seg_target_data = np.zeros((1, n_events, n_events, n_tests, n_chans, stepwidth))
-    seg_template = np.zeros((1, n_events, n_chans, stepwidth))
-    for i in range(seg_num):
-        # seg_target_data: (seg_num, n_events, n_events, n_trials, n_chans, stepwidth)
-        seg_target_data = np.concatenate((seg_target_data,
-            target_sig[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-        # seg_template: (seg_num, n_events, n_chans, stepwidth)
-        seg_template = np.concatenate((seg_template,
-            template[NA, ..., i*stepwidth:(i+1)*stepwidth]), axis=0)
-    seg_target_data = np.delete(seg_target_data, 0, axis=0)
-    seg_template = np.delete(seg_template, 0, axis=0)
-    
+    # split data (views)
+    seg_template = split_view(template, stepwidth)  # (seg_num, n_events, n_chans, stepwidth)
+
     if mode == 'partial':  # only divide the test dataset
-        # compute spatial filter w
+        # compute spatial filter w: (n_events, n_chans)
         w = TRCA_compute(model_sig)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for nes in range(n_events):                  # n_events in srca model
-                for nte in range(n_tests):               # n_tests
-                    for ner in range(n_events):          # n_events in real test dataset
-                        temp_test = w @ seg_target_data[seg, nes, ner, nte, ...]
-                        temp_template = w @ seg_template[seg, nes, ...]
-                        rou[seg, nes, nte, ner] = pearson_corr2(temp_test, temp_template)
-    
     elif mode == 'total':  # divide both the training and test dataset
-        # compute spatial filter w
-        seg_w = np.zeros((1, n_events, n_chans))
-        for i in range(seg_num):
-            temp_w = TRCA_compute(model_sig[..., i*stepwidth:(i+1)*stepwidth])
-            seg_w = np.concatenate((seg_w, temp_w[NA, ...]), axis=0)
-        seg_w = np.delete(seg_w, 0, axis=0)
-
-        # split target identification
-        rou = np.zeros((seg_num, n_events, n_tests, n_events))
-        for seg in range(seg_num):
-            for nes in range(n_events):                  # n_events in srca model
-                for nte in range(n_tests):               # n_tests
-                    for ner in range(n_events):          # n_events in real test dataset
-                        temp_test = seg_w[seg, ...] @ seg_target_data[seg, nes, ner, nte, ...]
-                        temp_template = seg_w[seg, ...] @ seg_template[seg, nes, ...]
-                        rou[seg, nes, nte, ner] = pearson_corr2(temp_test, temp_template)
+        # compute spatial filter w: (seg_num, n_events, n_chans)
+        w = TRCA_compute(split_view(model_sig, stepwidth))
+    else:
+        raise ValueError('Unknown mode: ' + str(mode))
+
+    # apply different srca models on one trial's data & score model by model,
+    # so only one model's (n_events, n_tests, n_chans, n_times) signal is held
+    test_trials = test_data.reshape((n_events*n_tests,) + test_data.shape[2:])
+    rou = np.zeros((seg_num, n_events, n_tests, n_events), dtype=get_dtype())
+    for nes in range(n_events):  # n_events in SRCA model
+        target_sig = _apply_plan(plans[nes], test_trials, cache).reshape(
+            (n_events, n_tests, n_chans, n_times))
+        rou[:, nes, ...] = trca_scoring(w, seg_template[:, nes:nes+1, ...],
+            split_view(target_sig, stepwidth), ensemble=True)[0][:, 0, ...]
 
     # compute accuracy
-    accuracy = []
     r = np.sum(rou, axis=0)
-    for ner in range(n_events):
-        for nte in range(n_tests):
-            if np.argmax(r[:, nte, ner]) == ner:
-                accuracy.append(1)
-    accuracy = np.sum(accuracy) / (n_events*n_tests)
+    accuracy = trca_predict(r)[1]
 
     return rou, accuracy
 
@@ -1659,239 +2041,490 @@ def cvep_TI(code_num, code_length, gap_length, train_data, test_data):
     pass
 
 
+# %% Target identification: filter bank (series)
+def fb_weights(n_bands, a=1, b=1.25, c=0.25):
+    '''
+    Weights of sub-bands: w(n) = a * n^(-b) + c (n = 1, ..., n_bands)
+
+    Parameters
+    ----------
+    n_bands : int
+        number of sub-bands.
+    a, b, c : float, optional
+        The default is 1, 1.25 & 0.25 (Chen et al. 2015).
+
+    Returns
+    -------
+    weights : (n_bands,)
+    '''
+    return a * np.arange(1, n_bands+1)**(-b) + c
+
+def fb_fusion(r, weights=None):
+    '''
+    Weighted fusion of sub-band coefficients: sum_n w(n) * sign(r_n) * r_n^2
+
+    Parameters
+    ----------
+    r : (n_bands, ...)
+        coefficients of each sub-band.
+    weights : (n_bands,), optional
+        weights of sub-bands. The default is None (fb_weights).
+
+    Returns
+    -------
+    rou : (...)
+        fused coefficients.
+    '''
+    if weights is None:
+        weights = fb_weights(r.shape[0])
+    return np.tensordot(np.asarray(weights, dtype=r.dtype), np.sign(r)*r**2, axes=(0, 0))
+
+def fb_TRCA(train_data, test_data, weights=None):
+    '''
+    Filter bank TRCA (FB-TRCA)
+
+    Parameters
+    ----------
+    train_data : (n_bands, n_events, n_trials, n_chans, n_times)
+        training dataset, e.g. FilterBank.apply(data).
+    test_data : (n_bands, n_events, n_trials, n_chans, n_times)
+        test dataset.
+    weights : (n_bands,), optional
+        weights of sub-bands. The default is None (fb_weights).
+
+    Returns
+    -------
+    accuracy : float, 0-1
+    '''
+    template = train_data.mean(axis=2)  # (n_bands, n_events, n_chans, n_times)
+    w = TRCA_compute(train_data)        # filters of all bands & events: (n_bands, n_events, n_chans)
+
+    # correlation tensor of all bands at once, then one fusion
+    r = trca_scoring(w, template, test_data)[0]  # (n_bands, n_events, n_tests, n_events)
+    accuracy = trca_predict(fb_fusion(r, weights))[1]
+
+    return accuracy
+
+def fb_eTRCA(train_data, test_data, weights=None):
+    '''
+    Filter bank ensemble-TRCA (FB-eTRCA)
+
+    Parameters
+    ----------
+    train_data : (n_bands, n_events, n_trials, n_chans, n_times)
+        training dataset.
+    test_data : (n_bands, n_events, n_trials, n_chans, n_times)
+        test dataset.
+    weights : (n_bands,), optional
+        weights of sub-bands. The default is None (fb_weights).
+
+    Returns
+    -------
+    accuracy : float, 0-1
+    '''
+    template = train_data.mean(axis=2)
+    w = TRCA_compute(train_data)
+
+    r = trca_scoring(w, template, test_data, ensemble=True)[0]
+    accuracy = trca_predict(fb_fusion(r, weights))[1]
+
+    return accuracy
+
+def fb_sCCA(data, base_freq, n_bands, sfreq=1000, weights=None):
+    '''
+    Filter bank CCA (FBCCA)
+
+    Parameters
+    ----------
+    data : (n_fb, n_events, n_trials, n_chans, n_points)
+        test dataset through a filter bank.
+    base_freq : list of float/int
+        stimulus frequency of each event.
+    n_bands : int
+        number of harmonics of references.
+    sfreq : float/int, optional
+        sampling frequency. The default is 1000.
+    weights : (n_fb,), optional
+        weights of sub-bands. The default is None (fb_weights).
+
+    Returns
+    -------
+    accuracy : float, 0-1
+    '''
+    n_events, n_points = data.shape[1], data.shape[-1]
+    # references are shared by all sub-bands: one factorization
+    model = np.stack([sine_reference(base_freq[netr], n_bands, n_points, sfreq=sfreq).signal
+                      for netr in range(n_events)])  # (n_events, 2*n_bands, n_points)
+
+    # r: (n_fb, n_events(test), n_tests, n_events(model))
+    q_x, r_x = cca_qr(data)
+    r = cca_kernel((q_x[..., NA, :, :], r_x[..., NA, :, :]), cca_qr(model))[..., 0]
+
+    rou = fb_fusion(r, weights)
+    accuracy = np.mean(np.argmax(rou, axis=-1) == np.arange(n_events)[:, NA])
+
+    return accuracy
+
+def fb_itCCA(train_data, test_data, weights=None):
+    '''
+    Filter bank individual template CCA (FB-itCCA)
+
+    Parameters
+    ----------
+    train_data : (n_fb, n_events, n_trains, n_chans, n_points)
+        training dataset.
+    test_data : (n_fb, n_events, n_tests, n_chans, n_points)
+        test dataset.
+    weights : (n_fb,), optional
+        weights of sub-bands. The default is None (fb_weights).
+
+    Returns
+    -------
+    accuracy : float, 0-1
+    '''
+    n_events = train_data.shape[1]
+    q_t, r_t = cca_qr(train_data.mean(axis=2))  # templates: (n_fb, n_events, ...)
+
+    # r: (n_fb, n_events(test), n_tests, n_events(template))
+    q_x, r_x = cca_qr(test_data)
+    r = cca_kernel((q_x[..., NA, :, :], r_x[..., NA, :, :]),
+                   (q_t[:, NA, NA, ...], r_t[:, NA, NA, ...]))[..., 0]
+
+    rou = fb_fusion(r, weights)
+    accuracy = np.mean(np.argmax(rou, axis=-1) == np.arange(n_events)[:, NA])
+
+    return accuracy
+
+
 # %% Target identification: DCPM
+# pre-functions
+def dsp_scatter(data):
+    '''
+    Scatter matrices of discriminative spatial patterns (DSP) for N classes
+    Each trial is centered over time, then
+        Sb = mean_k (M_k - M) @ (M_k - M).T
+        Sw = mean_k sum_i (X_ki - M_k) @ (X_ki - M_k).T / (n_trials_k - 1)
+    where M_k is the template of class k and M the grand average.
+
+    Parameters
+    ----------
+    data : (n_events, n_trials, n_chans, n_times) or list of (n_trials_k, n_chans, n_times)
+        input data array, a list allows different numbers of trials per class.
+
+    Returns
+    -------
+    sb : (n_chans, n_chans)
+        between-class scatter matrix (float64).
+    sw : (n_chans, n_chans)
+        within-class scatter matrix (float64).
+    '''
+    if isinstance(data, np.ndarray):
+        data = np.asarray(data, dtype=np.float64)
+        data = data - data.mean(axis=-1, keepdims=True)
+        template = data.mean(axis=1)  # (n_events, n_chans, n_times)
+        resid = data - template[:, NA, ...]
+        sw = np.einsum('ekct,ekdt->cd', resid, resid, optimize=True) / (data.shape[1]-1)
+    else:
+        template, sw = [], 0
+        for class_data in data:  # different numbers of trials
+            class_data = np.asarray(class_data, dtype=np.float64)
+            class_data = class_data - class_data.mean(axis=-1, keepdims=True)
+            template.append(class_data.mean(axis=0))
+            resid = class_data - template[-1]
+            sw = sw + np.einsum('kct,kdt->cd', resid, resid, optimize=True) / (class_data.shape[0]-1)
+        template = np.stack(template)
+    n_events = template.shape[0]
+    diff = template - template.mean(axis=0)
+    sb = np.einsum('ect,edt->cd', diff, diff, optimize=True) / n_events
+    return sb, sw / n_events
+
+def dsp_core(data, n_components=1):
+    '''
+    Shared DSP kernel: solve Sb @ w = lambda * Sw @ w once for all classes
+
+    Parameters
+    ----------
+    data : (n_events, n_trials, n_chans, n_times) or list of (n_trials_k, n_chans, n_times)
+        input data array.
+    n_components : int or None, optional
+        number of eigenvectors kept (descending eigenvalues).
+        The default is 1; None keeps all.
+
+    Returns
+    -------
+    e_va : (n_components,)
+        generalized eigenvalues in descending order.
+    w : (n_components, n_chans)
+        unit-norm eigenvectors.
+    '''
+    sb, sw = dsp_scatter(data)
+    return solve_gep(sb, sw, n_components)
+
+def _dcpm_gram(dataA, dataB):
+    # auto- & cross-covariance of channel-centered 2-D patterns (float64)
+    dataA = np.asarray(dataA, dtype=np.float64)
+    dataB = np.asarray(dataB, dtype=np.float64)
+    dataA = dataA - dataA.mean(axis=-1, keepdims=True)
+    dataB = dataB - dataB.mean(axis=-1, keepdims=True)
+    caa = dataA @ dataA.swapaxes(-1, -2)
+    cbb = dataB @ dataB.swapaxes(-1, -2)
+    cab = dataA @ dataB.swapaxes(-1, -2)
+    return caa, cbb, cab
+
+def _trace(data):
+    return np.trace(data, axis1=-2, axis2=-1)
+
+def _gram_cca(caa, cbb, cab):
+    # CCA from covariance matrices: SVD of La^-1 @ Cab @ Lb^-T (Cholesky factors)
+    la, lb = LA.cholesky(caa), LA.cholesky(cbb)
+    shape = np.broadcast_shapes(la.shape, cab.shape, lb.shape)
+    la, lb = np.broadcast_to(la, shape), np.broadcast_to(lb, shape)
+    M = LA.solve(lb, LA.solve(la, cab).swapaxes(-1, -2)).swapaxes(-1, -2)
+    U, rho, Vh = LA.svd(M)
+    w_a = LA.solve(la.swapaxes(-1, -2), U)
+    w_b = LA.solve(lb.swapaxes(-1, -2), Vh.swapaxes(-1, -2))
+    return np.clip(rho, 0, 1), w_a, w_b
+
+def _filtered_corr(w, caa, cbb, cab):
+    # 2-D correlation of w.T @ A and w.T @ B
+    wt = w.swapaxes(-1, -2)
+    return _trace(wt @ cab @ w) / np.sqrt(_trace(wt @ caa @ w) * _trace(wt @ cbb @ w))
+
 # discrimination index 1: 2D correlation
 def di1(dataA, dataB):
     '''
-    Correlation coefficient of 2D matrices
-    Parameters:
-        dataA & dataB: (n_chans, n_times)
-    Return:
-        coef: float
+    Correlation coefficient of 2D matrices (channels centered)
+
+    Parameters
+    ----------
+    dataA, dataB : (..., n_chans, n_times)
+        patterns, leading axes are broadcast.
+
+    Returns
+    -------
+    coef : (...)
     '''
-    coef = pearson_corr2(dataA, dataB)
-    return coef
+    caa, cbb, cab = _dcpm_gram(dataA, dataB)
+    return _trace(cab) / np.sqrt(_trace(caa) * _trace(cbb))
 
 # discrimination index 2: Euclidean distance
 def di2(dataA, dataB):
     '''
-    Euclidean of 2D matrices
-    Parameters:
-        dataA & dataB: (n_chans, n_times)
-    Return:
-        coef: float
+    Negative Euclidean distance of 2D matrices (channels centered),
+    so that larger values mean more similar patterns like other indices
+
+    Parameters
+    ----------
+    dataA, dataB : (..., n_chans, n_times)
+        patterns, leading axes are broadcast.
+
+    Returns
+    -------
+    coef : (...)
     '''
-    dataA, dataB = dataA.A, dataB.A
-    coef = np.sqrt(np.sum((dataA - dataB)**2))
-    return coef
+    caa, cbb, cab = _dcpm_gram(dataA, dataB)
+    return -np.sqrt(np.maximum(_trace(caa) + _trace(cbb) - 2*_trace(cab), 0))
 
 # discrimination index 3: CCA coefficient
-def di3(dataA, dataB):
+def di3(dataA, dataB, n_cca=1):
     '''
-    Standard CCA coefficient using unified framework
-    Parameters:
-        dataA & dataB: (n_chans, n_times)
-    Return:
-        coef: float
-    '''
-    x = np.mat(np.swapaxes(dataA, 0, 1))       # (n_times, n_chans)
-    y = np.mat(np.swapaxes(dataB, 0, 1))       # (n_times, n_chans)
-    # filter for template: u
-    projectionX = y * (y.T * y).I * y.T        # (n_chans, n_chans)
-    matrixAX = x.T * projectionX * x           # (n_chans, n_chans)
-    matrixBX = x.T * x                         # (n_chans, n_chans)
-    baX = matrixBX.I * matrixAX                # GEPs
-    e_valueX, e_vectorX = np.linalg.eig(baX)
-    u_index = np.max(np.where(e_valueX == np.max(e_valueX)))
-    u = e_vectorX[:, u_index].T                # (1, n_chans)
-    del u_index, projectionX, matrixAX, matrixBX, baX, e_valueX
-    # filter for data: v
-    projectionY = x * (x.T * x).I * x.T        # (n_chans, n_chans)
-    matrixAY = y.T * projectionY * y           # (n_chans, n_chans)
-    matrixBY = y.T * y                         # (n_chans, n_chans)
-    baY = matrixBY.I * matrixAY                # GEPs
-    e_valueY, e_vectorY = np.linalg.eig(baY)
-    v_index = np.max(np.where(e_valueY == np.max(e_valueY)))
-    v = e_vectorY[:, v_index].T                # (1, n_chans)
-    del v_index, projectionY, matrixAY, matrixBY, baY, e_valueY
-    # compute coefficient
-    coef = np.sum(np.tril(np.corrcoef(u*dataA, v*dataB), -1))
-    return coef
-
-# discrimination index 4: 1D correlation & CCA coefficient (template filter)
-def di4(dataA, dataB):
-    pass
+    Mean of the largest canonical correlations
 
-# discrimination index 5: 1D correlation & CCA coefficient (data filter)
-def di5(dataA, dataB):
-    pass
+    Parameters
+    ----------
+    dataA, dataB : (..., n_chans, n_times)
+        patterns, leading axes are broadcast.
+    n_cca : int, optional
+        number of canonical correlations. The default is 1.
+
+    Returns
+    -------
+    coef : (...)
+    '''
+    return _gram_cca(*_dcpm_gram(dataA, dataB))[0][..., :n_cca].mean(axis=-1)
+
+# discrimination index 4: 2D correlation of CCA filtered patterns (template filter)
+def di4(dataA, dataB, n_cca=1):
+    '''
+    Correlation of both patterns filtered by the canonical weights of dataA
+
+    Parameters
+    ----------
+    dataA : (..., n_chans, n_times)
+        template patterns.
+    dataB : (..., n_chans, n_times)
+        test patterns, leading axes are broadcast.
+    n_cca : int, optional
+        number of canonical weights. The default is 1.
+
+    Returns
+    -------
+    coef : (...)
+    '''
+    grams = _dcpm_gram(dataA, dataB)
+    return _filtered_corr(_gram_cca(*grams)[1][..., :n_cca], *grams)
+
+# discrimination index 5: 2D correlation of CCA filtered patterns (data filter)
+def di5(dataA, dataB, n_cca=1):
+    '''
+    Correlation of both patterns filtered by the canonical weights of dataB
+
+    Parameters
+    ----------
+    dataA : (..., n_chans, n_times)
+        template patterns.
+    dataB : (..., n_chans, n_times)
+        test patterns, leading axes are broadcast.
+    n_cca : int, optional
+        number of canonical weights. The default is 1.
+
+    Returns
+    -------
+    coef : (...)
+    '''
+    grams = _dcpm_gram(dataA, dataB)
+    return _filtered_corr(_gram_cca(*grams)[2][..., :n_cca], *grams)
+
+def dcpm_scoring(w, template, test_data, di=['1','2','3','4','5'], n_cca=1):
+    '''
+    Batched DCPM target identification
+    Templates & all test trials are projected with one einsum each, the
+    covariance matrices of every (template, test trial) pair are computed
+    once and shared by all selected indices.
+
+    Parameters
+    ----------
+    w : (n_components, n_chans)
+        DSP spatial filters.
+    template : (n_events, n_chans, n_times)
+        templates of each event.
+    test_data : (n_events, n_tests, n_chans, n_times)
+        test dataset.
+    di : list of str, optional
+        discrimination indices to sum ('1'-'5'). The default is all.
+    n_cca : int, optional
+        number of canonical correlations/weights of indices 3-5. The default is 1.
+
+    Returns
+    -------
+    r : (n_events(template), n_tests, n_events(test))
+        sum of discrimination indices.
+    predict : (n_events, n_tests)
+        predicted label of each test trial.
+    accuracy : float, 0-1
+    '''
+    dtype = get_dtype()
+    w = np.asarray(w, dtype=dtype)
+    temp_template = np.einsum('fc,mct->mft', w, as_compute(template))
+    temp_test = np.einsum('fc,ekct->ekft', w, as_compute(test_data))
+    # (n_events(template), n_events(test), n_tests, ...)
+    grams = _dcpm_gram(temp_template[:, NA, NA, ...], temp_test[NA, ...])
+    caa, cbb, cab = grams
+    rou = 0
+    if '1' in di:  # 2D correlation
+        rou = rou + _trace(cab) / np.sqrt(_trace(caa) * _trace(cbb))
+    if '2' in di:  # Euclidean distance
+        rou = rou - np.sqrt(np.maximum(_trace(caa) + _trace(cbb) - 2*_trace(cab), 0))
+    if '3' in di or '4' in di or '5' in di:
+        rho, w_a, w_b = _gram_cca(*grams)
+        if '3' in di:  # CCA coefficient
+            rou = rou + rho[..., :n_cca].mean(axis=-1)
+        if '4' in di:  # correlation & CCA (template filter)
+            rou = rou + _filtered_corr(w_a[..., :n_cca], *grams)
+        if '5' in di:  # correlation & CCA (data filter)
+            rou = rou + _filtered_corr(w_b[..., :n_cca], *grams)
+    r = np.broadcast_to(rou, cab.shape[:-2]).swapaxes(-1, -2)  # (..., n_events, n_tests, n_events)
+    predict, accuracy = trca_predict(r)
+    return r, predict, accuracy
 
 # DCPM for origin data
-def DCPM(train_data, test_data, di=['1','2','3','4','5']):
+def DCPM(train_data, test_data, di=['1','2','3','4','5'], n_components=1, n_cca=1):
     '''
     Discriminative canonical pattern matching algorithm (DCPM) for origin data
-    Parameters:
-        train_data: (n_events, n_trials, n_chans, n_times) | training dataset
-        test_data: (n_events, n_trials, n_chans, n_times) | test dataset
-        di: discrimination index | 5 different indices, recommended 1 or 2
-    Returns:
-        acc: int | the number of correct identifications
+
+    Parameters
+    ----------
+    train_data : (n_events, n_trials, n_chans, n_times)
+        training dataset.
+    test_data : (n_events, n_trials, n_chans, n_times)
+        test dataset.
+    di : list of str, optional
+        discrimination indices, 5 different indices, recommended 1 or 2.
+        The default is all.
+    n_components : int, optional
+        number of DSP spatial filters. The default is 1.
+    n_cca : int, optional
+        number of canonical correlations/weights of indices 3-5. The default is 1.
+
+    Returns
+    -------
+    accuracy : float, 0-1
     '''
-    # basic information
-    n_events = train_data.shape[0]
-    n_trains = train_data.shape[1]
-    n_tests = test_data.shape[1]
-    # pattern data preparation
-    x1 = np.swapaxes(train_data[0, ...], 0, 2)  # (n_times, n_chans, n_trials)
-    x1 = np.swapaxes(x1, 0, 1)                     # (n_chans, n_times, n_trials)
-    x2 = np.swapaxes(train_data[1, ...], 0, 2)  # (n_times, n_chans, n_trials)
-    x2 = np.swapaxes(x2, 0, 1)                     # (n_chans, n_times, n_trials)
-    pattern1 = np.mat(np.mean(train_data[0, ...], axis=0))  # (n_chans, n_times)
-    pattern2 = np.mat(np.mean(train_data[1, ...], axis=0))  # (n_chans, n_times)
-    # covariance matrices
-    sigma11 = pattern1 * pattern1.T  # (n_chans, n_chans)
-    sigma12 = pattern1 * pattern2.T  # (n_chans, n_chans)
-    sigma21 = pattern2 * pattern1.T  # (n_chans, n_chans)
-    sigma22 = pattern2 * pattern2.T  # (n_chans, n_chans)
-    # variance matrices
-    var1, var2 = np.zeros_like(sigma11), np.zeros_like(sigma22)
-    for i in range(n_trains):
-        var1 += (x1[...,i] - pattern1) * (x1[...,i] - pattern1).T
-        var2 += (x2[...,i] - pattern2) * (x2[...,i] - pattern2).T
-    var1 /= (n_trains - 1)
-    var2 /= (n_trains - 1)
-    # discriminative spatial pattern (DSP) % projection W
-    sb = sigma11 + sigma22 - sigma12 - sigma21    # (n_chans, n_chans)
-    sw = var1 + var2                              # (n_chans, n_chans)
-    e_value, e_vector = np.linalg.eig(sw.I * sb)  # (n_chans, n_chans)
-    #e_index = e_value.argsort()  # rise-up sorting
-    #n_loop, n_per = 0, 0
-    #while n_loop < 9:
-    #    n_per += e_value[e_index[n_loop]]/np.sum(e_value)
-    w_index = np.max(np.where(e_value == np.max(e_value)))
-    w = e_vector[:, w_index].T
-    # apply DSP projection
-    wx1 = w * pattern1             # (1, n_times)
-    wx2 = w * pattern2             # (1, n_times)
+    template = train_data.mean(axis=1)           # (n_events, n_chans, n_times)
+    w = dsp_core(train_data, n_components)[1]    # (n_components, n_chans)
+
     # target identification
-    rou = np.zeros((n_events, n_tests, n_events))
-    for nete in range(n_events):          # n_events in test dataset
-        for nte in range(n_tests):
-            if '1' in di:             # 2D correlation
-                rou[nete, nte, 0] += di1(wx1, w*test_data[nete, nte, :, :])
-                rou[nete, nte, 1] += di1(wx2, w*test_data[nete, nte, :, :])
-            if '2' in di:             # Euclidean distance
-                rou[nete, nte, 0] += di2(wx1, w*test_data[nete, nte, :, :])
-                rou[nete, nte, 1] += di2(wx2, w*test_data[nete, nte, :, :])
-            if '3' in di:             # CCA coefficient
-                rou[nete, nte, 0] += di3(wx1, w*test_data[nete, nte, :, :])
-                rou[nete, nte, 1] += di3(wx2, w*test_data[nete, nte, :, :])
-            if '4' in di:             # Correlation & CCA (template)
-                rou[nete, nte, 0] += di4(wx1, w*test_data[nete, nte, :, :])
-                rou[nete, nte, 1] += di4(wx2, w*test_data[nete, nte, :, :])
-            if '5' in di:             # Correlation & CCA (data)
-                rou[nete, nte, 0] += di5(wx1, w*test_data[nete, nte, :, :])
-                rou[nete, nte, 1] += di5(wx2, w*test_data[nete, nte, :, :])
-        del nte
-    del nete
-    # compute accuracy
-    acc = []
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            if np.max(np.where(rou[nete, nte, :] == np.max(rou[nete, nte, :]))) == nete:
-                acc.append(1)
-    acc = np.sum(acc)/(n_tests*n_events)
-    print('DCPM indentification complete!')
-    return acc
+    r, predict, accuracy = dcpm_scoring(w, template, test_data, di, n_cca)
+
+    return accuracy
 
 # DCPM for SRCA data
-def SRCA_DCPM(train_data, test_data, tar_chans, model_chans, chans,
-              regression='OLS', sp=1140, di=['1','2','3','4','5']):
+def SRCA_DCPM(train_data, test_data, tar_chans, model_chans, chans, regression='OLS',
+              alpha=1.0, l1_ratio=1.0, sp=1140, di=['1','2','3','4','5'], n_components=1,
+              n_cca=1, cache=None):
     '''
     Discriminative canonical pattern matching algorithm (DCPM) for SRCA data
-    Parameters:
-        train_data: (n_events, n_trials, n_chans, n_times) | training dataset
-        test_data: (n_events, n_trials, n_chans, n_times) | test dataset
-        tar_chans: str list | names of target channels
-        model_chans: str list | names of SRCA channels for all target channels
-        chans: str list | names of all channels
-        regression: str | OLS, Ridge, Lasso or ElasticNet regression, default OLS
-        sp: int | start point of mission state (default 1140)
-        di: discrimination index | 5 different indices
-    Returns:
-        acc: int | the number of correct identifications
+
+    Parameters
+    ----------
+    train_data : (n_events, n_trials, n_chans, n_times)
+        training dataset.
+    test_data : (n_events, n_trials, n_chans, n_times)
+        test dataset.
+    tar_chans : list
+        names of target channels.
+    model_chans : list
+        names of SRCA channels for all target channels.
+    chans : list
+        names of all channels.
+    regression : str, optional
+        OLS, Ridge, Lasso or ElasticNet regression. The default is 'OLS'.
+    alpha : float, optional
+        parameters used in Ridge, Lasso and EN regression. The default is 1.0.
+    l1_ratio : float, optional
+        parameters used in EN regression. The default is 1.0.
+    sp : int, optional
+        start point of mission state. The default is 1140.
+    di : list of str, optional
+        discrimination indices. The default is all.
+    n_components : int, optional
+        number of DSP spatial filters. The default is 1.
+    n_cca : int, optional
+        number of canonical correlations/weights of indices 3-5. The default is 1.
+    cache : SRCA_Cache, optional
+        reuse SRCA filtered trials across calls. The default is None.
+
+    Returns
+    -------
+    accuracy : float, 0-1
     '''
-    # config correct SRCA process on training/test dataset
-    n_events = train_data.shape[0]
-    n_trains = train_data.shape[1]
-    n_tests = test_data.shape[1]
-    n_chans = len(tar_chans)
-    n_times = train_data.shape[-1] - sp
-    model_sig = np.zeros((n_events, n_trains, n_chans, n_times))
-    target_sig = np.zeros((n_events, n_tests, n_chans, n_times))
-    for ne in range(n_events):
-        model_sig[ne, :, :, :] = apply_SRCA(train_data[ne, :, :, :], tar_chans,
-                                            model_chans, chans, regression, sp)
-        target_sig[ne, :, :, :] = apply_SRCA(test_data[ne, :, :, :], tar_chans,
-                                             model_chans, chans, regression, sp)
-    del n_chans, n_times
-    # pattern data preparation
-    x1 = np.swapaxes(model_sig[0, :, :, :], 0, 2)  # (n_times, n_chans, n_trials)
-    x1 = np.swapaxes(x1, 0, 1)                     # (n_chans, n_times, n_trials)
-    x2 = np.swapaxes(model_sig[1, :, :, :], 0, 2)  # (n_times, n_chans, n_trials)
-    x2 = np.swapaxes(x2, 0, 1)                     # (n_chans, n_times, n_trials)
-    pattern1 = np.mat(np.mean(model_sig[0, :, :, :], axis=0))  # (n_chans, n_times)
-    pattern2 = np.mat(np.mean(model_sig[1, :, :, :], axis=0))  # (n_chans, n_times)
-    # covariance matrices
-    sigma11 = pattern1 * pattern1.T  # (n_chans, n_chans)
-    sigma12 = pattern1 * pattern2.T  # (n_chans, n_chans)
-    sigma21 = pattern2 * pattern1.T  # (n_chans, n_chans)
-    sigma22 = pattern2 * pattern2.T  # (n_chans, n_chans)
-    # variance matrices
-    var1, var2 = np.zeros_like(sigma11), np.zeros_like(sigma22)
-    for i in range(n_trains):
-        var1 += (x1[:,:,i] - pattern1) * (x1[:,:,i] - pattern1).T
-        var2 += (x2[:,:,i] - pattern2) * (x2[:,:,i] - pattern2).T
-    var1 /= (n_trains - 1)
-    var2 /= (n_trains - 1)
-    # discriminative spatial pattern (DSP) % projection W
-    sb = sigma11 + sigma22 - sigma12 - sigma21    # (n_chans, n_chans)
-    sw = var1 + var2                              # (n_chans, n_chans)
-    e_value, e_vector = np.linalg.eig(sw.I * sb)  # (n_chans, n_chans)
-    w_index = np.max(np.where(e_value == np.max(e_value)))
-    w = e_vector[:, w_index].T
-    # apply DSP projection
-    wx1 = w * pattern1             # (1, n_times)
-    wx2 = w * pattern2             # (1, n_times)
+    # one SRCA model shared by all events (all trials at once)
+    n_events, n_trains, n_tests = train_data.shape[0], train_data.shape[1], test_data.shape[1]
+    plan = SRCA_Plan(tar_chans, model_chans, chans, regression, alpha, l1_ratio, sp)
+    model_sig = _apply_plan(plan, train_data.reshape((n_events*n_trains,) + train_data.shape[2:]),
+                            cache)
+    model_sig = as_compute(model_sig).reshape((n_events, n_trains) + model_sig.shape[1:])
+    target_sig = _apply_plan(plan, test_data.reshape((n_events*n_tests,) + test_data.shape[2:]),
+                             cache)
+    target_sig = as_compute(target_sig).reshape((n_events, n_tests) + target_sig.shape[1:])
+
+    template = model_sig.mean(axis=1)          # (n_events, n_chans, n_times)
+    w = dsp_core(model_sig, n_components)[1]   # (n_components, n_chans)
+
     # target identification
-    rou = np.zeros((n_events, n_tests, n_events))
-    for nete in range(n_events):          # n_events in test dataset
-        for nte in range(n_tests):
-            if '1' in di:             # 2D correlation
-                rou[nete, nte, 0] += di1(wx1, w*target_sig[nete, nte, :, :])
-                rou[nete, nte, 1] += di1(wx2, w*target_sig[nete, nte, :, :])
-            if '2' in di:             # Euclidean distance
-                rou[nete, nte, 0] += di2(wx1, w*target_sig[nete, nte, :, :])
-                rou[nete, nte, 1] += di2(wx2, w*target_sig[nete, nte, :, :])
-            if '3' in di:             # CCA coefficient
-                rou[nete, nte, 0] += di3(wx1, w*target_sig[nete, nte, :, :])
-                rou[nete, nte, 1] += di3(wx2, w*target_sig[nete, nte, :, :])
-            if '4' in di:             # Correlation & CCA (template)
-                rou[nete, nte, 0] += di4(wx1, w*target_sig[nete, nte, :, :])
-                rou[nete, nte, 1] += di4(wx2, w*target_sig[nete, nte, :, :])
-            if '5' in di:             # Correlation & CCA (data)
-                rou[nete, nte, 0] += di5(wx1, w*target_sig[nete, nte, :, :])
-                rou[nete, nte, 1] += di5(wx2, w*target_sig[nete, nte, :, :])
-        del nte
-    del nete
-    # compute accuracy
-    acc = []
-    for nete in range(n_events):
-        for nte in range(n_tests):
-            if np.max(np.where(rou[nete, nte, :] == np.max(rou[nete, nte, :]))) == nete:
-                acc.append(1)
-    print('SRCA DCPM indentification complete!')
-    return acc
+    r, predict, accuracy = dcpm_scoring(w, template, target_sig, di, n_cca)
+
+    return accuracy
 
 
 # %% Correlation detect for single-channel data
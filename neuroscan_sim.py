@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Local Neuroscan-compatible TCP server & acquisition benchmark
+
+1. NeuroscanSimulator: replay EEG data through the CTRL/DATA protocol used by
+    ex_base.Neuroscan (12-byte '>4sHHI' headers, big-endian int32 packages
+    of srate/25 points, 0.0298 uV resolution, label + 65280 in the last row)
+    (1) from_recording: replay a recording saved by Amplifier.use_save_hook
+        (.raw/.events/.json, see ex_base.load_recording)
+    (2) from_mat: replay a continuous .mat, e.g. ex_base.recording_to_mat
+        output with tlim=None
+    (3) synthetic: random EEG with periodic triggers for load tests
+    (4) start & stop: serve one client in background threads
+2. periodic_labels: inject triggers every n points
+3. benchmark: end-to-end samples/s, input queue depth and hook latency
+    through Neuroscan.establish_data_pipeline
+
+Example:
+    python neuroscan_sim.py --srate 4000 --chans 128 --seconds 10
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+import scipy.io as sio
+
+import time
+import socket
+import struct
+import argparse
+import threading
+
+# protocol constants (see ex_base.Neuroscan._COMMANDS & _unpack_data)
+_HEADER = struct.Struct('>4sHHI')
+_RESOLUTION = 0.0298
+_LABEL_OFFSET = 65280
+_START_TRANS = (3, 3)
+_STOP_TRANS = (3, 4)
+_STOP_CONNECT = (1, 2)
+
+# %% Simulator
+def periodic_labels(n_times, period, label=1, offset=0):
+    '''
+    Trigger channel with one label every period points
+
+    Parameters
+    ----------
+    n_times : int
+        length of the trigger channel.
+    period : int
+        points between two triggers.
+    label : int, optional
+        trigger value. The default is 1.
+    offset : int, optional
+        position of the first trigger. The default is 0.
+
+    Returns
+    -------
+    labels : (n_times,)
+    '''
+    labels = np.zeros((n_times), dtype=int)
+    labels[offset::period] = label
+    return labels
+
+class NeuroscanSimulator:
+    '''
+    Neuroscan-compatible TCP server replaying EEG data
+
+    Parameters
+    ----------
+    data : (n_chans, n_times)
+        EEG data (uV), replayed in a loop.
+    srate : int, optional
+        sample rate. The default is 1000.
+    labels : (n_times,), optional
+        trigger channel. The default is None (no trigger).
+    num_chans : int, optional
+        number of channels sent, rows of data are tiled or cropped to fit.
+        The default is None (n_chans of data).
+    address : tuple, optional
+        (host, port) of the server, port 0 picks a free one.
+        The default is ('127.0.0.1', 0).
+    speed : float, optional
+        replay speed relative to srate, None streams as fast as possible.
+        The default is 1.0.
+    '''
+    def __init__(self, data, srate=1000, labels=None, num_chans=None,
+                 address=('127.0.0.1', 0), speed=1.0):
+        data = np.asarray(data, dtype=float)
+        if num_chans is not None:
+            data = data[np.arange(num_chans) % data.shape[0]]
+        self.num_chans, n_times = data.shape
+        if labels is None:
+            labels = np.zeros((n_times))
+        self.srate = srate
+        self.speed = speed
+        self.pkg_points = max(srate//25, 1)
+        # encode once: (n_times, num_chans+1) big-endian int32
+        n_times -= n_times % self.pkg_points
+        encoded = np.empty((n_times, self.num_chans+1), dtype='>i4')
+        encoded[:, :-1] = np.round(data[:, :n_times].T / _RESOLUTION)
+        encoded[:, -1] = np.asarray(labels)[:n_times] + _LABEL_OFFSET
+        self._packages = encoded.reshape(-1, self.pkg_points*(self.num_chans+1))
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self.address = self._server.getsockname()
+        self._client = None
+        self._streaming = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.n_packages = 0
+
+    @classmethod
+    def from_recording(cls, file_name, **kwargs):
+        '''
+        Replay a recording saved by Amplifier.use_save_hook
+
+        Parameters
+        ----------
+        file_name : str
+            recording name (without .raw/.events/.json).
+        **kwargs :
+            other parameters of NeuroscanSimulator, srate defaults to the
+            recording's.
+        '''
+        from ex_base import load_recording
+
+        data, header = load_recording(file_name)
+        data = np.asarray(data).T  # (n_rows, n_points), the last row is the label channel
+        kwargs.setdefault('srate', header['srate'])
+        return cls(data[:-1], labels=data[-1].astype(int), **kwargs)
+
+    @classmethod
+    def from_mat(cls, file_name, key='data', has_label=True, **kwargs):
+        '''
+        Replay a continuous .mat recording, e.g. a save hook recording
+        converted by ex_base.recording_to_mat(file_name, mat_name) (tlim=None)
+
+        Parameters
+        ----------
+        file_name : str
+            .mat file.
+        key : str, optional
+            variable of the data, (n_rows, n_times). The default is 'data'.
+        has_label : bool, optional
+            the last row is the trigger channel. The default is True.
+        **kwargs :
+            other parameters of NeuroscanSimulator.
+        '''
+        data = sio.loadmat(file_name)[key]
+        if has_label:
+            return cls(data[:-1], labels=data[-1].astype(int), **kwargs)
+        return cls(data, **kwargs)
+
+    @classmethod
+    def synthetic(cls, num_chans=64, srate=1000, seconds=10, period=1.0, seed=0, **kwargs):
+        '''
+        Random EEG (50 uV) with a trigger every period seconds
+
+        Parameters
+        ----------
+        num_chans : int, optional
+            number of channels. The default is 64.
+        srate : int, optional
+            sample rate. The default is 1000.
+        seconds : float, optional
+            length of the replayed data. The default is 10.
+        period : float, optional
+            seconds between two triggers. The default is 1.0.
+        seed : int, optional
+            random seed. The default is 0.
+        '''
+        n_times = int(seconds*srate)
+        data = 50*np.random.default_rng(seed).standard_normal((num_chans, n_times))
+        labels = periodic_labels(n_times, int(period*srate))
+        return cls(data, srate=srate, labels=labels, **kwargs)
+
+    def start(self):
+        '''Start serving, returns the server address.'''
+        self._server.listen(1)
+        thread = threading.Thread(target=self._serve, daemon=True, name='neuroscan_sim')
+        thread.start()
+        self._threads.append(thread)
+        return self.address
+
+    def stop(self):
+        '''Stop streaming & close all sockets.'''
+        self._stopped.set()
+        self._streaming.clear()
+        for sock in (self._client, self._server):
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+        for thread in self._threads:
+            thread.join(timeout=1)
+
+    def _serve(self):
+        try:
+            self._client, _ = self._server.accept()
+        except OSError:
+            return
+        self._client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        thread = threading.Thread(target=self._stream, daemon=True, name='neuroscan_sim_stream')
+        thread.start()
+        self._threads.append(thread)
+        while not self._stopped.is_set():
+            try:
+                b_header = self._client.recv(_HEADER.size, socket.MSG_WAITALL)
+            except OSError:
+                break
+            if len(b_header) < _HEADER.size:
+                break
+            ch_id, w_code, w_request, pkg_size = _HEADER.unpack(b_header)
+            if pkg_size:
+                self._client.recv(pkg_size, socket.MSG_WAITALL)
+            if (w_code, w_request) == _START_TRANS:
+                self._streaming.set()
+            elif (w_code, w_request) == _STOP_TRANS:
+                self._streaming.clear()
+            elif (w_code, w_request) == _STOP_CONNECT:
+                break
+        self._streaming.clear()
+        self._stopped.set()
+
+    def _stream(self):
+        header = _HEADER.pack(b'DATA', 2, 1, self._packages.shape[1]*4)
+        period = None if self.speed is None else self.pkg_points / (self.srate*self.speed)
+        n_packages = self._packages.shape[0]
+        while not self._stopped.is_set():
+            if not self._streaming.wait(timeout=0.1):
+                continue
+            start, count = time.perf_counter(), 0
+            while self._streaming.is_set():
+                package = self._packages[self.n_packages % n_packages]
+                try:
+                    self._client.sendall(header + package.tobytes())
+                except OSError:
+                    self._stopped.set()
+                    return
+                self.n_packages += 1
+                count += 1
+                if period is not None:  # pace on the absolute schedule, no drift
+                    delay = start + count*period - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+
+# %% Benchmark
+def benchmark(srate=2000, num_chans=128, seconds=5, speed=1.0, simulator=None,
+              amplifier_class=None, process_type='realtime'):
+    '''
+    Load test of the acquisition stack
+
+    Parameters
+    ----------
+    srate : int, optional
+        sample rate. The default is 2000.
+    num_chans : int, optional
+        number of channels. The default is 128.
+    seconds : float, optional
+        duration of the test. The default is 5.
+    speed : float, optional
+        replay speed, None streams as fast as possible. The default is 1.0.
+    simulator : NeuroscanSimulator, optional
+        server to use. The default is None (synthetic data).
+    amplifier_class : type, optional
+        amplifier under test. The default is None (ex_base.Neuroscan).
+    process_type : str, optional
+        'realtime' (every package) or 'fixed' (1 s windows every 0.5 s).
+        The default is 'realtime'.
+
+    Returns
+    -------
+    report : dict
+        samples_per_s & n_points delivered to the hook, queue_depth (mean & max),
+        packages dropped by the hook's queue and hook latency
+        (p50, p99 & max, seconds from receiving a package to the hook).
+    '''
+    if amplifier_class is None:
+        from ex_base import Neuroscan as amplifier_class
+
+    class TimedAmplifier(amplifier_class):
+        # extras carry the time each package was received
+        def recv(self):
+            r_data, extras = super().recv()
+            return r_data, time.perf_counter()
+
+    if simulator is None:
+        simulator = NeuroscanSimulator.synthetic(num_chans, srate, speed=speed)
+    address = simulator.start()
+    amplifier = TimedAmplifier(address=address, srate=simulator.srate,
+                               num_chans=simulator.num_chans)
+    amplifier.srate = simulator.srate
+
+    records, n_points = [], [0]
+    def handler(eeg_data, extras):
+        if eeg_data.size:
+            records.append(time.perf_counter() - extras)
+            n_points[0] += eeg_data.shape[0]
+
+    data_type = {'process_type':process_type, 'label':None, 'tlim':(1, 0.5)}
+    amplifier.register_hook(name='benchmark', data_type=data_type, handler=handler)
+    amplifier.use_hooks(['benchmark'])
+    input_queue = amplifier._input_queues['benchmark']
+    amplifier.command('connect')
+    amplifier.command('start_transport')
+
+    depth = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        depth.append(input_queue.qsize())
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    stats = amplifier.subscriber_stats()['benchmark']
+    amplifier.send(amplifier._COMMANDS['stop_trans'])
+    amplifier.unuse_hooks(['benchmark'])
+    simulator.stop()
+
+    latency = np.array(records)  # late packages may still reach the hook
+    p50, p99 = np.percentile(latency, [50, 99]) if latency.size else (np.nan, np.nan)
+    return {'srate':simulator.srate, 'num_chans':simulator.num_chans,
+            'samples_per_s':n_points[0]/elapsed, 'n_points':n_points[0],
+            'queue_depth_mean':float(np.mean(depth)), 'queue_depth_max':int(np.max(depth)),
+            'n_dropped':stats['n_dropped'],
+            'latency_p50':p50, 'latency_p99':p99,
+            'latency_max':latency.max() if latency.size else np.nan}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Neuroscan acquisition benchmark')
+    parser.add_argument('--srate', type=int, default=2000)
+    parser.add_argument('--chans', type=int, default=128)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 0 streams as fast as possible')
+    parser.add_argument('--process-type', default='realtime', choices=['realtime', 'fixed'])
+    parser.add_argument('--mat', default=None, help='replay a saved recording')
+    args = parser.parse_args()
+    speed = args.speed or None
+    simulator = None
+    if args.mat is not None:
+        simulator = NeuroscanSimulator.from_mat(args.mat, srate=args.srate,
+                                                num_chans=args.chans, speed=speed)
+    report = benchmark(args.srate, args.chans, args.seconds, speed, simulator,
+                       process_type=args.process_type)
+    for key, value in report.items():
+        print('%s: %s' % (key, value))
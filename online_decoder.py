@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""
+Online target identification on amplifier hooks
+
+1. OnlineDecoder: trained TRCA/eTRCA model (spatial filters, templates and
+    optional SRCA plans) compiled once for single-window decisions
+    (1) train: build the model from a training dataset
+    (2) decide: identify the target of one (n_chans, n_times) window
+    (3) __call__: Amplifier hook handler, epoch mode (each 'fixed'/'label'
+        window is decided) or sliding mode ('realtime' packets are buffered
+        and decided every step points)
+    (4) report: p50/p99 decision latency and budget overruns
+    (5) save & load: pickle the compiled model
+    (6) incremental & update: recalibrate between trials (mcee.IncrementalTRCA)
+2. attach: register & start a decoder on an ex_base.Amplifier
+3. __main__: check that online decisions equal the offline model
+    (mcee.trca_scoring) on the same trials
+
+Example:
+    decoder = OnlineDecoder.train(train_data[..., 1140:2140], ensemble=True,
+                                  picks=tar_chan_index)
+    decisions = attach(amplifier, decoder, data_type={'process_type':'label',
+                                                      'label':1, 'tlim':(0, 1)})
+    label, r, latency = decisions.get()
+    print(decoder.report())
+
+@ author: Brynhildr
+@ email: brynhildrw@gmail.com
+version 1.0
+"""
+
+# %% Import third part module
+import numpy as np
+from numpy import newaxis as NA
+
+import time
+import pickle
+from collections import deque
+
+import mcee
+
+# %% Online decoder
+class OnlineDecoder:
+    '''
+    Compiled TRCA/eTRCA decoder for online situation
+    Filtered templates are normalized once, so each decision costs one
+    projection of the window and one dot product per template.
+
+    Parameters
+    ----------
+    w : (n_events, n_chans)
+        spatial filters.
+    template : (n_events, n_chans, n_times)
+        templates of each event.
+    ensemble : bool, optional
+        eTRCA (all filters) or TRCA (the event's own filter). The default is False.
+    plans : list of SRCA_Plan, optional
+        SRCA model of each event (len n_events). Windows must then contain the
+        rest state, and each plan's output replaces the picked channels.
+        The default is None.
+    picks : list or slice, optional
+        rows of the amplifier samples used as channels. The default is all
+        rows but the last one (label channel).
+    sp : int, optional
+        start point of mission state in each window (without SRCA plans).
+        The default is 0.
+    step : int, optional
+        sliding mode: decide every step points of 'realtime' packets.
+        The default is None (epoch mode).
+    budget : float, optional
+        latency budget of each decision (seconds). The default is 0.05.
+    history : int, optional
+        number of latencies kept for report. The default is 10000.
+    '''
+    def __init__(self, w, template, ensemble=False, plans=None, picks=None, sp=0,
+                 step=None, budget=0.05, history=10000):
+        self.w = np.asarray(w, dtype=float)
+        self.n_events, self.n_chans, self.n_times = template.shape
+        if plans is not None and len(plans) != self.n_events:
+            raise ValueError('One SRCA plan per event is required.')
+        self.ensemble = ensemble
+        self.plans = plans
+        self.picks = slice(None, -1) if picks is None else picks
+        self.sp = sp
+        self.step = step
+        self.budget = budget
+        self.history = history
+        self.model = None
+        self._compile(template)
+        self.reset()
+
+    def _compile(self, template, event=None):
+        # centred & normalized filtered templates (only one event's row if given)
+        if self.ensemble:  # (n_events, n_filters, n_times)
+            temp, axis = np.einsum('fc,ect->eft', self.w, template), (-2, -1)
+        elif event is None:  # (n_events, n_times)
+            temp, axis = np.einsum('ec,ect->et', self.w, template), -1
+        else:
+            temp, axis = self.w[event] @ template[event], -1
+        temp = temp - temp.mean(axis=axis, keepdims=True)
+        temp = temp / np.sqrt(np.sum(temp**2, axis=axis, keepdims=True))
+        if self.ensemble or event is None:
+            self._template = temp
+        else:
+            self._template[event] = temp
+
+    @classmethod
+    def train(cls, train_data, ensemble=False, plans=None, cache=None, **kwargs):
+        '''
+        Build an online decoder from a training dataset
+
+        Parameters
+        ----------
+        train_data : (n_events, n_trials, n_chans, n_times)
+            training dataset (whole trials if plans are given).
+        ensemble : bool, optional
+            eTRCA or TRCA. The default is False.
+        plans : list of SRCA_Plan, optional
+            SRCA model of each event. The default is None.
+        cache : SRCA_Cache, optional
+            reuse SRCA filtered trials. The default is None.
+        **kwargs :
+            other parameters of OnlineDecoder.
+
+        Returns
+        -------
+        decoder : OnlineDecoder
+        '''
+        if plans is not None:
+            train_data = np.stack([mcee._apply_plan(plan, data, cache)
+                                   for plan, data in zip(plans, train_data)])
+        template = train_data.mean(axis=1)
+        w = mcee.TRCA_compute(train_data)
+        return cls(w, template, ensemble, plans, **kwargs)
+
+    @classmethod
+    def incremental(cls, train_data, ensemble=False, plans=None, cache=None, forgetting=1.0,
+                    **kwargs):
+        '''
+        Build an online decoder that can be recalibrated with labelled windows
+        (see update)
+
+        Parameters
+        ----------
+        train_data : (n_events, n_trials, n_chans, n_times)
+            initial training dataset (whole trials if plans are given).
+        ensemble : bool, optional
+            eTRCA or TRCA. The default is False.
+        plans : list of SRCA_Plan, optional
+            SRCA model of each event. The default is None.
+        cache : SRCA_Cache, optional
+            reuse SRCA filtered trials. The default is None.
+        forgetting : float, optional
+            exponential forgetting factor of old trials (0, 1]. The default is 1.
+        **kwargs :
+            other parameters of OnlineDecoder.
+
+        Returns
+        -------
+        decoder : OnlineDecoder
+        '''
+        if plans is not None:
+            train_data = np.stack([mcee._apply_plan(plan, data, cache)
+                                   for plan, data in zip(plans, train_data)])
+        model = mcee.IncrementalTRCA.from_data(train_data, forgetting)
+        decoder = cls(model.w, model.template, ensemble, plans, **kwargs)
+        decoder.model = model
+        return decoder
+
+    def update(self, window, label):
+        '''
+        Recalibrate with one labelled window: running sums of the event are
+        updated and only its spatial filter is solved again
+
+        Parameters
+        ----------
+        window : (n_chans, n_points)
+            picked channels of one window (as decide).
+        label : int
+            index of its event.
+        '''
+        if self.model is None:
+            raise ValueError('Only decoders built by OnlineDecoder.incremental can be updated.')
+        if self.plans is not None:
+            trial = self.plans[label](window[NA, ...])[0, :, :self.n_times]
+        else:
+            trial = window[:, self.sp:self.sp+self.n_times]
+        self.model.update(trial, label)
+        self.w = self.model.w
+        self._compile(self.model.template, label)
+
+    def reset(self):
+        '''Clear the sliding buffer & latency records.'''
+        self._buff = None
+        self._fill = 0
+        self._since = 0
+        self.latency = deque(maxlen=self.history)
+        self.n_overrun = 0
+
+    def _window_length(self):
+        if self.plans is not None:
+            return self.plans[0].sp + self.n_times
+        return self.sp + self.n_times
+
+    def scores(self, window):
+        '''
+        Correlation coefficients of one window with all templates
+
+        Parameters
+        ----------
+        window : (n_chans, n_points)
+            picked channels of one window, n_points >= sp + n_times.
+
+        Returns
+        -------
+        r : (n_events,)
+            correlation coefficients.
+        '''
+        if self.plans is not None:  # test data depend on the template's event
+            data = np.stack([plan(window[NA, ...])[0, :, :self.n_times] for plan in self.plans])
+            if self.ensemble:
+                temp = np.einsum('fc,ect->eft', self.w, data)
+            else:
+                temp = np.einsum('ec,ect->et', self.w, data)
+        else:
+            data = window[:, self.sp:self.sp+self.n_times]
+            if self.ensemble:
+                temp = (self.w @ data)[NA, ...]
+            else:
+                temp = self.w @ data
+        # Pearson correlation, as mcee.trca_scoring
+        axis = (-2, -1) if self.ensemble else -1
+        temp = temp - temp.mean(axis=axis, keepdims=True)
+        return np.sum(temp*self._template, axis=axis) / np.sqrt(np.sum(temp**2, axis=axis))
+
+    def decide(self, window):
+        '''
+        Identify the target of one window
+
+        Parameters
+        ----------
+        window : (n_chans, n_points)
+            picked channels of one window.
+
+        Returns
+        -------
+        label : int
+            index of the identified event.
+        r : (n_events,)
+            correlation coefficients.
+        '''
+        r = self.scores(window)
+        return int(np.argmax(r)), r
+
+    def _record(self, start):
+        latency = time.perf_counter() - start
+        self.latency.append(latency)
+        if latency > self.budget:
+            self.n_overrun += 1
+        return latency
+
+    def __call__(self, eeg_data, extras=None):
+        '''
+        Amplifier hook handler
+
+        Parameters
+        ----------
+        eeg_data : list of samples (n_points, n_rows)
+            window or packet from Amplifier._wrapper_handler.
+        extras : optional
+            extras of the package (unused).
+
+        Returns
+        -------
+        decision : (label, r, latency) or None
+            None when no decision is due (sliding mode).
+        '''
+        start = time.perf_counter()
+        data = np.asarray(eeg_data, dtype=float).T[self.picks]
+        if self.step is None:  # epoch mode
+            label, r = self.decide(data)
+            return label, r, self._record(start)
+
+        # sliding mode: keep the newest window in a fixed buffer
+        length = self._window_length()
+        if self._buff is None:
+            self._buff = np.zeros((data.shape[0], length))
+        n_points = min(data.shape[1], length)
+        self._buff[:, :length-n_points] = self._buff[:, n_points:]
+        self._buff[:, length-n_points:] = data[:, -n_points:]
+        self._fill = min(self._fill + data.shape[1], length)
+        self._since += data.shape[1]
+        if self._fill < length or self._since < self.step:
+            return None
+        self._since = 0
+        label, r = self.decide(self._buff)
+        return label, r, self._record(start)
+
+    def report(self):
+        '''
+        Decision latency statistics
+
+        Returns
+        -------
+        report : dict
+            n_decisions, p50, p99, max (seconds), budget & n_overrun.
+        '''
+        latency = np.asarray(self.latency)
+        if latency.size == 0:
+            p50 = p99 = maximum = np.nan
+        else:
+            p50, p99 = np.percentile(latency, [50, 99])
+            maximum = latency.max()
+        return {'n_decisions':latency.size, 'p50':p50, 'p99':p99, 'max':maximum,
+                'budget':self.budget, 'n_overrun':self.n_overrun}
+
+    def save(self, file_name):
+        with open(file_name, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(file_name):
+        with open(file_name, 'rb') as f:
+            return pickle.load(f)
+
+def attach(amplifier, decoder, name='decoder', data_type=None):
+    '''
+    Register & start a decoder on an amplifier
+
+    Parameters
+    ----------
+    amplifier : ex_base.Amplifier
+        amplifier with an established data pipeline.
+    decoder : OnlineDecoder
+        compiled decoder.
+    name : str, optional
+        name of the hook. The default is 'decoder'.
+    data_type : dict, optional
+        process_type, label & tlim of the hook. The default is None ('realtime').
+
+    Returns
+    -------
+    output_queue : queue.Queue
+        decisions (label, r, latency) of the decoder.
+    '''
+    amplifier.register_hook(name=name, data_type=data_type, handler=decoder)
+    amplifier.use_hooks([name])
+    return amplifier.get_output_queue(name)
+
+if __name__ == '__main__':
+    # consistency check: online decisions equal the offline model (mcee.trca_scoring)
+    rng = np.random.default_rng(0)
+    n_events, n_trials, n_chans, n_times = 4, 6, 9, 500
+    t = np.arange(n_times) / 1000
+    signal = np.stack([np.sin(2*np.pi*(8+ne)*t) for ne in range(n_events)])
+    mixing = rng.standard_normal(n_chans)
+    data = (mixing[NA, NA, :, NA]*signal[:, NA, NA, :]
+            + rng.standard_normal((n_events, n_trials+1, n_chans, n_times))
+            + 5*rng.standard_normal((1, 1, n_chans, 1)))  # DC offset of each channel
+    train_data, test_data = data[:, :n_trials], data[:, n_trials:]
+    for ensemble in (False, True):
+        decoder = OnlineDecoder.train(train_data, ensemble=ensemble)
+        r, predict, accuracy = mcee.trca_scoring(decoder.w, train_data.mean(axis=1), test_data,
+                                                 ensemble)
+        for ne in range(n_events):
+            label, r_online = decoder.decide(test_data[ne, 0])
+            assert np.allclose(r_online, r[:, 0, ne]) and label == predict[ne, 0]
+        print('%s: online == offline, accuracy %.2f' % ('eTRCA' if ensemble else 'TRCA', accuracy))
@@ -11,6 +11,8 @@ import time
 import matplotlib.pyplot as plt
 from matplotlib.gridspec import GridSpec
 import mcee
+import cross_validation as cv
+from functools import partial
 import seaborn as sns
 from math import pi
 
@@ -69,56 +71,40 @@ plt.plot(np.mean(data[0,:,i,:], axis=0))
 plt.plot(np.mean(data[1,:,i,:], axis=0))
 
 #%% (4) check acc
-realAcc, realAcc2, realAcc3, realAcc4 = 0, 0, 0, 0
-for i in range(20):
-    randPick = np.arange(80)
-    np.random.shuffle(randPick)
-    acc1 = mcee.SRCA_TRCA(train_data=testData[:,randPick[:20],:,:],
-                     test_data=testData[:,randPick[20:],:,:], tar_chans=tar_chans,
-                     model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
-    acc1 = np.sum(acc1)/(2*60)
-    realAcc += acc1
-    acc2 = mcee.SRCA_TRCA(train_data=trainData, test_data=testData[:,randPick[20:],:,:], tar_chans=tar_chans,
-                     model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
-    acc2 = np.sum(acc2)/(2*60)
-    realAcc2 += acc2
-    z = testData[:,:,[45,51,52,53,54,55,58,59,60],1140:]
-    x = z[:,randPick[20:],:,:]
-    y = z[:,randPick[:20],:,:]
-    acc3 = mcee.TRCA(trainData[:,:,[45,51,52,53,54,55,58,59,60],1140:], x)
-    acc3 = np.sum(acc3)/(2*60)
-    realAcc3 += acc3
-    acc4 = mcee.TRCA(y,x)
-    acc4 = np.sum(acc4)/(2*60)
-    realAcc4 += acc4
-realAcc /= 20
-realAcc2 /= 20
-realAcc3 /= 20
-realAcc4 /= 20
+srca = dict(tar_chans=tar_chans, model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
+ori_chan = [45,51,52,53,54,55,58,59,60]
+allData = np.concatenate((trainData, testData), axis=1)  # trials 0-39: trainData, 40-119: testData
+datasets = {'test':testData, 'ori_test':testData[:,:,ori_chan,1140:],
+            'all':allData, 'ori_all':allData[:,:,ori_chan,1140:]}
+acc_path = r'D:\SSVEP\realCV\pangjun\SNR\4C 40-70\train_40\loop_4\%s.csv'
+# serial folds (n_jobs=1): the cells of this script are not under a __main__ guard
+
+# train on 20 shuffled test trials, test on the rest
+folds = cv.random_repeats(80, 20, n_repeats=20)
+acc = cv.cross_validate(datasets, folds, [('srca_trca', 'test', partial(mcee.SRCA_TRCA, **srca)),
+                                          ('ori_trca', 'ori_test', mcee.TRCA)],
+                        results=acc_path %('acc_test'))
+realAcc, realAcc4 = acc['srca_trca'].mean(), acc['ori_trca'].mean()
+
+# train on trainData, test on the same shuffled test trials
+folds = [(np.arange(40), 40+test) for train, test in folds]
+acc = cv.cross_validate(datasets, folds, [('srca_trca', 'all', partial(mcee.SRCA_TRCA, **srca)),
+                                          ('ori_trca', 'ori_all', mcee.TRCA)],
+                        results=acc_path %('acc_train'))
+realAcc2, realAcc3 = acc['srca_trca'].mean(), acc['ori_trca'].mean()
 
 #%%
-realAcc5 = 0
-acc = mcee.SRCA_TRCA(train_data=trainData, test_data=trainData, tar_chans=tar_chans,
-                     model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
-acc = np.sum(acc)/(2*20)
-realAcc5 += acc
-
-realAcc6 = 0
-acc = mcee.TRCA(train_data=trainData[:,:,[45,51,52,53,54,55,58,59,60],1140:],
-                test_data=trainData[:,:,[45,51,52,53,54,55,58,59,60],1140:])
-acc = np.sum(acc)/(2*20)
-realAcc6 += acc
+realAcc5 = mcee.SRCA_TRCA(train_data=trainData, test_data=trainData, tar_chans=tar_chans,
+                          model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
+
+realAcc6 = mcee.TRCA(train_data=trainData[:,:,[45,51,52,53,54,55,58,59,60],1140:],
+                     test_data=trainData[:,:,[45,51,52,53,54,55,58,59,60],1140:])
 
 #%%
-realAcc4 = 0
-for i in range(10):
-    randPick = np.arange(80)
-    np.random.shuffle(randPick)
-    acc = mcee.SRCA_TRCA(train_data=trainData, test_data=testData[:,randPick[:40],:,:], tar_chans=tar_chans,
-                     model_chans=modelChans, chans=chans, regression='OLS', sp=1140)
-    acc = np.sum(acc)/(2*40)
-    realAcc4 += acc
-realAcc4 /= 10
+folds = [(np.arange(40), 40+test) for train, test in cv.random_repeats(80, 40, n_repeats=10)]
+acc = cv.cross_validate(datasets, folds, [('srca_trca', 'all', partial(mcee.SRCA_TRCA, **srca))],
+                        results=acc_path %('acc_half'))
+realAcc4 = acc['srca_trca'].mean()
 
 #%% (5) check SNR alteration
 k = 0
@@ -263,7 +249,6 @@ test_data[1,:,:,:] = testData[2,:,:,15:1355]
 
 acc = mcee.SRCA_DCPM(train_data=train_data, test_data=train_data, tar_chans=tar_chans,
         model_chans=modelChans, chans=chans, regression='OLS', sp=1140, di=['1','2'])
-acc = np.sum(acc)/(2*train_data.shape[1])
 
 #%% (5) check acc Ori
 train_data = np.zeros((2,9,40,200))
@@ -276,7 +261,6 @@ test_data[1,:,:,:] = testData[2,:,[45,51,52,53,54,55,58,59,60],1155:1355]
 test_data = np.swapaxes(test_data, 1,2)
 
 acc = mcee.DCPM(train_data=train_data, test_data=train_data, di=['1','2'])
-acc = np.sum(acc)/(2*train_data.shape[1])
 
 #%% (5) check fisher score alteration
 ori_chan = [45,51,52,53,54,55,58,59,60]
@@ -46,6 +46,13 @@ The Unified Framework:
 1. spatial_filter (W): class
     framework 1: (Z.T)*D*P*(P.T)*(D.T)*Z*W = Z.T*D*D.T*Z*W*Lamda
     framework 2: (Z.T)*D*P*(P.T)*(D.T)*Z*W = W*Lamda
+2. register_filter:
+    register the builder of matrices A & B of a filter type
+3. FilterCache:
+    shared projections, matrices & solutions keyed by
+    (dataset fingerprint, filter type, time window)
+4. solve_gep (mcee):
+    GEPs of all events in one batched eigh (Cholesky reduction)
 
 Target identification functions
 1. CCA series (Canonical Correlation Analysis):
@@ -72,14 +79,19 @@ import numpy as np
 from numpy import newaxis as NA
 from numpy import linalg as LA
 from numpy import (sin, cos, pi, sqrt, diagonal)
-from sympy import diag
+from scipy.linalg import block_diag
 from sklearn import linear_model
 
+import hashlib
 from copy import deepcopy
 from time import perf_counter
+from collections import OrderedDict
 import scipy.io as io
 import matplotlib.pyplot as plt
 
+from mcee import (get_dtype, as_compute, solve_gep, sine_reference, dsp_scatter, trca_scoring,
+                  dcpm_scoring)
+
 # %% Prefunctions
 def zero_mean(data):
     """
@@ -262,16 +274,76 @@ def diag_splice(*arg):
         Diagonal mosaic matrix.
 
     """
-    target = 0
-    for data in arg:
-        target = diag(target, data)
-    target.col_del(0).row_del(0)
-    target = np.array(target, dtype=float)
+    target = block_diag(*arg).astype(float)
 
-    return target   
+    return target
 
     
 # %% The Unified Framework
+class FilterCache:
+    """
+    Cache of the unified framework, keyed by (dataset fingerprint, filter type,
+    time window, ...). Three kinds of items are stored:
+        shared projections of the training data (e.g. sum of trials,
+            inter-channel covariance, templates projected on references),
+            reused by every filter type built on the same data
+        matrices A & B of each filter type
+        solutions (eigenvalues & spatial filters) of each number of components
+
+    Parameters
+    ----------
+    max_items : int, optional
+        the largest number of cached items, the least recently used ones are
+        dropped. The default is None (unbounded).
+    """
+    def __init__(self, max_items=None):
+        self.max_items = max_items
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(data):
+        return (data.shape, data.dtype.str,
+                hashlib.blake2b(np.ascontiguousarray(data), digest_size=16).digest())
+
+    def get(self, key, compute):
+        """
+        Cached value of key, computed by compute() on first use.
+        """
+        if key in self.store:
+            self.hits += 1
+            self.store.move_to_end(key)
+            return self.store[key]
+        self.misses += 1
+        value = compute()
+        self.store[key] = value
+        if self.max_items is not None:
+            while len(self.store) > self.max_items:
+                self.store.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+
+_FILTERS = {}
+
+def register_filter(filter_core, filter_types, frame_type='1'):
+    """
+    Register a builder of matrices A & B for (filter_core, filter_type) pairs.
+    The builder is called as builder(sf, key) with a spatial_filter sf and the
+    cache key of the selected data, and returns A (and B for Type I),
+    (n_events or 1, n_chans, n_chans). sf.shared(name, key) gives cached
+    shared projections.
+    """
+    def decorator(builder):
+        for filter_type in filter_types:
+            _FILTERS[(filter_core, filter_type)] = (builder, frame_type)
+        return builder
+    return decorator
+
 class spatial_filter:
     """
     The Unified Framework for constructing spatial filters used in SSVEP signal processing:
@@ -280,9 +352,17 @@ class spatial_filter:
     The data matrix has been preprocessed by time-domain filtering by default, so D = E, i.e.
         Type I : (Z.T)*P*P.T*Z*W = (Z.T)*Z*W*Lambda
         Type II : (Z.T)*P*P.T*Z*W = W*Lambda
+    Z & P of each filter type are never formed: A = (Z.T)*P*P.T*Z and B = (Z.T)*Z
+    are assembled from shared projections of the training data (FilterCache), e.g.
+        TRCA: Z = [X1, ..., XNt], P = Imn(Nt, n_times)/sqrt(Nt)
+            A = (sum Xi)*(sum Xi).T / Nt, B = sum Xi*Xi.T
+        TRCA-R: P = Imn(Nt, n_times)*Q*Q.T/sqrt(Nt), Q: orthonormal sine-cosine reference
+        CCA: Z = mean(Xi), P = Q
+        DSP (DCPM): A = between-class scatter, B = within-class scatter (one filter for all events)
 
     """
-    def __init__(self, train_data, subject=None):
+    def __init__(self, train_data, subject=None, freqs=None, phases=None, n_harmonics=5,
+                 sfreq=1000, cache=None):
         """
 
         Parameters
@@ -292,6 +372,17 @@ class spatial_filter:
         subject : dict, {'name':[num1,num2], ...}
             Dictation to describe the trial subscript of each participant.
             If None, i.e. single subject's data. The default is None.
+        freqs : list of float, optional
+            stimulus frequency of each event (for filters with references).
+        phases : list of float, optional
+            stimulus phase of each event (0-2). The default is None (all 0).
+        n_harmonics : int, optional
+            number of harmonics of references. The default is 5.
+        sfreq : float/int, optional
+            sampling frequency. The default is 1000.
+        cache : FilterCache, optional
+            shared cache, e.g. for many instances on the same data.
+            The default is None (a private cache).
         """
         # basic information
         self.ori_data = train_data
@@ -301,123 +392,200 @@ class spatial_filter:
         self.n_chans = train_data.shape[2]
         self.n_times = train_data.shape[-1]
 
-        if subject is not None:
-            for sub in subject:
-                start_point, end_point = subject[sub][0], subject[sub][1]
-                sub_data = train_data[..., start_point:end_point]
-                exec("self.train_data_%s = sub_data" %sub)
+        self.subject = {} if subject is None else dict(subject)
+        self.freqs = freqs
+        self.phases = [0]*self.n_events if phases is None else phases
+        self.n_harmonics = n_harmonics
+        self.sfreq = sfreq
+        self.cache = FilterCache() if cache is None else cache
+        self.fingerprint = FilterCache.fingerprint(train_data)
+
+    @staticmethod
+    def filter_list():
+        """
+        Registered (filter_core, filter_type) pairs.
+        """
+        return sorted(_FILTERS)
 
-        # check if some attribute exist
-        # if hasattr(self, 'attribute'):
+    def data_key(self, window=None, subject=None):
+        """
+        Cache key of the selected training data
+        window : tuple, (start point, end point) of the time window. None means all.
+        subject : str, name of the participant. None means all trials.
+        """
+        window = (0, self.n_times) if window is None else tuple(int(w) for w in window)
+        return (self.fingerprint, window, subject)
 
+    def select(self, key):
+        """
+        Training data of a cache key, (n_events, n_trials, n_chans, n_times).
+        """
+        fingerprint, window, subject = key
+        data = self.ori_data
+        if subject is not None:
+            start_point, end_point = self.subject[subject][0], self.subject[subject][1]
+            data = data[:, start_point:end_point]
+        return data[..., window[0]:window[1]]
 
-    def framework(self, filter_core=None, filter_type=None, **kwargs):
+    def shared(self, name, key):
+        """
+        Shared projections of the training data, cached. cov (GEP input) is
+        accumulated in float64, the others use the compute dtype (mcee.get_dtype):
+            sum : (n_events, n_chans, n_times), sum of trials
+            cov : (n_events, n_chans, n_chans), sum of Xi*Xi.T
+            template : (n_events, n_chans, n_times), mean of trials
+            reference : (n_events, n_times, 2*n_harmonics), orthonormal references Q
+            sum_ref : (n_events, n_chans, 2*n_harmonics), (sum Xi)*Q
+        """
+        if name in ('reference', 'sum_ref'):
+            if self.freqs is None:
+                raise ValueError('Stimulus frequencies are required by filters with references.')
+            full_key = key + (name, get_dtype().str, tuple(self.freqs), tuple(self.phases),
+                              self.n_harmonics, self.sfreq)
+        elif name == 'cov':
+            full_key = key + (name,)
+        else:
+            full_key = key + (name, get_dtype().str)
+        return self.cache.get(full_key, lambda: self._compute_shared(name, key))
+
+    def _compute_shared(self, name, key):
+        if name == 'sum':
+            return as_compute(self.select(key)).sum(axis=1)
+        if name == 'cov':
+            data = np.asarray(self.select(key), dtype=np.float64)
+            return np.einsum('ekct,ekdt->ecd', data, data, optimize=True)
+        if name == 'template':
+            return self.shared('sum', key) / self.select(key).shape[1]
+        if name == 'reference':
+            start, end = key[1]
+            return np.stack([sine_reference(self.freqs[ne], self.n_harmonics, end-start,
+                                            self.phases[ne], self.sfreq, start).q
+                             for ne in range(self.n_events)])
+        if name == 'sum_ref':
+            return as_compute(self.shared('sum', key) @ self.shared('reference', key))
+        raise ValueError('Unknown shared projection: ' + str(name))
+
+    def framework(self, filter_core=None, filter_type=None, window=None, subject=None, **kwargs):
         """
         Choose different frameworks for different spatial filter schemes.
         Determine the form of the data matrix and projection matrix.
         Parameters
         ----------
         filter_core : str
-            Filter series. Now supported: TRCA, CCA, LDA, DCPM
-        filter_type : list of str
+            Filter series. Now supported: TRCA, CCA, DCPM
+        filter_type : str or list of str
             Specific filter model. Now supported:
-            TRCA : origin, ensemble | reference | split, filter bank
-            CCA : origin, individual template, transform template | extended, multi-set |
-                    split, filter bank, 
-            LDA : origin, stepwise, bayesian, shrinkage, spatial-time
-            DCPM : origin, PCA, 
-        *args : list of str
+            TRCA : origin, ensemble | reference
+            CCA : origin
+            DCPM : origin
+            ('ensemble' only changes target identification)
+        window : tuple, optional
+            (start point, end point) of the time window. The default is None (all).
+        subject : str, optional
+            name of the participant in self.subject. The default is None (all trials).
+        **kwargs :
             Additional parameters according to specific needs
 
         """
-        # initialise
-        self.train_data = train_data
-        self.matrix_A = np.zeros((self.n_events, self.n_chans, self.n_chans))
-        self.matrix_B = np.zeros_like(self.matrix_A)
-        self.template = np.zeros((self.n_events, self.n_chans, self.n_times))
-        self.frame_type = '1'
-
-        if filter_core not in self.core_list:
-            raise Exception('Not supported filter core: ' + filter_core)
-        elif filter_type not in self.filter_list:
-            raise Exception('Not supported spatial filters: ' + filter_type)
-
-        if filter_core == 'TRCA':
-            # detection order: 
-            # (1) whether time domain segmentation is required
-            # (2) whether to include a filter bank
-            # (3) which type: origin, ensemble or reference
-            self.special_design = True
-            if 'reference' in filter_type:
-                pass
-
-            if 'origin' or 'ensemble' in filter_type:
-                # same in filter constructing, different in target identification
-                for ne in range(self.n_events):
-                    temp = self.train_data[ne, ...].swapaxes(0,1).reshape((self.n_chans,-1), order='C')
-                    self.matrix_A[ne, ...] = (temp@temp.T) / (self.n_trains*self.n_times)
-                    for i in range(self.n_trains):
-                        for j in range(self.n_trains):
-                            if i != j:
-                                data_i = self.train_data[ne, i, ...]
-                                data_j = self.train_data[ne, j, ...]
-                                self.matrix_B[ne, ...] += (data_i@data_j.T) / self.n_times
-                self.template = self.train_data.mean(axis=1)
-                if 'ensemble' in filter_type:
-                    self.ensemble = True
-
-
-        elif filter_series == 'CCA':
-            # detection order: 
-            # (1) whether time domain segmentation is required
-            # (2) whether to include a filter bank
-            # (3) which specific type
-
-            pass
-
-
-        elif filter_series == None:
-            pass
-        
-        # deal with unknown options or errors
-        if self.matrix_A == self.matrix_B:  # nothing happened or something wrong
-            raise Exception('Unknown Error while constructing framework, maybe not supported combination?')
+        filter_type = ['origin'] if filter_type is None else filter_type
+        filter_type = [filter_type] if isinstance(filter_type, str) else list(filter_type)
+        # the filter model: e.g. 'reference' takes precedence over 'origin'/'ensemble'
+        model = [ft for ft in filter_type if ft not in ('origin', 'ensemble')]
+        model = model[0] if model else 'origin'
+        if (filter_core, model) not in _FILTERS:
+            raise ValueError('Not supported spatial filter: %s %s' % (filter_core, filter_type))
+
+        self.filter_core = filter_core
+        self.filter_model = model
+        self.ensemble = 'ensemble' in filter_type
+        self.key = self.data_key(window, subject)
+        builder, self.frame_type = _FILTERS[(filter_core, model)]
+        matrices = self.cache.get(self.key + ('matrix', filter_core, model, self.freqs_key(),
+                                              get_dtype().str),
+                                  lambda: builder(self, self.key))
+        self.matrix_A, self.matrix_B = matrices
+        self.template = self.shared('template', self.key)
+        return self
+
+    def freqs_key(self):
+        return (None if self.freqs is None else tuple(self.freqs), tuple(self.phases),
+                self.n_harmonics, self.sfreq)
+
+    def build_filter(self, n_components=1):
+        """
+        Solve Generalized Eigenvalue Problems(GEPS) of all events at once: A*W = B*W*Lambda
 
+        Parameters
+        ----------
+        n_components : int
+            number of eigenvectors kept (descending eigenvalues). The default is 1.
 
-    def build_filter(self):
+        Returns
+        -------
+        w : ndarray, (n_events, n_components, n_chans)
+            spatial filters (shared by all events for DCPM).
         """
-        Solve Generalized Eigenvalue Problems(GEPS): A*W = B*W*Lambda
+        key = self.key + ('solution', self.filter_core, self.filter_model, self.freqs_key(),
+                          get_dtype().str, n_components)
+        self.e_va, self.w = self.cache.get(key, lambda: solve_gep(self.matrix_A, self.matrix_B,
+                                                                  n_components))
+        if self.w.shape[0] != self.n_events:  # one filter for all events
+            self.w = np.broadcast_to(self.w, (self.n_events,) + self.w.shape[1:])
+        return self.w
+
+    def identify(self, test_data, **kwargs):
+        """
+        Target identification with the built filters
+
         Parameters
         ----------
-        data : ndarray, basic units: (n_chans, n_times)
-            matrix Z, 
-        projection : ndarray, basic units: (n_times, n_times)
-            matrix P, orthogonal projector, Hermite matrix.
-        frame_type : int
-            1 or 2. For details, please refer to the corresponding literature.
-
+        test_data : ndarray, (n_events, n_tests, n_chans, n_times)
+            test dataset (same time window as training data).
+        **kwargs :
+            parameters of dcpm_scoring for DCPM (di, n_cca).
+
+        Returns
+        -------
+        r : ndarray, (n_events(template), n_tests, n_events(test))
+            correlation coefficients (discrimination indices for DCPM).
+        predict : ndarray, (n_events, n_tests)
+            predicted label of each test trial.
+        accuracy : float, 0-1
         """
-        # initialization
-        self.w = np.zeros((self.n_events, self.n_chans))
-        # unified framework
-        if self.special_design:
-            matrix_A = self.matrix_A
-            matrix_B = self.matrix_B
-        else:
-            if self.split == True:
-            for ne in range(self.n_events):
-                data = self.combine_data[ne, ...]
-                projection = self.projection[ne, ...]
-                matrix_A[ne, ...] = data.T @ projection @ projection.T @ data
-                if self.frame_type == '1':
-                    matrix_B[ne, ...] = data.T @ data
-                elif self.frame_type == '2':  # B = E
-                    matrix_B[ne, ...] = np.eye(matrix_A.shape[0])
-        # solve Generalized Eigenvalue Problems(GEPS)
-        for ne in range(self.n_events):
-            e_va, e_vec = LA.eig(LA.inv(matrix_A[ne, ...]) @ matrix_B[ne, ...])
-            w_index = np.argmax(e_va)
-            self.w[ne, :] = e_vec[:, w_index].T
+        test_data = as_compute(test_data)
+        if self.filter_core == 'DCPM':
+            return dcpm_scoring(self.w[0], self.template, test_data, **kwargs)
+        if self.ensemble:  # filters of all events
+            return trca_scoring(self.w[:, 0, :], self.template, test_data, ensemble=True)
+        return trca_scoring(self.w[:, 0, :], self.template, test_data)
+
+@register_filter('TRCA', ['origin'])
+def _trca_matrix(sf, key):
+    # A = (sum Xi)*(sum Xi).T / Nt, B = sum Xi*Xi.T
+    data_sum = sf.shared('sum', key).astype(np.float64)
+    n_trials = sf.select(key).shape[1]
+    return data_sum @ data_sum.swapaxes(-1, -2) / n_trials, sf.shared('cov', key)
+
+@register_filter('TRCA', ['reference'])
+def _trca_r_matrix(sf, key):
+    # A = (sum Xi)*Q*Q.T*(sum Xi).T / Nt, B = sum Xi*Xi.T
+    sum_ref = sf.shared('sum_ref', key).astype(np.float64)
+    n_trials = sf.select(key).shape[1]
+    return sum_ref @ sum_ref.swapaxes(-1, -2) / n_trials, sf.shared('cov', key)
+
+@register_filter('CCA', ['origin'])
+def _cca_matrix(sf, key):
+    # template-reference CCA: A = X*Q*Q.T*X.T, B = X*X.T (X: template)
+    n_trials = sf.select(key).shape[1]
+    temp_ref = sf.shared('sum_ref', key).astype(np.float64) / n_trials
+    template = sf.shared('template', key).astype(np.float64)
+    return temp_ref @ temp_ref.swapaxes(-1, -2), template @ template.swapaxes(-1, -2)
+
+@register_filter('DCPM', ['origin'])
+def _dsp_matrix(sf, key):
+    # DSP: A = Sb, B = Sw, one GEP for all events
+    sb, sw = dsp_scatter(sf.select(key))
+    return sb[NA, ...], sw[NA, ...]
 
 
 # %% DCPM Series
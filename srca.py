@@ -58,6 +58,7 @@ Target identification functions (Developer-Special Edition, DSE)
 Main function:
 1. SRCA: class
     container of SRCA data
+    (fit runs the stepwise search of each target channel (& event) in a process pool)
 
 update: 2020/12/10
 
@@ -75,6 +76,12 @@ from time import perf_counter
 import scipy.io as io
 import matplotlib.pyplot as plt
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import mcee
+
 # %% Prefunctions
 def zero_mean(data):
     """
@@ -401,6 +408,71 @@ def srca_process(rest_model, rest_target, task_model, task_target, regression='I
     return extract
 
 
+# process-pool workers
+_SHARED_MEM = _SHARED_X = None
+
+def _attach_shared(name, shape, dtype):
+    """
+    Pool initializer: map the shared trial array once per worker process.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block.
+    shape : tuple
+        Shape of the trial array, (n_trials, n_channels, n_points).
+    dtype : str
+        Data type of the trial array.
+
+    """
+    global _SHARED_X, _SHARED_MEM
+    _SHARED_MEM = shared_memory.SharedMemory(name=name)
+    _SHARED_X = np.ndarray(shape, dtype=dtype, buffer=_SHARED_MEM.buf)
+
+
+def _stepwise_task(task, X=None):
+    """
+    Stepwise SRCA search of one target channel (and one event).
+
+    Parameters
+    ----------
+    task : dict
+        Channel indices, trial indices, time windows & objective of one search.
+        task['event'] is None for inter-class objective ('fisher_score').
+    X : ndarray, shape (n_trials, n_channels, n_points), the default is None.
+        Raw data. When it is None, use the array shared with the pool.
+
+    Returns
+    -------
+    model_chans : list
+        Best fitting channels.
+    para_change : list
+        Alteration of the objective function.
+
+    """
+    if X is None:
+        X = _SHARED_X
+    background = slice(*task['background'])
+    signal = slice(*task['task'])
+    target, candidates = task['target'], task['candidates']
+    if task['event'] is None:  # inter-class: (n_events, n_trials, n_channels, n_points)
+        data = X[np.stack(task['trials'])]
+        mfs = np.mean(mcee.fisher_score(data[..., target, signal]))
+        return mcee.stepwise_SRCA_fs(task['names'], mfs, data[:, :, candidates, background],
+                                     data[..., target, background], data[:, :, candidates, signal],
+                                     data[..., target, signal], task['regression'])
+    # intra-class: (n_trials, n_channels, n_points)
+    data = X[task['trials'][task['event']]]
+    method = {'pearson_corr':'Corr', 'snr':'SNR'}[task['objective']]
+    if method == 'Corr':
+        mpara = np.mean(mcee.pearson_corr(data[:, target, signal]))
+    else:
+        mpara = np.mean(mcee.snr_time(data[:, target, signal]))
+    return mcee.SRCA_train(task['names'], mpara, data[:, candidates, background],
+                           data[:, target, background], data[:, candidates, signal],
+                           data[:, target, signal], method, task['regression'])
+
+
 # main class
 class SRCA:
     """
@@ -408,7 +480,8 @@ class SRCA:
     """
     def __init__(self, sample_rate, target_channel, background_end_time, task_end_time = None,
                  background_begin_time = 0, task_begin_time = None, recursive_form = 'stepwise',
-                 raw_fitting_channels = None, objective_function = 'fisher_score', n_jobs = 1):
+                 raw_fitting_channels = None, objective_function = 'fisher_score', n_jobs = 1,
+                 channel_names = None, regression = 'OLS'):
         """
 
         Parameters
@@ -427,18 +500,25 @@ class SRCA:
         task_begin_time : float, the default is None.
             Task EEG begin time, unit is second.
             When it is None, set it to background EEG end time.
-        recursive_form : string, the options are {'traversal','stepwise'},
+        recursive_form : string, the options are {'stepwise'},
                          the default is 'stepwise'.
             The recursive form for choose channels from raw fitting channals.
         raw_fitting_channels : string list list, the default is None.
             The raw fitting channels, sometimes it is not required.
             But when it was given, the number of string lists must be 
             equal to number of target channel strings.
-        objective_function : string, the options are {'fisher_score','pearson_corr'}, 
+        objective_function : string, the options are {'fisher_score','pearson_corr','snr'}, 
                              the default is 'fisher_score'.
-            The objective function.
+            The objective function. 'fisher_score' trains one model per target channel,
+            the others train one model per target channel & event.
         n_jobs : int, the default is 1.
             Parallel computing, the value is the number of processes.
+            -1 means using all processors.
+        channel_names : string list, the default is None.
+            Names of all channels, the order corresponds to X's channel axis.
+            When it is None, channels are given as integer indices.
+        regression : string, the default is 'OLS'.
+            OLS, Ridge, Lasso or ElasticNet.
 
         Raises
         ------
@@ -468,9 +548,20 @@ class SRCA:
         self.recursive_form = recursive_form
         self.objective_function = objective_function
         self.n_jobs = n_jobs # Multiprocess parameter
-        
+        self.channel_names = channel_names
+        self.regression = regression
+
+    def _channel_index(self, channel):
+        if self.channel_names is None:
+            return int(channel)
+        return self.channel_names.index(channel)
+
     def fit(self,X,y):
         """
+        Each target channel (& event) is an independent stepwise search, so the
+        searches run in a process pool. X is copied once into shared memory and
+        mapped by every worker; results are collected in submission order, so
+        the model does not depend on n_jobs.
 
         Parameters
         ----------
@@ -479,16 +570,81 @@ class SRCA:
         y : ndarray, shape (n_trials)
             Labels.
 
+        Raises
+        ------
+        ValueError
+            Unknown recursive form or objective function, or unequal number of
+            trials per event for 'fisher_score'.
+
         Returns
         -------
-        None.
+        self.
 
         """
-        X = deepcopy(X)
-        y = deepcopy(y)
+        if self.recursive_form != 'stepwise':
+            raise ValueError('Unknown recursive form: ' + str(self.recursive_form))
+        if self.objective_function not in ('fisher_score', 'pearson_corr', 'snr'):
+            raise ValueError('Unknown objective function: ' + str(self.objective_function))
+        X = np.ascontiguousarray(X)
+        y = np.asarray(y)
         n_trials, n_channels, n_points = X.shape
-        self.best_fitting_channels = self.raw_fitting_channels # The best fitting channels combination.
-        pass
+        self.events_ = np.unique(y)
+        trials = [np.flatnonzero(y == event) for event in self.events_]
+        if self.objective_function == 'fisher_score' and len(set(map(len, trials))) != 1:
+            raise ValueError("'fisher_score' needs equal number of trials per event.")
+        names = self.channel_names if self.channel_names else list(range(n_channels))
+
+        # one task per target channel (fisher score) or per target channel & event
+        tasks = []
+        for nt, channel in enumerate(self.target_channel):
+            target = self._channel_index(channel)
+            if self.raw_fitting_channels:
+                candidates = [self._channel_index(c) for c in self.raw_fitting_channels[nt]]
+            else:
+                candidates = [c for c in range(n_channels) if c != target]
+            task = {'target':target, 'candidates':candidates, 'trials':trials,
+                    'names':[names[c] for c in candidates], 'objective':self.objective_function,
+                    'regression':self.regression, 'event':None,
+                    'background':(self.background_begin_point, self.background_end_point),
+                    'task':(self.task_begin_point, self.task_end_point)}
+            if self.objective_function == 'fisher_score':
+                tasks.append(task)
+            else:
+                tasks += [dict(task, event=ne) for ne in range(len(trials))]
+
+        n_jobs = os.cpu_count() if self.n_jobs in (None, -1) else self.n_jobs
+        n_jobs = max(1, min(n_jobs, len(tasks)))
+        if n_jobs == 1:
+            results = [_stepwise_task(task, X) for task in tasks]
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=X.nbytes)
+            try:
+                np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[...] = X
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=_attach_shared,
+                                         initargs=(shm.name, X.shape, X.dtype.str)) as executor:
+                    results = list(executor.map(_stepwise_task, tasks))
+            finally:
+                shm.close()
+                shm.unlink()
+
+        # fisher score: [n_targets]; others: [n_targets][n_events]
+        model_chans = [result[0] for result in results]
+        para_change = [result[1] for result in results]
+        if self.objective_function != 'fisher_score':
+            n_events = len(trials)
+            model_chans = [model_chans[i:i+n_events] for i in range(0, len(tasks), n_events)]
+            para_change = [para_change[i:i+n_events] for i in range(0, len(tasks), n_events)]
+        self.best_fitting_channels = model_chans # The best fitting channels combination.
+        self.para_change = para_change
+        return self
+
+    def _transform_one(self, X, channel, model_chans):
+        target = self._channel_index(channel)
+        model = [self._channel_index(c) for c in model_chans]
+        background = slice(self.background_begin_point, self.background_end_point)
+        signal = slice(self.task_begin_point, self.task_end_point)
+        return mcee.srca(X[:, model, background], X[:, target, background],
+                         X[:, model, signal], X[:, target, signal], self.regression)
 
     def transform(self,X):
         """
@@ -500,11 +656,16 @@ class SRCA:
 
         Returns
         -------
-        Residual_X : ndarray, shape (n_trials, n_best_fitting_channels, n_points)
-            Data after SRCA.
+        Residual_X : ndarray, shape (n_trials, n_target_channels, n_task_points)
+            Data after SRCA. For intra-class objective functions, one model per
+            event is applied: shape (n_events, n_trials, n_target_channels, n_task_points).
 
         """
-        Residual_X = deepcopy(X)
-        return Residual_X
-
-
+        X = np.asarray(X)
+        if self.objective_function == 'fisher_score':
+            return np.stack([self._transform_one(X, channel, model_chans) for channel, model_chans
+                             in zip(self.target_channel, self.best_fitting_channels)], axis=1)
+        n_events = len(self.events_)
+        return np.stack([np.stack([self._transform_one(X, channel, model_chans[ne]) for channel, model_chans
+                                   in zip(self.target_channel, self.best_fitting_channels)], axis=1)
+                         for ne in range(n_events)])
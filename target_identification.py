@@ -9,6 +9,9 @@ Created on Sat Jan 11 15:14:37 2020
 import numpy as np
 import scipy.io as io
 import mcee
+import cross_validation as cv
+from functools import partial
+from itertools import combinations
 import pandas as pd
 import xlrd
 import matplotlib.pyplot as plt
@@ -19,6 +22,7 @@ import copy
 
 # %% TRCA/eTRCA for SRCA/origin data
 tar_chans = ['PZ ','PO5','PO3','POZ','PO4','PO6','O1 ','OZ ','O2 ']
+tar_list = [45,51,52,53,54,55,58,59,60]
 # tar_chans= ['O1 ', 'OZ ', 'O2 ']
 # train_num = [10, 20, 30, 40]
 # train_num = [80]
@@ -26,28 +30,29 @@ tar_chans = ['PZ ','PO5','PO3','POZ','PO4','PO6','O1 ','OZ ','O2 ']
 nameList = ['wanghao', 'wangruiyan', 'wujieyu', 'xiongwentian', 'zhaowei']
 nameList = ['wanghao']
 
-# acc_srca_trca, acc_srca_etrca = np.zeros((len(nameList), 10)), np.zeros((len(nameList), 10))
-# acc_srca_strca, acc_srca_setrca = np.zeros((len(nameList), 5, 5)), np.zeros((len(nameList), 5, 5))
-acc_ori_trca, acc_ori_etrca = np.zeros((len(nameList), 10, 5)), np.zeros((len(nameList), 10, 5))
-# acc_ori_strca, acc_ori_setrca = np.zeros((len(nameList), 5, 5)), np.zeros((len(nameList), 5, 5))
+ori_recognizers = [('ori_trca', 'origin', mcee.TRCA),
+                   ('ori_etrca', 'origin', mcee.eTRCA),
+                   ('ori_strca', 'origin', partial(mcee.split_TRCA, 100, mode='partial')),
+                   ('ori_setrca', 'origin', partial(mcee.split_eTRCA, 100, mode='partial'))]
+acc = {}
 
 for nPeo in range(len(nameList)):
     people = nameList[nPeo]
     eeg = io.loadmat(r'D:\SSVEP\dataset\preprocessed_data\60&80\%s\fir_50_90.mat' %(people))
     f_data = eeg['f_data']
     chans = eeg['chan_info'].tolist()
-    n_events = f_data.shape[0]
     print("Now running " + people + "'s data...")
     del eeg
     for tn in range(len(train_num)):
         ns = train_num[tn]
         print('Training trials: ' + str(ns))
-        for cv in range(10):  # cross-validation in training
-            print('CV: %d turn...' %(cv+1))
-            for nt in range(5): 
+        for loop in range(10):  # cross-validation in training
+            print('CV: %d turn...' %(loop+1))
+            for nt in range(5):
                 print('Data length: %d00ms' %(nt+1))
-                # srcaModel = io.loadmat(r'D:\SSVEP\realCV\60 & 80\%s\OLS\CCA\bp_50_90\train_%d\loop_%d\srca_%d.mat' 
-                #                    %(people, ns, cv, nt))   
+                model_path = r'D:\SSVEP\realCV\60 & 80\%s\OLS\CCA\bp_50_90\train_%d\loop_%d\srca_%d' %(
+                    people, ns, loop, nt)
+                srcaModel = io.loadmat(model_path + '.mat')
 
                 # extract model info used in SRCA
                 modelInfo = srcaModel['modelInfo'].flatten().tolist()
@@ -59,53 +64,27 @@ for nPeo in range(len(nameList)):
                         continue
                 del modelInfo
 
-                # extract trials info used in Cross Validation
+                # each SRCA model was trained on its own fold: keep the stored trials
                 trainTrial = np.mean(srcaModel['trialInfo'], axis=0).astype(int)
                 del srcaModel
-
-                # extract origin data with correct trials & correct length
-                train_data = f_data[:, trainTrial[:ns], :, :1240+nt*100]
-                test_data = f_data[:, trainTrial[-60:], :, :1240+nt*100]
-
-                # target identification main process
-                accTRCA = mcee.SRCA_TRCA(train_data=train_data, test_data=test_data,
-                            tar_chans=tar_chans, model_chans=modelChans, chans=chans)
-                acceTRCA = mcee.SRCA_eTRCA(train_data=train_data, test_data=test_data,
-                            tar_chans=tar_chans, model_chans=modelChans, chans=chans)
-                _, split_accTRCA = mcee.split_SRCA_TRCA(stepwidth=100, train_data=train_data,
-                                test_data=test_data, tar_chans=tar_chans,
-                                model_chans=modelChans, chans=chans, mode='partial')
-                _, split_acceTRCA = mcee.split_SRCA_eTRCA(stepwidth=100, train_data=train_data,
-                                test_data=test_data, tar_chans=tar_chans,
-                                model_chans=modelChans, chans=chans, mode='partial')
-                
-                tr = train_data[:,:,[45,51,52,53,54,55,58,59,60],:]
-                te = test_data[:,:,[45,51,52,53,54,55,58,59,60],:]
-                accOriTRCA = mcee.TRCA(tr[...,1140:], te[...,1140:])
-                accOrieTRCA = mcee.eTRCA(tr[...,1140:], te[...,1140:])
-                _, split_accOriTRCA = mcee.split_TRCA(stepwidth=100, train_data=tr[...,1140:],
-                                                test_data=te[...,1140:], mode='partial')
-                _, split_accOrieTRCA = mcee.split_eTRCA(stepwidth=100, train_data=tr[...,1140:],
-                                                test_data=te[...,1140:], mode='partial')
-
-                # save accuracy data
-                acc_srca_trca[nPeo, cv, nt], acc_srca_etrca[nPeo, cv, nt] = accTRCA, acceTRCA
-                acc_srca_strca[nPeo, cv, nt], acc_srca_setrca[nPeo, cv, nt] = split_accTRCA, split_acceTRCA
-                acc_ori_trca[nPeo, cv, nt], acc_ori_etrca[nPeo, cv, nt] = accOriTRCA, accOrieTRCA
-                acc_ori_strca[nPeo, cv, nt], acc_ori_setrca[nPeo, cv, nt] = split_accOriTRCA, split_accOrieTRCA
-                del accTRCA, acceTRCA
-                del split_accTRCA, split_acceTRCA
-                del accOriTRCA, accOrieTRCA
-                del split_accOriTRCA, split_accOrieTRCA
-            print(str(cv+1) + 'th cross-validation complete!\n')
+                trials = np.concatenate((trainTrial[:ns], trainTrial[-60:]))
+                folds = [(np.arange(ns), np.arange(ns, ns+60))]
+                data = f_data[:, trials, :, :1240+nt*100]
+                datasets = {'origin':data[..., tar_list, 1140:], 'raw':data}
+
+                # one SRCA model per event: SRCA recognizers filter the raw data themselves
+                srca = dict(tar_chans=tar_chans, model_chans=modelChans, chans=chans)
+                recognizers = ori_recognizers + [
+                    ('srca_trca', 'raw', partial(mcee.SRCA_TRCA, **srca)),
+                    ('srca_etrca', 'raw', partial(mcee.SRCA_eTRCA, **srca)),
+                    ('srca_strca', 'raw', partial(mcee.split_SRCA_TRCA, 100, mode='partial', **srca)),
+                    ('srca_setrca', 'raw', partial(mcee.split_SRCA_eTRCA, 100, mode='partial', **srca))]
+                acc[people, ns, loop, nt] = cv.cross_validate(datasets, folds, recognizers,
+                                                              results=model_path + '.csv')
+                del trainTrial, trials, data, datasets
+            print(str(loop+1) + 'th cross-validation complete!\n')
         print(str(ns) + ' training trials complete!\n')
 
-data_path = r'C:\Users\Administrator\Desktop\dec_26.mat'
-io.savemat(data_path, {'ori_trca':acc_ori_trca, 'ori_etrca':acc_ori_etrca,
-                       'ori_strca':acc_ori_strca, 'ori_setrca':acc_ori_setrca,
-                       'srca_trca':acc_srca_trca, 'srca_etrca':acc_srca_etrca,
-                       'srca_strca':acc_srca_strca, 'srca_setrca':acc_srca_setrca})
-
 
 
 # %% only origin data
@@ -120,69 +99,55 @@ freq = [48,52,54,56,58,60]
 nameList = ['wuqiaoyi']
 #nameList = ['dingrumeng','zhangcongyu']
 
-acc_ori_trca = np.zeros((len(nameList), len(freq), 20, 5))
-acc_ori_etrca = np.zeros((len(nameList), len(freq), 20, 5))
-# acc_srca_trca = np.zeros_like(acc_ori_trca)
-# acc_srca_etrca = np.zeros_like(acc_ori_etrca)
+# one dataset per data length (100-500ms)
+recognizers = []
+for nt in range(5):
+    recognizers += [('ori_trca_%d00ms' %(nt+1), '%d00ms' %(nt+1), mcee.TRCA),
+                    ('ori_etrca_%d00ms' %(nt+1), '%d00ms' %(nt+1), mcee.eTRCA)]
+acc = {}
 
 for nPeo in range(len(nameList)):
     people = nameList[nPeo]
     print('Running ' + people + "'s data...")
-    loop = 0
     for fq in freq:
         eeg = io.loadmat(r'D:\SSVEP\dataset\preprocessed_data\xwt_bishe\%s\1-31\f_%d.mat' 
                         %(people, fq))
         #eeg = io.loadmat(r'D:\SSVEP\dataset\preprocessed_data\xwt_bishe\%s\f_%d.mat' 
         #                %(people, fq))
         f_data = eeg['f_data']
-        chans = eeg['chan_info'].tolist()
+        del eeg
         # n_events = 12
         ns = 40
         print('Testing frequency: ' + str(fq) + 'Hz')
-        for cv in range(20):
-            print('CV: %d turn...' %(cv+1))
-            randPick = np.arange(f_data.shape[1])
-            np.random.shuffle(randPick)
-            for nt in range(5): 
-                print('Data length: %d00ms' %(nt+1))
-                sp = 1140
-                ep = 1240 + nt*100
-                train_data = f_data[:,randPick[:ns],:,sp:ep][...,tar_list,:]
-                test_data = f_data[:,randPick[ns:],:,sp:ep][...,tar_list,:]
-                    
-                otrca = mcee.TRCA(train_data, test_data)
-                oetrca = mcee.eTRCA(train_data, test_data)
-
-                acc_ori_trca[nPeo, loop, cv, nt] = otrca
-                acc_ori_etrca[nPeo, loop, cv, nt] = oetrca
-
-                # del ot.rca, oetrca, strca, setrca
-            print(str(cv+1) + 'th cross-validation complete!\n')
-        loop += 1
-print('Frequency ' + str(fq) + ' complete!\n')
-
-acc_ori_trca = acc_ori_trca.mean(axis=-2)
-acc_ori_etrca = acc_ori_etrca.mean(axis=-2)
-
-#%%
-data_path = r'C:\Users\Administrator\Desktop\acc.mat'
-io.savemat(data_path, {'ori_trca':acc_ori_trca,
-                       'ori_etrca':acc_ori_etrca,})
+        sp = 1140
+        datasets = {'%d00ms' %(nt+1):f_data[..., tar_list, sp:1240+nt*100] for nt in range(5)}
+        folds = cv.random_repeats(f_data.shape[1], ns, n_repeats=20)
+        # serial folds (n_jobs=1): the cells of this script are not under a __main__ guard
+        acc[people, fq] = cv.cross_validate(datasets, folds, recognizers,
+            results=r'C:\Users\Administrator\Desktop\acc_%s_%d.csv' %(people, fq))
+        del f_data, datasets
+        print('Frequency ' + str(fq) + ' complete!\n')
 
 #%%
-result = io.loadmat(r'F:\SSVEP\realCV\mengqiangfan\FS\Long CI\Cross 23\dcpm_result.mat')
-ori = result['ori'][0,:,:]
-srca = result['srca'][0,:,:]
+result = pd.concat([pd.read_csv(r'F:\SSVEP\realCV\mengqiangfan\OLS\FS\Long CI\Cross 23\loop_%d\srca_%d.csv'
+                                %(loop, nt)).assign(loop=loop, length=nt)
+                    for loop in range(5) for nt in range(5)])
+ori = result[result['recognizer'] == 'ori_dcpm'].pivot(index='loop', columns='length',
+                                                        values='accuracy').values
+srca = result[result['recognizer'] == 'srca_dcpm'].pivot(index='loop', columns='length',
+                                                          values='accuracy').values
 del result
 
 #%% DCPM for SRCA/origin data (Online Mode)
 tarChans = ['PZ ','PO5','PO3','POZ','PO4','PO6','O1 ','OZ ','O2 ']
+tar_list = [45,51,52,53,54,55,58,59,60]
 trainNum = [80]
 nameList = ['pangjun', 'mengqiangfan', 'chengqian']
 #nameList = ['pangjun']
 
-acc_srca_dcpm = np.zeros((len(nameList), len(trainNum), 5, 5))
-acc_ori_dcpm = np.zeros((len(nameList), len(trainNum), 5, 5))
+recognizers = [('ori_dcpm', 'origin', partial(mcee.DCPM, di=['1','2'])),
+               ('srca_dcpm', 'srca', partial(mcee.DCPM, di=['1','2']))]
+acc = {}
 
 for nPeo in range(len(nameList)):
     people = nameList[nPeo]
@@ -194,12 +159,13 @@ for nPeo in range(len(nameList)):
     for tn in range(len(trainNum)):
         ns = trainNum[tn]
         print('Training trials: ' + str(ns))
-        for cv in range(1):  # cross-validation in training
-            print('CV: %d turn...' %(cv+1))
+        for loop in range(1):  # cross-validation in training
+            print('CV: %d turn...' %(loop+1))
             for nt in range(2):
                 print('Data length: %d00ms' %(nt+1))
-                srcaModel = io.loadmat(r'F:\SSVEP\realCV\%s\SNR\4C 40-70\train_%d\loop_%d\srca_%d.mat' 
-                                   %(people, ns, cv, nt))
+                model_path = r'F:\SSVEP\realCV\%s\SNR\4C 40-70\train_%d\loop_%d\srca_%d' %(
+                    people, ns, loop, nt)
+                srcaModel = io.loadmat(model_path + '.mat')
                 # extract model info used in SRCA
                 modelInfo = srcaModel['modelInfo'].flatten().tolist()
                 modelChans = []
@@ -209,31 +175,24 @@ for nPeo in range(len(nameList)):
                     else:
                         continue
                 del modelInfo
-                # extract trials info used in Cross Validation
+                # each SRCA model was trained on its own fold: keep the stored trials
                 trainTrial = np.mean(srcaModel['trialInfo'], axis=0).astype(int)
                 del srcaModel
-                # extract origin data with correct trials & correct length
-                train_data = f_data[:, trainTrial[:ns], :, :1240+nt*100]
-                test_data = f_data[:, trainTrial[-80:], :, :1240+nt*100]
-                del trainTrial
-                # target identification main process
-                accDCPM = mcee.SRCA_DCPM(train_data=train_data, test_data=test_data,
-                    tar_chans=tarChans, model_chans=modelChans, chans=chans,
-                    regression='OLS', sp=1140, di=['1','2'])
-                accOriDCPM = mcee.DCPM(train_data[:, :, [45,51,52,53,54,55,58,59,60], 1140:],
-                    test_data[:, :, [45,51,52,53,54,55,58,59,60], 1140:], di=['1','2'])
-                # re-arrange accuracy data
-                accDCPM = np.sum(accDCPM)/(test_data.shape[1]*2)
-                accOriDCPM = np.sum(accOriDCPM)/(test_data.shape[1]*2)
-                # save accuracy data
-                acc_srca_dcpm[nPeo, tn, cv, nt] = accDCPM
-                acc_ori_dcpm[nPeo, tn, cv, nt] = accOriDCPM
-                del accDCPM, accOriDCPM
-            print(str(cv+1) + 'th cross-validation complete!\n')
+                trials = np.concatenate((trainTrial[:ns], trainTrial[-80:]))
+                folds = [(np.arange(ns), np.arange(ns, ns+80))]
+                data = f_data[:, trials, :, :1240+nt*100]
+                datasets = {'origin':data[..., tar_list, 1140:],
+                            'srca':cv.srca_dataset(data, tarChans, modelChans, chans,
+                                                   regression='OLS', sp=1140)}
+                acc[people, ns, loop, nt] = cv.cross_validate(datasets, folds, recognizers,
+                                                              results=model_path + '.csv')
+                del trainTrial, trials, data, datasets
+            print(str(loop+1) + 'th cross-validation complete!\n')
         print(str(ns) + ' training trials complete!\n')
 
 #%% DCPM Long CI
 tarChans = ['PZ ','PO5','PO3','POZ','PO4','PO6','O1 ','OZ ','O2 ']
+tar_list = [45,51,52,53,54,55,58,59,60]
 trainNum = [80]
 nameList = ['pangjun','mengqiangfan','chengqian']
 
@@ -241,8 +200,9 @@ items = []
 for i in combinations('0123', r=2):
     items.append(i)
 
-acc_srca_dcpm = np.zeros((len(trainNum), 5, 5))  # (..., cv, n_length)
-acc_ori_dcpm = np.zeros((len(trainNum), 5, 5))
+recognizers = [('ori_dcpm', 'origin', partial(mcee.DCPM, di=['1','2'])),
+               ('srca_dcpm', 'srca', partial(mcee.DCPM, di=['1','2']))]
+acc = {}
 
 for item in items:
     file_num = item[0] + item[1]
@@ -251,48 +211,37 @@ for item in items:
         eeg = eeg = io.loadmat(r'F:\SSVEP\dataset\preprocessed_data\%s\40_70bp.mat' %(people))
         f_data = eeg['f_data'][[eval(item[0]), eval(item[1])], :, :, :]
         chans = eeg['chan_info'].tolist()
-        n_events = f_data.shape[0]
         del eeg
         for tn in range(len(trainNum)):
             ns = trainNum[tn]
             print('Training trials: ' + str(ns))
-            for cv in range(5):  # cross-validation in training
-                print('CV: %d turn...' %(cv+1))
+            for loop in range(5):  # cross-validation in training
+                print('CV: %d turn...' %(loop+1))
                 for nt in range(5):
                     print('Data length: %d00ms' %(nt+1))
-                    srcaModel = io.loadmat(r'F:\SSVEP\realCV\%s\OLS\FS\Long CI\Cross %s\loop_%d\srca_%d.mat' 
-                                   %(people, file_num, cv, nt))
+                    model_path = r'F:\SSVEP\realCV\%s\OLS\FS\Long CI\Cross %s\loop_%d\srca_%d' %(
+                        people, file_num, loop, nt)
+                    srcaModel = io.loadmat(model_path + '.mat')
                     # extract model info used in SRCA
                     modelInfo = srcaModel['modelInfo'].flatten().tolist()
                     modelChans = []
                     for i in range(len(modelInfo)):
                         modelChans.append(modelInfo[i].tolist())
                     del modelInfo
-                    # extract trials info used in Cross Validation
+                    # each SRCA model was trained on its own fold: keep the stored trials
                     trainTrial = np.mean(srcaModel['trialInfo'], axis=0).astype(int)
                     del srcaModel
-                    # extract origin data with correct trials & correct length
-                    trainData = f_data[:, trainTrial[:ns], :, :1240+nt*100]
-                    testData = f_data[:, trainTrial[-60:], :, :1240+nt*100]
-                    del trainTrial
-                    # target identification main process
-                    accDCPM = mcee.SRCA_DCPM(train_data=trainData, test_data=testData,
-                            tar_chans=tarChans, model_chans=modelChans, chans=chans,
-                            regression='OLS', sp=1140, di=['1','2'])
-                    accOriDCPM = mcee.DCPM(trainData[:, :, [45,51,52,53,54,55,58,59,60], 1140:],
-                            testData[:, :, [45,51,52,53,54,55,58,59,60], 1140:], di=['1','2'])
-                    # re-arrange accuracy data
-                    accDCPM = np.sum(accDCPM)/(testData.shape[1]*2)
-                    accOriDCPM = np.sum(accOriDCPM)/(testData.shape[1]*2)
-                    # save accuracy data
-                    acc_srca_dcpm[tn, cv, nt] = accDCPM
-                    acc_ori_dcpm[tn, cv, nt] = accOriDCPM
-                del accDCPM, accOriDCPM
-            print(str(cv+1) + 'th cross-validation complete!\n')
-        print(str(ns) + ' training trials complete!\n')
-        # save data
-        data_path = r'F:\SSVEP\realCV\%s\OLS\FS\Long CI\Cross %s\dcpm_result.mat' %(people, file_num)
-        io.savemat(data_path, {'ori': acc_ori_dcpm, 'srca': acc_srca_dcpm})
+                    trials = np.concatenate((trainTrial[:ns], trainTrial[-60:]))
+                    folds = [(np.arange(ns), np.arange(ns, ns+60))]
+                    data = f_data[:, trials, :, :1240+nt*100]
+                    datasets = {'origin':data[..., tar_list, 1140:],
+                                'srca':cv.srca_dataset(data, tarChans, modelChans, chans,
+                                                       regression='OLS', sp=1140)}
+                    acc[file_num, people, loop, nt] = cv.cross_validate(datasets, folds,
+                        recognizers, results=model_path + '.csv')
+                    del trainTrial, trials, data, datasets
+                print(str(loop+1) + 'th cross-validation complete!\n')
+            print(str(ns) + ' training trials complete!\n')
 
 
 #%% make fs alteration chart
@@ -483,8 +432,6 @@ testData = f_data[:, trainTrial[-80:], :, :1340]
 accDCPM = mcee.SRCA_DCPM(trainData, testData, tarChans, modelChans, chans, di=['1','2'])
 accOriDCPM = mcee.DCPM(trainData[:, :, [45,51,52,53,54,55,58,59,60], 1140:],
                        testData[:, :, [45,51,52,53,54,55,58,59,60], 1140:], di=['1', '2'])
-accDCPM = np.sum(accDCPM)/160
-accOriDCPM = np.sum(accOriDCPM)/160
 #%% [45,51,52,53,54,55,58,59,60]
 # ['PZ ','PO5','PO3','POZ','PO4','PO6','O1 ','OZ ','O2 ']
 srca_te = np.zeros((2,80,9,200))
@@ -69,32 +69,7 @@ def TRCA_compute(data):
         eigenvector refering to the largest eigenvalue.
 
     '''
-    # basic information
-    n_events = data.shape[0]
-    n_trials= data.shape[1]
-    n_chans = data.shape[2]
-    n_times = data.shape[-1]
-
-    # compute spatial filter W 
-    w = np.zeros((n_events, n_chans))
-    for ne in range(n_events):
-        # matrix Q: inter-channel covariance
-        q = np.zeros((n_chans, n_chans))
-        temp_Q = data[ne, ...].swapaxes(0,1).reshape((n_chans,-1), order='C')
-        q = (temp_Q@temp_Q.T) / (n_trials*n_times)
-        # matrix S: inter-channels' inter-trial covariance
-        s = np.zeros_like(q)
-        for nt_i in range(n_trials):
-            for nt_j in range(n_trials):
-                if nt_i != nt_j:
-                    data_i = data[ne, nt_i, ...]
-                    data_j = data[ne, nt_j, ...]
-                    s += (data_i@data_j.T) / n_times
-        # generalized eigenvalue problem
-        e_va, e_vec = LA.eig(LA.inv(q)@s)
-        w_index = np.argmax(e_va)
-        w[ne, :] = e_vec[:, w_index].T
-    return w
+    return mcee.TRCA_compute(data)
 
 # For origin data
 def TRCA(train_data, test_data):